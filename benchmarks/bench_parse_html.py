@@ -0,0 +1,55 @@
+"""Compare pages/sec of the BeautifulSoup and streaming hOCR parsers.
+
+Usage: python benchmarks/bench_parse_html.py [HTML_FILE_OR_DIR ...] [--repeat N]
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+from create_ocr_data.pipeline import parse_html
+
+DEFAULT_INPUT = Path("tests/test_data/work/work_volume_id/ocr/html")
+
+
+def collect_html_files(paths):
+    html_files = []
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            html_files.extend(sorted(path.rglob("*.html")))
+        else:
+            html_files.append(path)
+    return html_files
+
+
+def bench_parser(html_files, parser, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for html_file in html_files:
+            parse_html(html_file, parser=parser)
+    elapsed = time.perf_counter() - start
+    return len(html_files) * repeat / elapsed
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("paths", nargs="*", default=[DEFAULT_INPUT])
+    arg_parser.add_argument("--repeat", type=int, default=200)
+    args = arg_parser.parse_args()
+
+    html_files = collect_html_files(args.paths)
+    for html_file in html_files:
+        if parse_html(html_file, parser="bs4") != parse_html(
+            html_file, parser="stream"
+        ):
+            print(f"Parsers disagree on {html_file}")
+
+    print(f"{len(html_files)} pages x {args.repeat} repeats")
+    for parser in ("bs4", "stream"):
+        pages_per_sec = bench_parser(html_files, parser, args.repeat)
+        print(f"{parser:>6}: {pages_per_sec:10.1f} pages/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""Throughput of every pipeline stage and of process_all_works on a synthetic corpus.
+
+Stages are timed one after the other in this process; the end-to-end run
+uses process_all_works with each of the given process counts. Results can be
+stored as a named baseline and compared against one.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--pages N ...] [--processes 1 2 4]
+        [--save-baseline NAME] [--compare NAME] [--tolerance 0.1]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from synthetic_corpus import add_spec_arguments, generate_corpus, spec_from_args
+
+from create_ocr_data.checkpoints import CHECKPOINT_DB_ENV, close_checkpoint_store
+from create_ocr_data.extract_valid_image import organize_images_and_create_category_csvs
+from create_ocr_data.metadata_sink import close_metadata_sinks
+from create_ocr_data.multi_pipeline import process_all_works
+from create_ocr_data.pipeline import (
+    analyze_ocr_texts,
+    crop_and_save_line_images,
+    find_corresponding_image_path,
+    parse_html,
+    update_csv_files_by_category,
+    work_and_volume_ids,
+)
+
+BASELINE_DIR = Path(__file__).parent / "baselines"
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def bench_stages(html_files, output_dir):
+    """Run every stage over all pages; returns `{stage: (items/sec, unit)}`."""
+    elapsed = dict.fromkeys(
+        ["parse_html", "analyze_ocr_texts", "crop_and_save_line_images", "csv"], 0.0
+    )
+    lines = 0
+    for html_file in html_files:
+        ocr_data, seconds = timed(parse_html, html_file)
+        elapsed["parse_html"] += seconds
+        image_path = find_corresponding_image_path(html_file)
+        work_id, volume_id = work_and_volume_ids(image_path)
+        ocr_data, seconds = timed(
+            crop_and_save_line_images,
+            image_path,
+            ocr_data,
+            output_dir / work_id / "images",
+            volume_id,
+        )
+        elapsed["crop_and_save_line_images"] += seconds
+        ocr_data, seconds = timed(analyze_ocr_texts, ocr_data)
+        elapsed["analyze_ocr_texts"] += seconds
+        csv_file_path = output_dir / work_id / f"{work_id}.csv"
+        _, seconds = timed(
+            update_csv_files_by_category,
+            csv_file_path,
+            ocr_data,
+            work_id,
+            volume_id,
+            image_path.name,
+        )
+        elapsed["csv"] += seconds
+        lines += len(ocr_data)
+
+    rows = 0
+    start = time.perf_counter()
+    for work_dir in sorted(output_dir.iterdir()):
+        csv_file_path = work_dir / f"{work_dir.name}_90-100%.csv"
+        with csv_file_path.open(encoding="utf-8") as csv_file:
+            rows += sum(1 for _ in csv_file) - 1
+        organize_images_and_create_category_csvs(
+            csv_file_path, work_dir, work_dir / "filtered_images"
+        )
+    organize_seconds = time.perf_counter() - start
+
+    return {
+        "parse_html": (len(html_files) / elapsed["parse_html"], "pages/s"),
+        "analyze_ocr_texts": (lines / elapsed["analyze_ocr_texts"], "lines/s"),
+        "crop_and_save_line_images": (
+            lines / elapsed["crop_and_save_line_images"],
+            "lines/s",
+        ),
+        "update_csv_files_by_category": (lines / elapsed["csv"], "lines/s"),
+        "organize_images_and_create_category_csvs": (
+            rows / organize_seconds,
+            "rows/s",
+        ),
+    }
+
+
+def bench_end_to_end(corpus_dir, num_pages, processes, scratch_dir):
+    results = {}
+    for num_processes in processes:
+        run_dir = scratch_dir / f"run-{num_processes}"
+        os.environ[CHECKPOINT_DB_ENV] = str(run_dir / "checkpoints.sqlite3")
+        close_checkpoint_store()
+        start = time.perf_counter()
+        process_all_works(corpus_dir, run_dir / "output", num_processes)
+        seconds = time.perf_counter() - start
+        close_checkpoint_store()
+        results[f"process_all_works[{num_processes}]"] = (
+            num_pages / seconds,
+            "pages/s",
+        )
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print the change against `baseline`; returns the regressed benchmarks."""
+    regressions = []
+    for name, (value, unit) in results.items():
+        if name not in baseline:
+            continue
+        change = value / baseline[name][0] - 1
+        flag = ""
+        if change < -tolerance:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:45} {change:+8.1%} vs baseline{flag}")
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    add_spec_arguments(arg_parser)
+    arg_parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    arg_parser.add_argument("--save-baseline", metavar="NAME")
+    arg_parser.add_argument("--compare", metavar="NAME")
+    arg_parser.add_argument("--tolerance", type=float, default=0.1)
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        scratch_dir = Path(scratch)
+        os.environ[CHECKPOINT_DB_ENV] = str(scratch_dir / "checkpoints.sqlite3")
+        corpus_dir = scratch_dir / "corpus"
+        html_files = generate_corpus(corpus_dir, spec_from_args(args))
+        print(f"{len(html_files)} synthetic pages of {args.lines} lines")
+
+        results = bench_stages(html_files, scratch_dir / "stages")
+        close_metadata_sinks()
+        results.update(
+            bench_end_to_end(corpus_dir, len(html_files), args.processes, scratch_dir)
+        )
+        close_checkpoint_store()
+
+    for name, (value, unit) in results.items():
+        print(f"{name:45} {value:12.1f} {unit}")
+
+    if args.save_baseline:
+        BASELINE_DIR.mkdir(exist_ok=True)
+        baseline_path = BASELINE_DIR / f"{args.save_baseline}.json"
+        baseline_path.write_text(json.dumps(results, indent=2), encoding="utf-8")
+        print(f"Saved baseline {baseline_path}")
+    if args.compare:
+        baseline_path = BASELINE_DIR / f"{args.compare}.json"
+        baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
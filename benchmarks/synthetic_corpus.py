@@ -0,0 +1,226 @@
+"""Generate a deterministic synthetic corpus of works, volumes and hOCR pages.
+
+Every page gets an hOCR file and a page image laid out like the extracted
+data the pipeline reads:
+
+    <root>/<work>/<work>-<volume>/html/<page>.html
+    <root>/<work>/<work>-<volume>/images/<page>.<ext>
+
+The same arguments always produce the same files.
+
+Usage: python benchmarks/synthetic_corpus.py OUTPUT_DIR [--works N] [--pages N] ...
+"""
+
+import argparse
+import random
+from dataclasses import dataclass
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+SYLLABLES = [
+    "བཀྲ",
+    "ཤིས",
+    "བདེ",
+    "ལེགས",
+    "རང",
+    "ཉིད",
+    "ངོ",
+    "སྤྲོད",
+    "བོད",
+    "ཡིག",
+    "རྩོམ",
+    "པ",
+    "པོ",
+    "སངས",
+    "རྒྱས",
+    "ཆོས",
+    "དགེ",
+    "འདུན",
+]
+TIBETAN_DIGITS = "༠༡༢༣༤༥༦༧༨༩"
+LATIN_WORDS = ["Chapter", "Volume", "page", "Tibetan", "Buddhist", "text", "edition"]
+
+# Image formats and the PIL save parameters of their page images.
+IMAGE_FORMATS = {
+    "tif": {"format": "TIFF", "compression": "tiff_lzw"},
+    "png": {"format": "PNG"},
+    "jpg": {"format": "JPEG", "quality": 85},
+}
+
+HOCR_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN" "http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml">
+<head>
+<title>{page_id}.html</title>
+<meta http-equiv='content-type' content='text/html; charset=utf-8'/>
+<meta name='ocr-capabilities' content='ocr_page ocr_par ocrx_word ocr_line' />
+</head>
+<body>
+<div class='ocr_page' title='bbox 0 0 {width} {height};ppageno {page}'>
+{lines}
+</div>
+</body>
+</html>
+"""
+
+
+@dataclass
+class CorpusSpec:
+    """Shape of a synthetic corpus.
+
+    `confidence_weights` are the relative shares of lines in the 0-50%,
+    51-89% and 90-100% bands; `no_confidence` lines have no x_wconf.
+    `mixed_fraction` of the lines have Tibetan digits or mix Tibetan with
+    Latin (these need the botok tokenizer), `latin_fraction` are Latin only.
+    """
+
+    works: int = 2
+    volumes: int = 2
+    pages: int = 20
+    lines: int = 30
+    width: int = 1600
+    height: int = 2400
+    image_format: str = "tif"
+    confidence_weights: tuple = (0.1, 0.2, 0.7)
+    no_confidence: float = 0.02
+    mixed_fraction: float = 0.1
+    latin_fraction: float = 0.05
+    seed: int = 0
+
+
+def line_text(rng, spec):
+    kind = rng.random()
+    if kind < spec.latin_fraction:
+        words = rng.choices(LATIN_WORDS, k=rng.randint(2, 6))
+        return " ".join(words + [str(rng.randint(1, 999))])
+    syllables = rng.choices(SYLLABLES, k=rng.randint(4, 16))
+    text = "་".join(syllables) + "།"
+    if kind < spec.latin_fraction + spec.mixed_fraction:
+        if rng.random() < 0.5:
+            digits = "".join(rng.choices(TIBETAN_DIGITS, k=rng.randint(1, 3)))
+            return f"{digits} {text}"
+        return f"{text} {rng.choice(LATIN_WORDS)}"
+    return text
+
+
+def line_confidence(rng, spec):
+    if rng.random() < spec.no_confidence:
+        return None
+    band = rng.choices(((0, 50), (51, 89), (90, 100)), spec.confidence_weights)[0]
+    return rng.randint(*band)
+
+
+def hocr_line(bbox, text, ocr_conf):
+    title = "bbox {} {} {} {}".format(*bbox)
+    if ocr_conf is not None:
+        title += f";x_wconf {ocr_conf}"
+    words = "".join(
+        f"<span class='ocrx_word' title='{title}'>{word}</span> "
+        for word in text.split(" ")
+    )
+    return f"<span class='ocr_line' title='{title}'>{words.rstrip()}</span>"
+
+
+def write_page(volume_dir, page, volume_id, spec):
+    """Write the hOCR file and page image of one page; returns its hOCR path."""
+    page_id = f"{volume_id}{page:04d}"
+    rng = random.Random(f"{spec.seed}-{volume_dir.name}-{page}")
+    margin = spec.width // 16
+    line_height = max((spec.height - 2 * margin) // max(spec.lines, 1), 4)
+    image = Image.new("L", (spec.width, spec.height), 255)
+    draw = ImageDraw.Draw(image)
+    lines = []
+    for i in range(spec.lines):
+        top = margin + i * line_height
+        right = rng.randint(spec.width // 2, spec.width - margin)
+        bbox = (margin, top, right, top + line_height - 2)
+        # Dark strokes standing in for the glyphs of the line
+        for left in range(margin, right, 24):
+            draw.rectangle(
+                (left, top + 4, left + 16, bbox[3] - 4), fill=rng.randint(0, 80)
+            )
+        lines.append(hocr_line(bbox, line_text(rng, spec), line_confidence(rng, spec)))
+
+    html_path = volume_dir / "html" / f"{page_id}.html"
+    html_path.write_text(
+        HOCR_TEMPLATE.format(
+            page_id=page_id,
+            width=spec.width,
+            height=spec.height,
+            page=page,
+            lines="\n".join(lines),
+        ),
+        encoding="utf-8",
+    )
+    image.save(
+        volume_dir / "images" / f"{page_id}.{spec.image_format}",
+        **IMAGE_FORMATS[spec.image_format],
+    )
+    return html_path
+
+
+def generate_corpus(root, spec=CorpusSpec()):
+    """Write the corpus described by `spec` under `root`; returns its hOCR paths."""
+    root = Path(root)
+    html_files = []
+    for work in range(1, spec.works + 1):
+        work_id = f"W{work}"
+        for volume in range(1, spec.volumes + 1):
+            volume_id = f"I{volume}"
+            volume_dir = root / work_id / f"{work_id}-{volume_id}"
+            (volume_dir / "html").mkdir(parents=True, exist_ok=True)
+            (volume_dir / "images").mkdir(parents=True, exist_ok=True)
+            for page in range(1, spec.pages + 1):
+                html_files.append(write_page(volume_dir, page, volume_id, spec))
+    return html_files
+
+
+def add_spec_arguments(arg_parser):
+    defaults = CorpusSpec()
+    for name in ("works", "volumes", "pages", "lines", "width", "height", "seed"):
+        arg_parser.add_argument(f"--{name}", type=int, default=getattr(defaults, name))
+    for name in ("no_confidence", "mixed_fraction", "latin_fraction"):
+        arg_parser.add_argument(
+            f"--{name.replace('_', '-')}", type=float, default=getattr(defaults, name)
+        )
+    arg_parser.add_argument(
+        "--confidence-weights",
+        type=float,
+        nargs=3,
+        default=defaults.confidence_weights,
+        metavar=("LOW", "MID", "HIGH"),
+    )
+    arg_parser.add_argument(
+        "--image-format", choices=sorted(IMAGE_FORMATS), default=defaults.image_format
+    )
+
+
+def spec_from_args(args):
+    return CorpusSpec(
+        works=args.works,
+        volumes=args.volumes,
+        pages=args.pages,
+        lines=args.lines,
+        width=args.width,
+        height=args.height,
+        image_format=args.image_format,
+        confidence_weights=tuple(args.confidence_weights),
+        no_confidence=args.no_confidence,
+        mixed_fraction=args.mixed_fraction,
+        latin_fraction=args.latin_fraction,
+        seed=args.seed,
+    )
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("output_dir", type=Path)
+    add_spec_arguments(arg_parser)
+    args = arg_parser.parse_args()
+    html_files = generate_corpus(args.output_dir, spec_from_args(args))
+    print(f"Wrote {len(html_files)} pages to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,375 @@
-from pathlib import Path
+import atexit
+import os
+import sqlite3
+import time
+from pathlib import Path, PurePosixPath
+from typing import Callable, List, Optional, Tuple
+
+"""checkpoint store
+
+Checkpoints and corrupted files are kept in a SQLite database in WAL mode so
+lookups are indexed and several worker processes can write concurrently.
+Besides the log of corrupted files, the `failures` table keeps one row per
+failed input with the stage it failed in, the exception type and how many
+times it failed, which retry.py uses to retry just those inputs.
+The database lives at CREATE_OCR_DATA_CHECKPOINT_DB, or under the user's home
+directory by default, so it no longer depends on the working directory.
+"""
+
+CHECKPOINT_DB_ENV = "CREATE_OCR_DATA_CHECKPOINT_DB"
+DEFAULT_CHECKPOINT_DB = Path.home() / ".create_ocr_data" / "checkpoints.sqlite3"
+
+# Checkpoints are committed in batches of this size; call flush_checkpoints()
+# at the end of a unit of work to commit the remainder.
+COMMIT_BATCH_SIZE = 100
+
+_connection: Optional[sqlite3.Connection] = None
+_connection_key: Optional[Tuple[int, Path]] = None
+_pending_checkpoints: List[str] = []
+_pending_page_digests: List[Tuple[str, str, str]] = []
+_before_commit_hooks: List[Callable[[], None]] = []
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    key TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS page_digests (
+    page TEXT PRIMARY KEY,
+    work TEXT NOT NULL,
+    digest TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS page_digests_work ON page_digests (work);
+CREATE TABLE IF NOT EXISTS line_index (
+    id INTEGER PRIMARY KEY,
+    text_hash TEXT NOT NULL,
+    image_hash TEXT NOT NULL,
+    work TEXT NOT NULL,
+    line TEXT NOT NULL,
+    page TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS line_index_text ON line_index (text_hash);
+CREATE INDEX IF NOT EXISTS line_index_page ON line_index (work, page);
+CREATE TABLE IF NOT EXISTS corrupted_files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    error TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS failures (
+    path TEXT PRIMARY KEY,
+    stage TEXT NOT NULL,
+    error_type TEXT NOT NULL,
+    error TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    first_failed_at REAL NOT NULL,
+    last_failed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS failures_stage ON failures (stage);
+"""
+
+
+def checkpoint_db_path() -> Path:
+    return Path(os.environ.get(CHECKPOINT_DB_ENV, DEFAULT_CHECKPOINT_DB)).resolve()
+
+
+def get_connection() -> sqlite3.Connection:
+    """Return this process's connection, reopening it after a fork or path change."""
+    global _connection, _connection_key
+    db_path = checkpoint_db_path()
+    key = (os.getpid(), db_path)
+    if _connection is None or _connection_key != key:
+        _pending_checkpoints.clear()
+        _pending_page_digests.clear()
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        _connection = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute("PRAGMA synchronous=NORMAL")
+        _connection.executescript(SCHEMA)
+        _connection_key = key
+    return _connection
+
+
+def close_checkpoint_store() -> None:
+    global _connection, _connection_key
+    if _connection is None or _connection_key is None:
+        return
+    if _connection_key[0] == os.getpid():
+        flush_checkpoints()
+        _connection.close()
+    _connection = None
+    _connection_key = None
+
+
+atexit.register(close_checkpoint_store)
+
 
 """checkpoint system"""
-CORRUPTED_FILES = Path("corrupted_file.txt")
-if not CORRUPTED_FILES.exists():
-    CORRUPTED_FILES.touch()
 
 
-def save_corrupted_files(file_path: Path, error: str) -> None:
-    with open(CORRUPTED_FILES, "a") as f:
-        f.write(f"{file_path}-{error}\n")
+def save_corrupted_files(file_path: Path, error, stage="page", error_type=None):
+    """Log a failed input and count the failure in the `failures` table.
+
+    `error` is an exception or a message; `error_type` defaults to the
+    exception's class name.
+    """
+    if error_type is None:
+        error_type = type(error).__name__ if isinstance(error, Exception) else "Error"
+    now = time.time()
+    connection = get_connection()
+    connection.execute(
+        "INSERT INTO corrupted_files (path, error, created_at) VALUES (?, ?, ?)",
+        (str(file_path), str(error), now),
+    )
+    connection.execute(
+        "INSERT INTO failures VALUES (?, ?, ?, ?, 1, ?, ?) ON CONFLICT (path) DO "
+        "UPDATE SET stage = excluded.stage, error_type = excluded.error_type, "
+        "error = excluded.error, attempts = attempts + 1, "
+        "last_failed_at = excluded.last_failed_at",
+        (str(file_path), stage, error_type, str(error), now, now),
+    )
+
+
+def load_failures(stages=None):
+    """Return the `failures` rows as dicts, oldest first, optionally of `stages`."""
+    connection = get_connection()
+    connection.row_factory = sqlite3.Row
+    try:
+        rows = connection.execute(
+            "SELECT * FROM failures ORDER BY first_failed_at, path"
+        ).fetchall()
+    finally:
+        connection.row_factory = None
+    return [dict(row) for row in rows if stages is None or row["stage"] in stages]
+
+
+def resolve_failures(paths) -> None:
+    """Forget the failures of `paths`, e.g. once they were retried successfully."""
+    connection = get_connection()
+    connection.execute("BEGIN IMMEDIATE")
+    connection.executemany(
+        "DELETE FROM failures WHERE path = ?", [(str(path),) for path in paths]
+    )
+    connection.execute("COMMIT")
+
+
+def load_corrupted_files():
+    rows = get_connection().execute(
+        "SELECT path, error FROM corrupted_files ORDER BY id"
+    )
+    return rows.fetchall()
 
 
 """check point system"""
 
-CONVERT_CHECKPOINT = Path("checkpoint.txt")
+
+class Checkpoints:
+    """Read-only view of the checkpoint table supporting `key in checkpoints`."""
+
+    def __contains__(self, key) -> bool:
+        key = str(key)
+        if key in _pending_checkpoints:
+            return True
+        row = (
+            get_connection()
+            .execute("SELECT 1 FROM checkpoints WHERE key = ?", (key,))
+            .fetchone()
+        )
+        return row is not None
+
+    def __iter__(self):
+        rows = get_connection().execute("SELECT key FROM checkpoints")
+        for (key,) in rows:
+            yield key
+        yield from list(_pending_checkpoints)
+
+    def __len__(self) -> int:
+        (count,) = (
+            get_connection().execute("SELECT COUNT(*) FROM checkpoints").fetchone()
+        )
+        return count + len(_pending_checkpoints)
+
+
+def load_checkpoints() -> Checkpoints:
+    get_connection()
+    return Checkpoints()
+
+
+def save_checkpoint(file_checkpoint):
+    get_connection()
+    _pending_checkpoints.append(str(file_checkpoint))
+    if len(_pending_checkpoints) >= COMMIT_BATCH_SIZE:
+        flush_checkpoints()
+
+
+def save_page_digest(page, work, digest):
+    """Record the content digest a page was processed with (incremental mode)."""
+    get_connection()
+    _pending_page_digests.append((page, work, digest))
+    if len(_pending_page_digests) >= COMMIT_BATCH_SIZE:
+        flush_checkpoints()
+
+
+def load_page_digests(work) -> dict:
+    """Return `{page: digest}` of the processed pages of `work`."""
+    rows = get_connection().execute(
+        "SELECT page, digest FROM page_digests WHERE work = ?", (work,)
+    )
+    return dict(rows.fetchall())
+
+
+def load_digested_works() -> set:
+    """Return the works that have processed pages recorded by digest."""
+    rows = get_connection().execute("SELECT DISTINCT work FROM page_digests")
+    return {work for (work,) in rows.fetchall()}
+
+
+def delete_page_digests(pages) -> None:
+    connection = get_connection()
+    connection.execute("BEGIN IMMEDIATE")
+    connection.executemany(
+        "DELETE FROM page_digests WHERE page = ?", [(page,) for page in pages]
+    )
+    connection.execute("COMMIT")
+
+
+def claim_lines(entries, same_image) -> list:
+    """Look `(text_hash, image_hash, work, line, page)` entries up in the dedup index.
+
+    An entry repeats the first indexed line of another `(work, line)` with
+    the same text hash whose image hash `same_image(image_hash, other)`
+    accepts; entries that repeat nothing are indexed. Returns the
+    `(work, line)` each entry repeats, or None, in one transaction so
+    concurrent workers agree on which line came first.
+    """
+    connection = get_connection()
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        owners: List[Optional[Tuple[str, str]]] = []
+        for text_hash, image_hash, work, line, page in entries:
+            candidates = connection.execute(
+                "SELECT image_hash, work, line FROM line_index WHERE text_hash = ? "
+                "ORDER BY id",
+                (text_hash,),
+            ).fetchall()
+            if any(candidate[1:] == (work, line) for candidate in candidates):
+                owners.append(None)  # Indexed by an earlier run of this page
+                continue
+            owner = next(
+                (
+                    (other_work, other_line)
+                    for other_hash, other_work, other_line in candidates
+                    if same_image(image_hash, other_hash)
+                ),
+                None,
+            )
+            if owner is None:
+                connection.execute(
+                    "INSERT INTO line_index (text_hash, image_hash, work, line, page) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (text_hash, image_hash, work, line, page),
+                )
+            owners.append(owner)
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+    connection.execute("COMMIT")
+    return owners
+
+
+def delete_line_hashes(work, pages) -> None:
+    """Forget the dedup index entries of a work's `pages` (image page ids)."""
+    connection = get_connection()
+    connection.execute("BEGIN IMMEDIATE")
+    connection.executemany(
+        "DELETE FROM line_index WHERE work = ? AND page = ?",
+        [(work, page) for page in pages],
+    )
+    connection.execute("COMMIT")
+
+
+def forget_work(work) -> None:
+    """Forget the page digests and dedup index entries of `work`."""
+    connection = get_connection()
+    connection.execute("BEGIN IMMEDIATE")
+    connection.execute("DELETE FROM page_digests WHERE work = ?", (work,))
+    connection.execute("DELETE FROM line_index WHERE work = ?", (work,))
+    connection.execute("COMMIT")
+
+
+def register_before_commit(hook) -> None:
+    """Call `hook()` before checkpoints are committed, e.g. to flush buffered output."""
+    _before_commit_hooks.append(hook)
+
+
+def flush_checkpoints() -> None:
+    """Commit the checkpoints buffered by this process in one transaction."""
+    if not _pending_checkpoints and not _pending_page_digests:
+        return
+    for hook in _before_commit_hooks:
+        hook()
+    connection = get_connection()
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        connection.executemany(
+            "INSERT OR IGNORE INTO checkpoints (key) VALUES (?)",
+            [(key,) for key in _pending_checkpoints],
+        )
+        connection.executemany(
+            "INSERT OR REPLACE INTO page_digests (page, work, digest) VALUES (?, ?, ?)",
+            _pending_page_digests,
+        )
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+    connection.execute("COMMIT")
+    _pending_checkpoints.clear()
+    _pending_page_digests.clear()
+
+
+def split_legacy_corrupted_line(line: str):
+    """Split a legacy `path-error` line at the first "-" after the path.
+
+    The path ends at the first "-" after its last "/", except in a
+    `<work>/<work>-<volume>` volume directory, where it ends after the volume.
+    """
+    path_part = line.split(" ", 1)[0]
+    start = path_part.rfind("/") + 1
+    parent = PurePosixPath(path_part[:start]).name
+    if parent and line.startswith(f"{parent}-", start):
+        start += len(parent) + 1
+    dash = line.find("-", start)
+    if dash == -1:
+        return line, ""
+    return line[:dash], line[dash + 1 :]
 
 
-def load_checkpoints():
-    if CONVERT_CHECKPOINT.exists():
-        return CONVERT_CHECKPOINT.read_text().splitlines()
+def import_legacy_files(
+    checkpoint_file=Path("checkpoint.txt"), corrupted_file=Path("corrupted_file.txt")
+):
+    """One-time import of the old checkpoint.txt and corrupted_file.txt files.
 
-    CONVERT_CHECKPOINT.touch()
-    return []
+    Imported files are renamed to `<name>.imported`, so running it again
+    does not log their corrupted files twice.
+    """
+    checkpoint_file, corrupted_file = Path(checkpoint_file), Path(corrupted_file)
+    if checkpoint_file.exists():
+        for key in checkpoint_file.read_text(encoding="utf-8").splitlines():
+            if key:
+                save_checkpoint(key)
+        flush_checkpoints()
+        checkpoint_file.rename(
+            checkpoint_file.with_name(f"{checkpoint_file.name}.imported")
+        )
+    if corrupted_file.exists():
+        for line in corrupted_file.read_text(encoding="utf-8").splitlines():
+            if line:
+                path, error = split_legacy_corrupted_line(line)
+                save_corrupted_files(path, error, stage="legacy")
+        corrupted_file.rename(
+            corrupted_file.with_name(f"{corrupted_file.name}.imported")
+        )
 
 
-def save_checkpoint(file_checkpoint: Path):
-    with open(CONVERT_CHECKPOINT, "a") as f:
-        f.write(f"{str(file_checkpoint)}\n")
+if __name__ == "__main__":
+    import_legacy_files()
+    print(f"Imported legacy checkpoints into {checkpoint_db_path()}")
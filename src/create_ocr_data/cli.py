@@ -0,0 +1,322 @@
+import argparse
+from pathlib import Path
+
+from create_ocr_data.checkpoints import load_checkpoints
+from create_ocr_data.config import (
+    DEDUP_MODES,
+    HTML_PARSERS,
+    IMAGE_CODECS,
+    OUTPUT_MODES,
+    LineFilter,
+    PipelineConfig,
+)
+from create_ocr_data.multi_pipeline import MAX_PAGES_PER_TASK, process_all_works
+from create_ocr_data.retry import (
+    DEFAULT_BACKOFF_SECONDS,
+    DEFAULT_MAX_ATTEMPTS,
+    DEFAULT_MAX_BACKOFF_SECONDS,
+    retry_failed,
+)
+from create_ocr_data.sharding import (
+    ZIP_BYTES_PER_PAGE,
+    merge_shards,
+    shard_weights,
+    work_id_of,
+    write_summary,
+)
+from create_ocr_data.streaming import (
+    CHECKPOINT_PREFIX,
+    StreamLimits,
+    local_zip_files,
+    run_pipeline,
+)
+from create_ocr_data.zip_download import (
+    DEFAULT_CHUNK_SIZE,
+    authenticate_google_drive,
+    list_zip_files,
+    load_credentials,
+    thread_local_downloader,
+)
+
+"""command line interface
+
+`create-ocr-data run DATA_DIR` runs the whole corpus pipeline (see
+streaming.py) with its folders under DATA_DIR: `work_zip/` for downloaded
+ZIPs, `extracted_data/`, `output_data/` and `outputs_new/` for the packaged
+archives. Work ZIPs come from a Drive folder (`--folder-id`) or from a
+local folder (`--zip-dir`), whose ZIPs are never deleted.
+
+`process` runs only the processing stage over a folder of works, and
+`merge` combines the outputs of nodes run with `--shard-index` and
+`--shard-count` (see sharding.py). `retry-failed` reprocesses just the
+pages that failed in earlier runs (see retry.py).
+"""
+
+
+def add_config_arguments(arg_parser):
+    defaults = PipelineConfig()
+    arg_parser.add_argument(
+        "--output-mode", choices=OUTPUT_MODES, default=defaults.output_mode
+    )
+    arg_parser.add_argument(
+        "--image-codec", choices=sorted(IMAGE_CODECS), default=defaults.image_codec
+    )
+    for name in ("grayscale", "single_pass", "parquet_metadata", "incremental"):
+        arg_parser.add_argument(f"--{name.replace('_', '-')}", action="store_true")
+    arg_parser.add_argument(
+        "--encoder-threads", type=int, default=defaults.encoder_threads
+    )
+    arg_parser.add_argument(
+        "--pipeline-depth", type=int, default=defaults.pipeline_depth
+    )
+    arg_parser.add_argument("--metrics-dir")
+    arg_parser.add_argument("--memory-budget-mb", type=int, default=0)
+    arg_parser.add_argument("--max-tasks-per-child", type=int)
+    arg_parser.add_argument("--dedup", choices=DEDUP_MODES)
+    arg_parser.add_argument(
+        "--dedup-max-distance", type=int, default=defaults.dedup_max_distance
+    )
+    arg_parser.add_argument(
+        "--html-parser", choices=HTML_PARSERS, default=defaults.html_parser
+    )
+    arg_parser.add_argument(
+        "--filter-lines",
+        action="store_true",
+        help="drop lines outside the default LineFilter before cropping them",
+    )
+
+
+def config_from_args(args):
+    return PipelineConfig(
+        output_mode=args.output_mode,
+        image_codec=args.image_codec,
+        grayscale=args.grayscale,
+        encoder_threads=args.encoder_threads,
+        single_pass=args.single_pass,
+        parquet_metadata=args.parquet_metadata,
+        metrics_dir=args.metrics_dir,
+        incremental=args.incremental,
+        pipeline_depth=args.pipeline_depth,
+        memory_budget_bytes=args.memory_budget_mb * 1024**2,
+        max_tasks_per_child=args.max_tasks_per_child,
+        line_filter=LineFilter() if args.filter_lines else None,
+        dedup=args.dedup,
+        dedup_max_distance=args.dedup_max_distance,
+        html_parser=args.html_parser,
+    )
+
+
+def add_limit_arguments(arg_parser):
+    defaults = StreamLimits()
+    for name in (
+        "download_workers",
+        "extract_workers",
+        "processes",
+        "package_workers",
+        "works_in_flight",
+    ):
+        arg_parser.add_argument(
+            f"--{name.replace('_', '-')}", type=int, default=getattr(defaults, name)
+        )
+    arg_parser.add_argument(
+        "--min-free-gb",
+        type=float,
+        default=0,
+        help="wait before admitting a work that would leave less disk space free",
+    )
+    arg_parser.add_argument("--keep-intermediates", action="store_true")
+
+
+def limits_from_args(args):
+    return StreamLimits(
+        download_workers=args.download_workers,
+        extract_workers=args.extract_workers,
+        processes=args.processes,
+        package_workers=args.package_workers,
+        works_in_flight=args.works_in_flight,
+        min_free_bytes=int(args.min_free_gb * 1024**3),
+        keep_intermediates=args.keep_intermediates,
+    )
+
+
+def add_shard_arguments(arg_parser):
+    arg_parser.add_argument("--shard-index", type=int, default=0)
+    arg_parser.add_argument(
+        "--shard-count",
+        type=int,
+        default=1,
+        help="split the works across this many nodes (see sharding.py)",
+    )
+
+
+def shard_from_args(args):
+    if args.shard_count == 1:
+        return None
+    return args.shard_index, args.shard_count
+
+
+def process(args):
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    process_all_works(
+        args.works,
+        args.output_dir,
+        args.processes,
+        args.max_pages_per_task,
+        config_from_args(args),
+        shard=shard_from_args(args),
+    )
+
+
+def retry(args):
+    retry_failed(
+        args.output_dir,
+        args.processes,
+        args.max_pages_per_task,
+        config_from_args(args),
+        args.backoff_seconds,
+        args.max_backoff_seconds,
+        args.max_attempts,
+    )
+
+
+def merge(args):
+    merge_shards(args.node_dirs, args.merged_dir, args.processes)
+
+
+def run(args):
+    data_dir = args.data_dir
+    if args.zip_dir is not None:
+        files = local_zip_files(args.zip_dir)
+
+        def fetch(file):
+            return args.zip_dir / file["name"]
+
+    else:
+        zip_dir = data_dir / "work_zip"
+        zip_dir.mkdir(parents=True, exist_ok=True)
+        creds = load_credentials(
+            args.token or data_dir / "token.pickle",
+            args.credentials or data_dir / "drive_cred.json",
+        )
+        files = list_zip_files(authenticate_google_drive(creds), args.folder_id)
+        download = thread_local_downloader(
+            lambda: authenticate_google_drive(creds), zip_dir, args.chunk_size
+        )
+
+        def fetch(file):
+            zip_path = zip_dir / file["name"]
+            if zip_path.exists():  # Verified by an earlier run
+                return zip_path
+            return download(file)
+
+    shard = shard_from_args(args)
+    if shard is not None:
+        weights = shard_weights(
+            {
+                work_id_of(file["name"]): int(file.get("size", 0)) // ZIP_BYTES_PER_PAGE
+                for file in files
+            },
+            *shard,
+        )
+        files = [file for file in files if work_id_of(file["name"]) in weights]
+    run_pipeline(
+        files,
+        fetch,
+        data_dir / "extracted_data",
+        data_dir / "output_data",
+        data_dir / "outputs_new",
+        limits_from_args(args),
+        config_from_args(args),
+        delete_zips=args.zip_dir is None,
+    )
+    if shard is not None:
+        checkpoints = load_checkpoints()
+        finished = {
+            work_id_of(file["name"])
+            for file in files
+            if CHECKPOINT_PREFIX + file["name"] in checkpoints
+        }
+        shard_index, shard_count = shard
+        write_summary(
+            data_dir / "output_data", shard_index, shard_count, weights, finished
+        )
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(
+        prog="create-ocr-data", description="Create OCR line data from BDRC works."
+    )
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser(
+        "run", help="download, extract, process and package a corpus"
+    )
+    run_parser.add_argument("data_dir", type=Path)
+    source = run_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--folder-id", help="Drive folder of the work ZIPs")
+    source.add_argument("--zip-dir", type=Path, help="local folder of work ZIPs")
+    run_parser.add_argument(
+        "--credentials", help="Drive client secrets (DATA_DIR/drive_cred.json)"
+    )
+    run_parser.add_argument(
+        "--token", help="saved Drive credentials (DATA_DIR/token.pickle)"
+    )
+    run_parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    add_limit_arguments(run_parser)
+    add_shard_arguments(run_parser)
+    add_config_arguments(run_parser)
+    run_parser.set_defaults(func=run)
+
+    process_parser = commands.add_parser(
+        "process", help="process extracted works (folders or work ZIPs)"
+    )
+    process_parser.add_argument("works", type=Path)
+    process_parser.add_argument("output_dir", type=Path)
+    process_parser.add_argument("--processes", type=int, default=10)
+    process_parser.add_argument(
+        "--max-pages-per-task", type=int, default=MAX_PAGES_PER_TASK
+    )
+    add_shard_arguments(process_parser)
+    add_config_arguments(process_parser)
+    process_parser.set_defaults(func=process)
+
+    retry_parser = commands.add_parser(
+        "retry-failed", help="reprocess the pages that failed in earlier runs"
+    )
+    retry_parser.add_argument("output_dir", type=Path)
+    retry_parser.add_argument("--processes", type=int, default=10)
+    retry_parser.add_argument(
+        "--max-pages-per-task", type=int, default=MAX_PAGES_PER_TASK
+    )
+    retry_parser.add_argument(
+        "--backoff-seconds",
+        type=float,
+        default=DEFAULT_BACKOFF_SECONDS,
+        help="wait after a first failure, doubled after every further failure",
+    )
+    retry_parser.add_argument(
+        "--max-backoff-seconds", type=float, default=DEFAULT_MAX_BACKOFF_SECONDS
+    )
+    retry_parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=DEFAULT_MAX_ATTEMPTS,
+        help="give up on pages that failed this many times",
+    )
+    add_config_arguments(retry_parser)
+    retry_parser.set_defaults(func=retry)
+
+    merge_parser = commands.add_parser(
+        "merge", help="combine the output folders of every shard"
+    )
+    merge_parser.add_argument("node_dirs", type=Path, nargs="+")
+    merge_parser.add_argument("--out", dest="merged_dir", type=Path, required=True)
+    merge_parser.add_argument("--processes", type=int)
+    merge_parser.set_defaults(func=merge)
+
+    args = arg_parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
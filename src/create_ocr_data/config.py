@@ -0,0 +1,167 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from create_ocr_data.extract_valid_image import MIN_TEXT_LENGTH
+
+"""pipeline settings shared by every worker process"""
+
+OUTPUT_MODES = ("files", "archive")
+
+# hOCR parsers of parse_html: BeautifulSoup or the streaming parser.
+HTML_PARSERS = ("bs4", "stream")
+
+# What happens to lines already in the dedup index: dropped or tagged.
+DEDUP_MODES = ("skip", "tag")
+
+# Most differing bits of the 256-bit image hashes of two lines with the same
+# transcript that still count as the same line.
+DEFAULT_DEDUP_MAX_DISTANCE = 10
+
+# Line image shards are closed once they grow past this many bytes.
+DEFAULT_SHARD_SIZE = 1024**3
+
+# Buffered metadata rows are written out once this many are pending.
+DEFAULT_METADATA_FLUSH_ROWS = 5000
+
+# Page images whose decoded size is above this are cropped band by band
+# where their format allows it.
+DEFAULT_MAX_DECODED_IMAGE_BYTES = 512 * 1024**2
+
+# Output codecs for line images: file suffix and PIL save parameters.
+# "source" keeps the page image's own format.
+IMAGE_CODECS = {
+    "source": None,
+    "png": (".png", {"format": "PNG"}),
+    "webp": (".webp", {"format": "WEBP", "lossless": True}),
+    "tiff_lzw": (".tif", {"format": "TIFF", "compression": "tiff_lzw"}),
+    "tiff_deflate": (".tif", {"format": "TIFF", "compression": "tiff_adobe_deflate"}),
+    "tiff_group4": (".tif", {"format": "TIFF", "compression": "group4"}),
+}
+
+
+@dataclass(frozen=True)
+class LineFilter:
+    """Which parsed lines are cropped, encoded and analyzed at all.
+
+    Lines need an OCR confidence within `min_confidence`..`max_confidence`
+    (lines without one count as 0) and a text length of at least
+    `min_text_length` and, if set, at most `max_text_length`. With
+    `check_bbox` lines whose box is empty or reaches outside the page image
+    are rejected too. The defaults keep the lines that end up in the
+    category outputs.
+    """
+
+    min_confidence: int = 90
+    max_confidence: int = 100
+    min_text_length: int = MIN_TEXT_LENGTH
+    max_text_length: Optional[int] = None
+    check_bbox: bool = True
+
+
+@dataclass(frozen=True)
+class PipelineConfig:
+    """Settings for a pipeline run, picklable so it travels with pool tasks.
+
+    `output_mode` "files" writes every line image to its own file under
+    `images/<page_id>/`; "archive" appends line images and their metadata to
+    tar shards of about `shard_size` bytes under `shards/<confidence>/`.
+
+    Line crops are encoded with `image_codec` (see IMAGE_CODECS), optionally
+    converted to grayscale first, by `encoder_threads` threads per process.
+    `report_page_timing` prints the decode/crop/encode time of every page.
+
+    `single_pass` routes lines to their bo/non_bo categories while each page
+    is processed (category CSVs, and hardlinks into `filtered_images/` in
+    files mode) instead of re-reading the work CSV once the work is done.
+
+    Metadata rows are buffered and appended every `metadata_flush_rows` rows;
+    `parquet_metadata` also writes them, typed, to `metadata/*.parquet`
+    (needs pyarrow).
+
+    With `metrics_dir` set, per-stage metrics of a run are exported there as
+    `metrics.json` and `metrics.prom` every `metrics_interval` seconds and at
+    the end; `profile_sample_rate` of the pages are also run under cProfile,
+    with their profiles written to `metrics_dir/profiles`.
+
+    `incremental` keys processed pages of work folders by a digest of their
+    hOCR, page image and the output settings instead of by path, so only
+    new or changed pages are reprocessed (see incremental.py).
+
+    A `pipeline_depth` above 0 runs the pages of a task through the staged
+    pipeline of page_pipeline.py (prefetching reader, CPU stage, writer)
+    with queues of that many pages between the stages.
+
+    With `memory_budget_bytes` set, the worker processes of a run share that
+    budget for decoded page images and wait for each other instead of
+    decoding more at once; pages above `max_decoded_image_bytes` are cropped
+    band by band where possible (see memory_budget.py). Workers are replaced
+    after `max_tasks_per_child` tasks, returning fragmented memory.
+
+    With a `line_filter` (see LineFilter) lines are filtered right after
+    parsing, so rejected lines are counted in the rejected_lines metric but
+    never cropped, encoded, analyzed or written.
+
+    `html_parser` selects the hOCR parser (see HTML_PARSERS); both return
+    the same lines, "stream" several times faster.
+
+    `dedup` ("skip" or "tag", see DEDUP_MODES) looks every cropped line up
+    in a persistent index of transcript and image hashes shared by all
+    works (see dedup.py). A line repeats an indexed line with the same
+    transcript whose image hash differs in at most `dedup_max_distance`
+    bits; duplicates are dropped before they are encoded, or kept with the
+    line they repeat in a "Duplicate Of" metadata column.
+    """
+
+    output_mode: str = "files"
+    shard_size: int = DEFAULT_SHARD_SIZE
+    image_codec: str = "source"
+    grayscale: bool = False
+    encoder_threads: int = 4
+    report_page_timing: bool = False
+    single_pass: bool = False
+    metadata_flush_rows: int = DEFAULT_METADATA_FLUSH_ROWS
+    parquet_metadata: bool = False
+    metrics_dir: Optional[str] = None
+    metrics_interval: float = 60.0
+    profile_sample_rate: float = 0.0
+    incremental: bool = False
+    pipeline_depth: int = 0
+    memory_budget_bytes: int = 0
+    max_decoded_image_bytes: int = DEFAULT_MAX_DECODED_IMAGE_BYTES
+    max_tasks_per_child: Optional[int] = None
+    line_filter: Optional[LineFilter] = None
+    dedup: Optional[str] = None
+    dedup_max_distance: int = DEFAULT_DEDUP_MAX_DISTANCE
+    html_parser: str = "bs4"
+
+    def __post_init__(self):
+        if self.output_mode not in OUTPUT_MODES:
+            raise ValueError(f"Unknown output mode: {self.output_mode}")
+        if self.html_parser not in HTML_PARSERS:
+            raise ValueError(f"Unknown HTML parser: {self.html_parser}")
+        if self.dedup is not None and self.dedup not in DEDUP_MODES:
+            raise ValueError(f"Unknown dedup mode: {self.dedup}")
+        if self.dedup_max_distance < 0:
+            raise ValueError("dedup_max_distance must not be negative")
+        if self.image_codec not in IMAGE_CODECS:
+            raise ValueError(f"Unknown image codec: {self.image_codec}")
+        if not 0 <= self.profile_sample_rate <= 1:
+            raise ValueError("profile_sample_rate must be between 0 and 1")
+        if self.pipeline_depth < 0:
+            raise ValueError("pipeline_depth must not be negative")
+        if self.memory_budget_bytes < 0:
+            raise ValueError("memory_budget_bytes must not be negative")
+        if self.max_tasks_per_child is not None and self.max_tasks_per_child < 1:
+            raise ValueError("max_tasks_per_child must be at least 1")
+        if self.profile_sample_rate and self.metrics_dir is None:
+            raise ValueError("profiling needs a metrics_dir")
+
+    @property
+    def profile_dir(self):
+        if self.metrics_dir is None:
+            return None
+        return Path(self.metrics_dir) / "profiles"
+
+
+DEFAULT_CONFIG = PipelineConfig()
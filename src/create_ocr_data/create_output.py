@@ -1,8 +1,36 @@
-import shutil
+import csv
+import os
 import zipfile
+from multiprocessing import Pool
 from pathlib import Path
+from typing import Dict, List, Tuple
 
-import pandas as pd
+from create_ocr_data.extract_valid_image import CATEGORY_FOLDERS
+
+"""output packager
+
+Builds one archive per work and category straight from a work's
+`filtered_images/` and `csv/` folders, without copying them into a staging
+tree first. Archives are built in parallel, one per task, and images whose
+format is already compressed are stored rather than deflated again.
+"""
+
+# Category of the work outputs -> folder of its archive under the new base path.
+ARCHIVE_FOLDERS = {
+    "bo_text": ("bo", "text"),
+    "bo_number": ("bo", "numbers"),
+    "non_bo_text": ("non-bo",),
+    "non_bo_number": ("non-bo",),
+}
+
+# Deflating these again costs CPU for next to no gain.
+STORED_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".tif", ".tiff", ".jp2"}
+
+
+def compress_type(file_path: Path):
+    if file_path.suffix.lower() in STORED_SUFFIXES:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
 
 
 def zip_dir(src_dir: Path, dest_zip: Path):
@@ -13,63 +41,98 @@ def zip_dir(src_dir: Path, dest_zip: Path):
     with zipfile.ZipFile(dest_zip, "w", zipfile.ZIP_DEFLATED) as zipf:
         for file_path in src_dir.glob("**/*"):
             if file_path.is_file():
-                zipf.write(file_path, file_path.relative_to(src_dir.parent))
+                zipf.write(
+                    file_path,
+                    file_path.relative_to(src_dir.parent),
+                    compress_type(file_path),
+                )
+
 
+def merge_csv_files(csv_files, out):
+    """Stream the rows of `csv_files` into the binary stream `out` under one header.
+
+    Rows are copied as they are, without parsing them; only each file's
+    header is read, to check that it matches the first one.
+    """
+    header = None
+    for csv_path in csv_files:
+        with open(csv_path, "rb") as csv_file:
+            header_line = csv_file.readline()
+            file_header = next(csv.reader([header_line.decode("utf-8")]), [])
+            if header is None:
+                header = file_header
+                out.write(header_line)
+            elif file_header != header:
+                raise ValueError(
+                    f"{csv_path}: header {file_header} does not match {header}"
+                )
+            if not header_line.endswith(b"\n"):
+                out.write(b"\r\n")
+            ends_with_newline = True
+            for chunk in iter(lambda: csv_file.read(1024 * 1024), b""):
+                out.write(chunk)
+                ends_with_newline = chunk.endswith(b"\n")
+            if not ends_with_newline:
+                out.write(b"\r\n")
 
-def reorganize_directory_structure(base_path: Path, new_base_path: Path):
+
+def plan_work_archives(work_dir: Path, new_base_path: Path):
+    """Group a work's category outputs by the archive they are packaged into.
+
+    Returns `[(work_id, dest_zip, image_dirs, csv_files), ...]`.
+    """
+    archives: Dict[Path, Tuple[List[Path], List[Path]]] = {}
+    for category, folders in ARCHIVE_FOLDERS.items():
+        dest_zip = new_base_path.joinpath(*folders, f"{work_dir.name}.zip")
+        image_dirs, csv_files = archives.setdefault(dest_zip, ([], []))
+        image_dir = work_dir / "filtered_images" / CATEGORY_FOLDERS[category]
+        if image_dir.is_dir():
+            image_dirs.append(image_dir)
+        csv_file = work_dir / "csv" / f"{category}.csv"
+        if csv_file.is_file():
+            csv_files.append(csv_file)
+    return [
+        (work_dir.name, dest_zip, image_dirs, csv_files)
+        for dest_zip, (image_dirs, csv_files) in archives.items()
+    ]
+
+
+def write_work_archive(args):
+    """Stream a work's images and CSV of one category archive into `dest_zip`."""
+    work_id, dest_zip, image_dirs, csv_files = args
+    dest_zip.parent.mkdir(parents=True, exist_ok=True)
+    tmp_zip = dest_zip.with_name(f".{dest_zip.name}.{os.getpid()}")
+    with zipfile.ZipFile(tmp_zip, "w", zipfile.ZIP_DEFLATED) as zipf:
+        for image_dir in image_dirs:
+            for image_file in sorted(image_dir.iterdir()):
+                zipf.write(
+                    image_file,
+                    f"{work_id}/images/{image_file.name}",
+                    compress_type(image_file),
+                )
+        if csv_files:
+            with zipf.open(f"{work_id}/{work_id}.csv", "w") as csv_member:
+                merge_csv_files(csv_files, csv_member)
+    os.replace(tmp_zip, dest_zip)
+    return dest_zip
+
+
+def reorganize_directory_structure(
+    base_path: Path, new_base_path: Path, num_processes=None
+):
+    """Package every work under `base_path` into per-category archives."""
     new_base_path.mkdir(parents=True, exist_ok=True)
-    for work_id in base_path.iterdir():
+    tasks = []
+    for work_id in sorted(base_path.iterdir()):
         if not work_id.is_dir():
             continue
+        tasks.extend(plan_work_archives(work_id, new_base_path))
+    with Pool(processes=num_processes) as pool:
+        for dest_zip in pool.imap_unordered(write_work_archive, tasks):
+            print(f"Created {dest_zip}")
+
 
-        paths = {
-            "bo_text": new_base_path / "bo" / "text" / work_id.name,
-            "bo_number": new_base_path / "bo" / "numbers" / work_id.name,
-            "non_bo_text": new_base_path / "non-bo" / work_id.name,
-            "non_bo_number": new_base_path / "non-bo" / work_id.name,
-        }
-
-        # Create new directories and their image subdirectories
-        for path in paths.values():
-            (path / "images").mkdir(parents=True, exist_ok=True)
-
-        # Move image files
-        filter_images_path = work_id / "filtered_images"
-        for category_dir in filter_images_path.iterdir():
-            for sub_category_dir in category_dir.iterdir():
-                dest_path = paths[f"{category_dir.name}_{sub_category_dir.name}"]
-                for image_file in sub_category_dir.iterdir():
-                    shutil.copy(str(image_file), dest_path / "images")
-
-        # Move CSV files
-        csv_path = Path(work_id) / "csv"
-        for csv_file in csv_path.iterdir():
-            category = csv_file.stem
-            dest_path = paths[category]
-            dest_file_path = dest_path / f"{work_id.name}.csv"
-
-            if dest_file_path.exists():
-                # File exists, append new data to existing CSV
-                existing_df = pd.read_csv(dest_file_path)
-                new_df = pd.read_csv(csv_file)
-                combined_df = pd.concat([existing_df, new_df[1:]])
-                combined_df.to_csv(dest_file_path, index=False)
-            else:
-                # File does not exist, copy the new file
-                shutil.copy(str(csv_file), dest_file_path)
-
-        for key, path in paths.items():
-            zip_file_path = path.parent / f"{path.name}.zip"
-            zip_dir(path, zip_file_path)
-
-            # Check if the directory exists before trying to remove it
-            if path.exists():
-                shutil.rmtree(path)
-            else:
-                print(f"Attempted to remove non-existing directory: {path}")
-
-
-# Call the function
-base_path = Path("../../data/output_data")
-new_base_path = Path("../../data/outputs_new")
-reorganize_directory_structure(base_path, new_base_path)
+if __name__ == "__main__":
+    base_path = Path("../../data/output_data")
+    new_base_path = Path("../../data/outputs_new")
+    reorganize_directory_structure(base_path, new_base_path)
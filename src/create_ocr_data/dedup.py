@@ -0,0 +1,84 @@
+import hashlib
+
+from PIL import Image
+
+from create_ocr_data.checkpoints import claim_lines
+from create_ocr_data.metrics import count, timed_stage
+
+"""cross-work line deduplication
+
+Reprints and re-scans put the same lines into many works. Every cropped
+line is hashed twice: its exact transcript, and a difference hash of its
+crop (a 256-bit gradient fingerprint of a small grayscale thumbnail that
+survives re-encoding and slight rescaling). Lines are looked up in an index
+kept in the checkpoint database, so it is shared by the pool workers and
+kept between runs. A line is a duplicate only when another line has the
+same transcript and an image hash at most `config.dedup_max_distance` bits
+away: a common transcript alone ("om mani padme hum", page headers) is not
+the same line, and neither is a similar-looking crop with other text.
+Lines are keyed by work and line image name, which are only unique
+together.
+"""
+
+# Thumbnail size of the difference hash: 32 x 8 horizontal gradients.
+IMAGE_HASH_SIZE = (33, 8)
+
+
+def text_hash(text) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def image_hash(crop) -> str:
+    width, height = IMAGE_HASH_SIZE
+    thumbnail = crop.convert("L").resize(IMAGE_HASH_SIZE, Image.Resampling.BILINEAR)
+    pixels = thumbnail.tobytes()
+    bits = 0
+    for y in range(height):
+        row = pixels[y * width : (y + 1) * width]
+        for left, right in zip(row, row[1:]):
+            bits = bits << 1 | (left < right)
+    return f"{bits:064x}"
+
+
+def hash_distance(image_hash, other) -> int:
+    """Number of differing bits of two image hashes."""
+    return bin(int(image_hash, 16) ^ int(other, 16)).count("1")
+
+
+@timed_stage("dedup_lines")
+def dedup_lines(ocr_data, crops, work_id, config):
+    """Look up the cropped lines of a page of work `work_id` in the dedup index.
+
+    Lines need their `line_image_name` and `image_page_id`. With dedup "skip"
+    duplicate lines and their crops are dropped; with "tag" every line is
+    kept and `line["duplicate_of"]` names the `<work>/<line image>` it
+    repeats, or is empty. Returns the lines and crops to keep.
+    """
+    owners = claim_lines(
+        [
+            (
+                text_hash(line["text"]),
+                image_hash(crop),
+                work_id,
+                line["line_image_name"],
+                line["image_page_id"],
+            )
+            for line, crop in zip(ocr_data, crops)
+        ],
+        lambda image_hash, other: hash_distance(image_hash, other)
+        <= config.dedup_max_distance,
+    )
+    kept_lines, kept_crops = [], []
+    duplicates = 0
+    for line, crop, owner in zip(ocr_data, crops, owners):
+        duplicate_of = "" if owner is None else "/".join(owner)
+        duplicates += bool(duplicate_of)
+        if duplicate_of and config.dedup == "skip":
+            continue
+        if config.dedup == "tag":
+            line["duplicate_of"] = duplicate_of
+        kept_lines.append(line)
+        kept_crops.append(crop)
+    count("dedup_lines", lines=len(ocr_data))
+    count("duplicate_lines", lines=duplicates)
+    return kept_lines, kept_crops
@@ -3,13 +3,46 @@ from pathlib import Path
 from shutil import copy2
 from typing import Any, Dict, List
 
+# Lines shorter than this are left out of the category folders and CSVs.
+MIN_TEXT_LENGTH = 10
+
+CATEGORY_CSV_COLUMNS = [
+    "Work ID",
+    "Volume ID",
+    "Page ID",
+    "Line Image Name",
+    "OCR Confidence",
+    "Text",
+]
+
+CATEGORY_FOLDERS = {
+    "bo_text": "bo/text",
+    "bo_number": "bo/number",
+    "non_bo_number": "non_bo/number",
+    "non_bo_text": "non_bo/text",
+}
+
+
+def line_category(tib_num, non_bo_word, non_bo_num):
+    """Return the category key (bo_text, bo_number, ...) of a line from its flags."""
+    if not tib_num and not non_bo_word:
+        return "bo_text"
+    elif tib_num and not non_bo_word:
+        return "bo_number"
+    elif non_bo_word and non_bo_num:
+        return "non_bo_number"
+    return "non_bo_text"
+
 
 def organize_images_and_create_category_csvs(
-    csv_file_path, images_base_path, output_base
+    csv_file_path, images_base_path, output_base, copy_images=True
 ):
     """
     Organize images into specific folders based on CSV data, including counts, volume-wise,
     and create separate CSV files for each category.
+
+    With `copy_images` False only the category CSVs are written, e.g. when the
+    line images were written to tar shards instead of files.
     """
 
     category_rows: Dict[str, List[Dict[str, Any]]] = {
@@ -19,14 +52,7 @@ def organize_images_and_create_category_csvs(
         "non_bo_number": [],
     }
 
-    desired_columns = [
-        "Work ID",
-        "Volume ID",
-        "Page ID",
-        "Line Image Name",
-        "OCR Confidence",
-        "Text",
-    ]
+    desired_columns = CATEGORY_CSV_COLUMNS
 
     with open(csv_file_path, newline="", encoding="utf-8") as csvfile:
         reader = csv.DictReader(csvfile)
@@ -37,25 +63,17 @@ def organize_images_and_create_category_csvs(
             non_bo_num = row["Non Bo Num"].lower() == "true"
             text_length = int(row["Text_length"])
 
-            if text_length < 10:
+            if text_length < MIN_TEXT_LENGTH:
                 continue
 
             # Determine the target subfolder and category key based on the criteria
-            if not tib_num and not non_bo_word:
-                target_folder = output_base / "bo/text"
-                category_key = "bo_text"
-            elif tib_num and not non_bo_word:
-                target_folder = output_base / "bo/number"
-                category_key = "bo_number"
-            elif non_bo_word and non_bo_num:
-                target_folder = output_base / "non_bo/number"
-                category_key = "non_bo_number"
-            else:
-                target_folder = output_base / "non_bo/text"
-                category_key = "non_bo_text"
+            category_key = line_category(tib_num, non_bo_word, non_bo_num)
+            target_folder = output_base / CATEGORY_FOLDERS[category_key]
 
             # Add row to the corresponding category list
             category_rows[category_key].append(row)
+            if not copy_images:
+                continue
 
             # Ensure the target directory exists
             target_folder.mkdir(parents=True, exist_ok=True)
@@ -1,5 +1,30 @@
+import json
 import os
+import shutil
 import zipfile
+import zlib
+from multiprocessing import Pool
+
+from create_ocr_data.checkpoints import save_corrupted_files
+
+"""manifest-driven extraction
+
+Every top-level archive is extracted in a worker process into a hidden
+staging directory next to its target (`.<name>.tmp-<pid>`), nested archives
+included, and then renamed into place, so a target directory is either
+complete or absent. Page scans skip hidden entries, and staging directories
+left behind by a crash are removed when extraction starts again. The
+manifest records the size, mtime and CRC of each extracted archive; on the
+next run unchanged archives whose target exists are skipped without being
+opened.
+"""
+
+MANIFEST_NAME = "extract_manifest.json"
+
+# The manifest is rewritten after this many extracted archives.
+MANIFEST_SAVE_EVERY = 100
+
+STAGING_MARKER = ".tmp-"
 
 
 def extract_zip(zip_path, extract_to):
@@ -10,29 +35,146 @@ def extract_zip(zip_path, extract_to):
         zip_ref.extractall(extract_to)
 
 
-def find_and_extract_zip(root_path, output_path):
-    """
-    Recursively finds ZIP files in the given directory and subdirectories,
-    and extracts them.
-    """
-    for root, dirs, files in os.walk(root_path):
+def extract_nested_zips(folder):
+    """Extract every ZIP found under `folder` next to itself, recursively."""
+    for root, dirs, files in os.walk(folder):
         for filename in files:
             if filename.endswith(".zip"):
-                # Correctly construct zip_path from the current root
                 zip_path = os.path.join(root, filename)
-                print(f"Extracting: {zip_path}")
-                # Prepare a corresponding output directory within output_path
-                relative_root = os.path.relpath(root, start=root_path)
-                extract_to = os.path.join(
-                    output_path, relative_root, os.path.splitext(filename)[0]
-                )
-                if not os.path.exists(extract_to):
-                    os.makedirs(extract_to)
+                extract_to = os.path.join(root, os.path.splitext(filename)[0])
+                os.makedirs(extract_to, exist_ok=True)
                 extract_zip(zip_path, extract_to)
-                # Recursively search the newly extracted directory for more ZIP files
-                find_and_extract_zip(
-                    extract_to, extract_to
-                )  # Adjusted to use extract_to for both parameters
+                extract_nested_zips(extract_to)
+
+
+def archive_stat(zip_path):
+    stat = os.stat(zip_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def archive_crc(zip_path):
+    """CRC of an archive's member names, sizes and CRCs, read from its directory."""
+    crc = 0
+    with zipfile.ZipFile(zip_path) as zip_file:
+        for info in zip_file.infolist():
+            entry = f"{info.filename}\0{info.file_size}\0{info.CRC}\n"
+            crc = zlib.crc32(entry.encode("utf-8"), crc)
+    return crc
+
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, encoding="utf-8") as manifest_file:
+        return json.load(manifest_file)
+
+
+def save_manifest(manifest_path, manifest):
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def staging_dir(extract_to):
+    """Hidden directory an archive is extracted into before it is renamed."""
+    parent, name = os.path.split(os.path.normpath(extract_to))
+    return os.path.join(parent, f".{name}{STAGING_MARKER}{os.getpid()}")
+
+
+def is_staging_dir(name):
+    return name.startswith(".") and STAGING_MARKER in name
+
+
+def remove_stale_staging(directory):
+    """Remove the staging directories directly under `directory`.
+
+    Only call this while no extraction into `directory` is running.
+    """
+    if not os.path.isdir(directory):
+        return
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False) and is_staging_dir(entry.name):
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def extract_archive(args):
+    """Extract one top-level archive atomically.
+
+    Returns `(key, manifest_entry, error)`; the entry is None on failure.
+    """
+    key, zip_path, extract_to = args
+    tmp_dir = staging_dir(extract_to)
+    try:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        extract_zip(zip_path, tmp_dir)
+        extract_nested_zips(tmp_dir)
+        if os.path.exists(extract_to):
+            shutil.rmtree(extract_to)
+        os.rename(tmp_dir, extract_to)
+        return key, {**archive_stat(zip_path), "crc": archive_crc(zip_path)}, None
+    except Exception as e:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return key, None, f"{zip_path}: {e}"
+
+
+def plan_extractions(root_path, output_path, manifest):
+    """Return the archives under `root_path` that need extracting.
+
+    Also updates the manifest of archives whose size or mtime changed but
+    whose CRC did not.
+    """
+    jobs = []
+    for root, dirs, files in os.walk(root_path):
+        remove_stale_staging(
+            os.path.join(output_path, os.path.relpath(root, start=root_path))
+        )
+        for filename in sorted(files):
+            if not filename.endswith(".zip"):
+                continue
+            zip_path = os.path.join(root, filename)
+            relative_root = os.path.relpath(root, start=root_path)
+            key = os.path.normpath(os.path.join(relative_root, filename))
+            extract_to = os.path.join(
+                output_path, relative_root, os.path.splitext(filename)[0]
+            )
+            entry = manifest.get(key)
+            if entry is not None and os.path.isdir(extract_to):
+                stat = archive_stat(zip_path)
+                if all(entry.get(field) == stat[field] for field in stat):
+                    continue
+                if entry.get("crc") == archive_crc(zip_path):
+                    manifest[key] = {**entry, **stat}
+                    continue
+            jobs.append((key, zip_path, extract_to))
+    return jobs
+
+
+def find_and_extract_zip(root_path, output_path, num_processes=None):
+    """
+    Finds ZIP files in the given directory and subdirectories and extracts
+    them in parallel, nested ZIPs included, skipping unchanged archives.
+    """
+    manifest_path = os.path.join(output_path, MANIFEST_NAME)
+    os.makedirs(output_path, exist_ok=True)
+    manifest = load_manifest(manifest_path)
+    jobs = plan_extractions(root_path, output_path, manifest)
+    print(f"Extracting {len(jobs)} archives, skipping unchanged ones")
+    if jobs:
+        with Pool(processes=num_processes) as pool:
+            for done, (key, entry, error) in enumerate(
+                pool.imap_unordered(extract_archive, jobs), start=1
+            ):
+                if entry is None:
+                    save_corrupted_files(key, error, stage="extract")
+                    print(f"Error extracting {error}")
+                    continue
+                manifest[key] = entry
+                if done % MANIFEST_SAVE_EVERY == 0:
+                    save_manifest(manifest_path, manifest)
+    save_manifest(manifest_path, manifest)
 
 
 if __name__ == "__main__":
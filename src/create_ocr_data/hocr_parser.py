@@ -0,0 +1,79 @@
+from contextlib import nullcontext
+from html.parser import HTMLParser
+from pathlib import Path
+
+"""streaming hOCR parser"""
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def parse_line_title(title):
+    """Extract the bounding box and OCR confidence from an hOCR title attribute."""
+    bbox = [int(x) for x in title.split(";")[0].split()[1:]]
+    ocr_conf = None
+    if "x_wconf" in title:
+        ocr_conf = int(title.split("x_wconf")[1].split(";")[0].strip())
+    return bbox, ocr_conf
+
+
+class HocrLineParser(HTMLParser):
+    """Collect `ocr_line` spans as they are fed, without building a document tree."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.lines = []
+        self._depth = 0  # span nesting depth inside the current ocr_line
+        self._title = None
+        self._text = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag != "span":
+            return
+        if self._depth:
+            self._depth += 1
+            return
+        classes = (dict(attrs).get("class") or "").split()
+        if "ocr_line" in classes:
+            self._depth = 1
+            self._title = dict(attrs).get("title")
+            self._text = []
+
+    def handle_endtag(self, tag):
+        if tag != "span" or not self._depth:
+            return
+        self._depth -= 1
+        if not self._depth:
+            bbox, ocr_conf = parse_line_title(self._title)
+            text = "".join(self._text)
+            self.lines.append({"bbox": bbox, "text": text, "ocr_conf": ocr_conf})
+
+    def handle_data(self, data):
+        if self._depth:
+            self._text.append(data)
+
+
+def iter_hocr_lines(file):
+    """Yield `{"bbox", "text", "ocr_conf"}` records from an open text file in one pass."""
+    parser = HocrLineParser()
+    while True:
+        chunk = file.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        parser.feed(chunk)
+        yield from parser.lines
+        parser.lines.clear()
+    parser.close()
+    yield from parser.lines
+
+
+def open_html_file(html_file):
+    """Open `html_file` as UTF-8 text, or pass an already open text file through."""
+    if hasattr(html_file, "read"):
+        return nullcontext(html_file)
+    return open(Path(html_file), encoding="utf-8")
+
+
+def parse_hocr(html_file):
+    """Parse an hOCR file (path or open text file) into line records."""
+    with open_html_file(html_file) as file:
+        return list(iter_hocr_lines(file))
@@ -0,0 +1,171 @@
+import csv
+import dataclasses
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+from create_ocr_data.checkpoints import (
+    delete_line_hashes,
+    delete_page_digests,
+    forget_work,
+    load_digested_works,
+    load_page_digests,
+)
+from create_ocr_data.pipeline import find_corresponding_image_path, find_image_files
+
+"""content-hash incremental processing
+
+A page of a work folder is identified by `<work>/<work>-<volume>/<page>`,
+which does not depend on where the data root lives, and is recorded with a
+digest of its hOCR file, its page image and the settings that shape its
+outputs. On a rerun only pages whose digest changed, or that are new, are
+processed again; the outputs of changed pages and of pages that no longer
+exist are removed from the work's line images, CSVs and category folders,
+and from the dedup index. Works that are no longer in the corpus at all
+lose their whole output folder.
+
+Line images already appended to tar shards (archive mode) and Parquet
+metadata parts cannot be removed page by page and are left as they are.
+"""
+
+# Bump when a change to the pipeline alters the outputs of unchanged pages.
+PIPELINE_VERSION = 1
+
+# Settings that do not change what a page's outputs contain.
+UNFINGERPRINTED_FIELDS = {
+    "encoder_threads",
+    "report_page_timing",
+    "metadata_flush_rows",
+    "metrics_dir",
+    "metrics_interval",
+    "profile_sample_rate",
+    "incremental",
+    "pipeline_depth",
+    "memory_budget_bytes",
+    "max_decoded_image_bytes",
+    "max_tasks_per_child",
+    "html_parser",
+}
+
+
+def config_fingerprint(config) -> str:
+    settings = {
+        name: value
+        for name, value in dataclasses.asdict(config).items()
+        if name not in UNFINGERPRINTED_FIELDS
+    }
+    settings["pipeline_version"] = PIPELINE_VERSION
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+def page_key(html_file) -> str:
+    """Location-independent key of a page, e.g. `W1/W1-I1/I10001`."""
+    parts = Path(html_file).parts
+    return "/".join([*parts[-4:-2], Path(html_file).stem])
+
+
+def key_image_page_id(key) -> str:
+    """The `Page ID` (volume id + last 4 characters of the page) of a page key."""
+    _, work_volume_id, page = key.split("/")
+    return f"{work_volume_id.split('-')[1]}{page[-4:]}"
+
+
+def update_file_digest(digest, file_path, chunk_size=1024 * 1024):
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+
+
+def page_digest(html_file, fingerprint, image_index=None) -> str:
+    """Digest of a page's hOCR, its page image (if any) and the settings."""
+    digest = hashlib.sha256(fingerprint.encode())
+    update_file_digest(digest, html_file)
+    image_path = find_corresponding_image_path(html_file)
+    image_files = find_image_files(image_path, image_index)
+    if image_files:
+        digest.update(image_files[0].name.encode())
+        update_file_digest(digest, image_files[0])
+    return digest.hexdigest()
+
+
+def diff_pages(digested_pages, stored_digests):
+    """Split a work's pages against the digests it was processed with.
+
+    `digested_pages` are `(html_file, page_key, digest)`. Returns the pages
+    to process and the keys of processed pages whose outputs are stale.
+    """
+    current_keys = {key for _, key, _ in digested_pages}
+    changed = [
+        page for page in digested_pages if stored_digests.get(page[1]) != page[2]
+    ]
+    stale = [key for _, key, _ in changed if key in stored_digests]
+    stale += [key for key in stored_digests if key not in current_keys]
+    return changed, stale
+
+
+def prune_csv_rows(csv_file_path, page_ids):
+    """Rewrite a CSV without the rows whose `Page ID` is in `page_ids`."""
+    tmp_path = csv_file_path.with_name(f".{csv_file_path.name}.{os.getpid()}")
+    with csv_file_path.open(newline="", encoding="utf-8") as source:
+        reader = csv.reader(source)
+        header = next(reader, None)
+        if header is None:
+            return
+        page_column = header.index("Page ID")
+        with tmp_path.open("w", newline="", encoding="utf-8") as target:
+            writer = csv.writer(target)
+            writer.writerow(header)
+            writer.writerows(row for row in reader if row[page_column] not in page_ids)
+    os.replace(tmp_path, csv_file_path)
+
+
+def remove_page_outputs(work_output_dir, work_id, keys):
+    """Remove the line images, CSV rows and category images of pages `keys`."""
+    if not keys:
+        return
+    page_ids = {key_image_page_id(key) for key in keys}
+    for page_id in page_ids:
+        shutil.rmtree(work_output_dir / "images" / page_id, ignore_errors=True)
+        for image_file in work_output_dir.glob(f"filtered_images/*/*/{page_id}_*"):
+            image_file.unlink()
+    csv_files = [
+        *work_output_dir.glob(f"{work_id}_*.csv"),
+        *work_output_dir.glob("csv/*.csv"),
+    ]
+    for csv_file_path in csv_files:
+        prune_csv_rows(csv_file_path, page_ids)
+    delete_line_hashes(work_id, page_ids)
+
+
+def remove_vanished_works(work_ids, output_dir):
+    """Clear the outputs and digests of processed works not in `work_ids`.
+
+    Only works with an output folder under `output_dir` are cleared, so
+    works processed into other output folders keep theirs. Returns the
+    removed work ids.
+    """
+    removed = []
+    for work_id in sorted(load_digested_works() - set(work_ids)):
+        work_output_dir = output_dir / work_id
+        if work_output_dir.is_dir():
+            shutil.rmtree(work_output_dir)
+            forget_work(work_id)
+            removed.append(work_id)
+    return removed
+
+
+def plan_work_pages(work_id, digested_pages, work_output_dir):
+    """Clear the outputs of a work's stale pages.
+
+    Returns the pages to process and whether any outputs were removed.
+    Digests of pages that no longer exist are forgotten; those of changed
+    pages are replaced once the page has been processed again.
+    """
+    stored_digests = load_page_digests(work_id)
+    changed, stale = diff_pages(digested_pages, stored_digests)
+    remove_page_outputs(work_output_dir, work_id, stale)
+    current_keys = {key for _, key, _ in digested_pages}
+    delete_page_digests([key for key in stale if key not in current_keys])
+    return changed, bool(stale)
@@ -0,0 +1,118 @@
+import io
+import json
+import os
+import tarfile
+import time
+from pathlib import Path
+from typing import IO, Dict, Optional, Tuple
+
+"""sharded tar output for line images
+
+Line images and their metadata rows are appended to WebDataset-style tar
+shards: each sample is a `<key>.<ext>` image member next to a `<key>.json`
+metadata member. Every process writes its own shards, named
+`<category>-<pid>-<index>.tar`, so concurrent workers never share a file.
+Shards are closed at the end of every task, but the process keeps their
+writers: its next task continues the last shard from the offset where its
+samples end, without re-reading every header the way tarfile's append mode
+does, until the shard reaches `shard_size`. A new writer starts after the
+highest index already on disk.
+"""
+
+
+class ShardWriter:
+    """Write samples to numbered tar shards, starting another past `shard_size` bytes."""
+
+    def __init__(self, shard_dir: Path, prefix: str, shard_size: int):
+        self.shard_dir = shard_dir
+        self.prefix = f"{prefix}-{os.getpid()}"
+        self.shard_size = shard_size
+        self.index = self._next_index()
+        self.tar: Optional[tarfile.TarFile] = None
+        self.file: Optional[IO[bytes]] = None
+        # Where the samples of the current shard end once it has been closed
+        self.end: Optional[int] = None
+
+    def _next_index(self):
+        indices = [
+            int(path.stem.rsplit("-", 1)[1])
+            for path in self.shard_dir.glob(f"{self.prefix}-*.tar")
+        ]
+        return max(indices, default=-1) + 1
+
+    def shard_path(self):
+        return self.shard_dir / f"{self.prefix}-{self.index:06d}.tar"
+
+    def write(self, key, members):
+        """Add one sample; `members` maps extensions (e.g. ".tif") to bytes."""
+        tar = self.open() if self.tar is None else self.tar
+        mtime = time.time()
+        for ext, data in members.items():
+            info = tarfile.TarInfo(f"{key}{ext}")
+            info.size = len(data)
+            info.mtime = mtime
+            tar.addfile(info, io.BytesIO(data))
+        if tar.offset >= self.shard_size:
+            self.close()
+            self.index += 1
+            self.end = None
+
+    def open(self):
+        """Create the current shard, or reopen it where its samples end."""
+        if self.end is not None and not self.shard_path().exists():
+            self.end = None  # Removed since, e.g. with its work's outputs
+        if self.end is None:
+            self.shard_dir.mkdir(parents=True, exist_ok=True)
+            self.file = open(self.shard_path(), "xb")
+        else:
+            # Overwrite the end-of-archive blocks written when it was closed
+            self.file = open(self.shard_path(), "r+b")
+            self.file.seek(self.end)
+            self.file.truncate()
+        self.tar = tarfile.open(fileobj=self.file, mode="w")
+        return self.tar
+
+    def close(self):
+        if self.tar is not None:
+            self.end = self.tar.offset
+            self.tar.close()
+            self.tar = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+_writers: Dict[Tuple[int, Path, str], ShardWriter] = {}
+
+
+def get_shard_writer(shard_dir: Path, prefix: str, shard_size: int) -> ShardWriter:
+    """Return this process's open writer for `shard_dir/prefix-*`."""
+    key = (os.getpid(), shard_dir, prefix)
+    if key not in _writers:
+        _writers[key] = ShardWriter(shard_dir, prefix, shard_size)
+    return _writers[key]
+
+
+def close_line_archives():
+    """Close every shard opened by this process; call at the end of a task.
+
+    The writers are kept, so the process's next task continues their shards.
+    """
+    for key, writer in list(_writers.items()):
+        if key[0] == os.getpid():
+            writer.close()
+        else:  # Inherited from the parent process
+            del _writers[key]
+
+
+def archive_line(shard_dir, category, shard_size, line, metadata):
+    """Append a line image (`line["image_bytes"]`) and its metadata row to its shard."""
+    name = Path(line["line_image_name"])
+    writer = get_shard_writer(shard_dir, category, shard_size)
+    writer.write(
+        name.stem,
+        {
+            name.suffix: line["image_bytes"],
+            ".json": json.dumps(metadata, ensure_ascii=False).encode("utf-8"),
+        },
+    )
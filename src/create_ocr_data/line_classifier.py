@@ -0,0 +1,62 @@
+from functools import lru_cache
+
+from botok.textunits.charcategories import get_char_category
+from botok.vars import CharMarkers
+
+"""fast-path script classifier
+
+Decides the `(non_bo_word, tib_num, non_bo_num)` flags of a line from the
+botok character categories alone when the answer does not depend on how botok
+groups syllables into words:
+
+- lines made only of Tibetan letters, punctuation, symbols and spaces yield
+  no LATIN/CJK/OTHER or NUM token;
+- lines without any Tibetan character are tokenized chunk by chunk, so every
+  non-bo character becomes a LATIN/CJK/OTHER token.
+
+Anything else (Tibetan digits, or Tibetan mixed with other scripts) is left
+to the botok tokenizer.
+"""
+
+NON_BO_CATEGORIES = {
+    CharMarkers.LATIN.value,
+    CharMarkers.CJK.value,
+    CharMarkers.OTHER.value,
+}
+
+PLAIN_TIBETAN_CLASSES = {"space", "bo"}
+NON_TIBETAN_CLASSES = {"space", "non_bo", "latin_digit"}
+
+
+@lru_cache(maxsize=None)
+def char_class(char):
+    """Return the class of a character: space, bo, num, latin_digit, non_bo or unknown."""
+    try:
+        category = get_char_category(char)
+    except ValueError:  # Tibetan codepoint botok itself rejects
+        return "unknown"
+    if category == CharMarkers.TRANSPARENT.value:
+        return "space"
+    if category == CharMarkers.NUMERAL.value:
+        return "num"
+    if category == CharMarkers.LATIN.value and char.isdecimal():
+        return "latin_digit"
+    if category in NON_BO_CATEGORIES:
+        return "non_bo"
+    return "bo"
+
+
+def page_char_classes(texts):
+    """Classify every distinct character of a page's lines in one pass."""
+    return {char: char_class(char) for char in set().union(*texts)}
+
+
+def fast_line_flags(text, char_classes):
+    """Return the line flags, or None when only botok can decide them."""
+    classes = {char_classes[char] for char in set(text)}
+    if classes <= PLAIN_TIBETAN_CLASSES:
+        return False, False, False
+    if classes <= NON_TIBETAN_CLASSES:
+        non_bo_num = "latin_digit" in classes
+        return non_bo_num or "non_bo" in classes, False, non_bo_num
+    return None
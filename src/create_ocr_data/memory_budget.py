@@ -0,0 +1,141 @@
+import multiprocessing
+import time
+from contextlib import contextmanager
+
+from PIL import Image
+
+from create_ocr_data.metrics import count
+
+"""memory admission control for page images
+
+Worker processes share a MemoryBudget (handed to them by the pool
+initializer) and reserve the estimated decoded size of a page image before
+decoding it, waiting while other workers hold the budget. The size is
+estimated from the image header, which PIL reads without decoding.
+
+Images too large to decode at once are cropped band by band when their
+pixel data is stored uncompressed (raw TIFF strips, PGM/PPM, ...); other
+formats can only be decoded whole and then wait until they can reserve the
+whole budget.
+"""
+
+# Bytes per pixel of PIL's in-memory image modes; other modes use 4.
+MODE_BYTES = {"1": 1, "L": 1, "P": 1, "I;16": 2, "I;16L": 2, "I;16B": 2}
+
+# Raw modes whose rows can be read straight from the file, with their bits per pixel.
+RAW_MODE_BITS = {"1": 1, "1;I": 1, "L": 8, "L;I": 8, "RGB": 24, "RGBA": 32, "CMYK": 32}
+
+_memory_budget = None
+
+
+class MemoryBudget:
+    """A byte budget shared by processes; `reserve` blocks until bytes are free."""
+
+    def __init__(self, limit, context=None):
+        context = context or multiprocessing.get_context()
+        self.limit = limit
+        self.used = context.Value("q", 0, lock=False)
+        self.condition = context.Condition()
+
+    @contextmanager
+    def reserve(self, nbytes):
+        # A request above the limit waits until it has the budget to itself
+        nbytes = min(nbytes, self.limit)
+        start = time.perf_counter()
+        with self.condition:
+            while self.used.value + nbytes > self.limit:
+                self.condition.wait()
+            self.used.value += nbytes
+        count("memory_wait", calls=1, seconds=time.perf_counter() - start)
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.used.value -= nbytes
+                self.condition.notify_all()
+
+
+def set_memory_budget(budget):
+    """Pool initializer: share `budget` with this worker process."""
+    global _memory_budget
+    _memory_budget = budget
+
+
+@contextmanager
+def reserve_memory(nbytes):
+    """Reserve `nbytes` of the shared budget, if this process has one."""
+    if _memory_budget is None:
+        yield
+        return
+    with _memory_budget.reserve(nbytes):
+        yield
+
+
+def decoded_bytes(mode, width, height, grayscale=False):
+    pixels = width * height
+    nbytes = pixels * MODE_BYTES.get(mode, 4)
+    if grayscale and mode not in ("1", "L"):
+        nbytes += pixels  # The grayscale copy
+    return nbytes
+
+
+def estimate_decoded_bytes(image, grayscale=False):
+    """Memory needed to decode an opened (not loaded) image, from its header."""
+    return decoded_bytes(image.mode, image.width, image.height, grayscale)
+
+
+def raw_args(args):
+    """(rawmode, stride, orientation) of a raw tile; PPM gives just the rawmode."""
+    if isinstance(args, str):
+        args = (args,)
+    return (*args, 0, 1)[:3]
+
+
+def band_decodable(image):
+    """Whether rows of `image` can be decoded without decoding the whole image."""
+    if image.mode not in RAW_MODE_BITS or not image.tile:
+        return False
+    for tile in image.tile:
+        codec_name, extents, _, args = tile
+        if codec_name != "raw":
+            return False
+        rawmode, _, orientation = raw_args(args)
+        if rawmode not in RAW_MODE_BITS or orientation != 1:  # E.g. bottom-up BMP
+            return False
+        if extents[0] != 0 or extents[2] != image.width:
+            return False
+    return True
+
+
+def decode_band(image, top, bottom):
+    """Decode rows `top` to `bottom` of a band-decodable, not yet loaded image."""
+    band = Image.new(image.mode, (image.width, bottom - top))
+    for codec_name, (x0, y0, x1, y1), offset, args in image.tile:
+        first, last = max(y0, top), min(y1, bottom)
+        if first >= last:
+            continue
+        rawmode, stride, _ = raw_args(args)
+        stride = stride or ((x1 - x0) * RAW_MODE_BITS[rawmode] + 7) // 8
+        image.fp.seek(offset + (first - y0) * stride)
+        data = image.fp.read((last - first) * stride)
+        rows = Image.frombytes(
+            image.mode, (x1 - x0, last - first), data, "raw", rawmode, stride
+        )
+        band.paste(rows, (0, first - top))
+    return band
+
+
+def crop_bands(image, bboxes, grayscale=False):
+    """Crop `bboxes` out of an image, decoding only the rows each one covers."""
+    crops = []
+    for left, top, right, bottom in bboxes:
+        top = min(max(top, 0), image.height - 1)
+        bottom = min(max(bottom, top + 1), image.height)
+        with reserve_memory(
+            decoded_bytes(image.mode, image.width, bottom - top, grayscale)
+        ):
+            band = decode_band(image, top, bottom)
+            if grayscale and band.mode not in ("1", "L"):
+                band = band.convert("L")
+            crops.append(band.crop((left, 0, right, bottom - top)))
+    return crops
@@ -0,0 +1,190 @@
+import csv
+import io
+import os
+import threading
+from typing import Dict, Tuple
+
+from create_ocr_data.checkpoints import register_before_commit
+from create_ocr_data.config import DEFAULT_METADATA_FLUSH_ROWS
+from create_ocr_data.metrics import count, timed_stage
+
+"""buffered metadata output
+
+A MetadataSink collects CSV rows per file and writes them in batches through
+handles it keeps open, instead of opening and closing every CSV for every
+page. Each batch for a file is a single append, so several worker processes
+can still share a work's CSVs. Optionally the same lines are also written to
+Parquet with typed columns.
+"""
+
+PARQUET_COLUMNS = [
+    ("work_id", "string"),
+    ("volume_id", "string"),
+    ("page_id", "string"),
+    ("line_image_name", "string"),
+    ("ocr_conf", "int16"),
+    ("tib_num", "bool_"),
+    ("non_bo_word", "bool_"),
+    ("non_bo_num", "bool_"),
+    ("text_length", "int32"),
+    ("text", "string"),
+    ("duplicate_of", "string"),
+]
+
+
+def create_csv_with_header(csv_file_path, header):
+    """Create `csv_file_path` holding only `header` unless it already exists.
+
+    The file is written aside and linked into place, so concurrent writers
+    never see it without its header.
+    """
+    if csv_file_path.exists():
+        return
+    csv_file_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = csv_file_path.with_name(f".{csv_file_path.name}.{os.getpid()}")
+    with tmp_path.open("w", newline="", encoding="utf-8") as csv_file:
+        csv.writer(csv_file).writerow(header)
+    try:
+        os.link(tmp_path, csv_file_path)
+    except FileExistsError:
+        pass
+    finally:
+        tmp_path.unlink()
+
+
+def encode_csv_rows(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode("utf-8")
+
+
+@timed_stage("write_metadata")
+def append_csv_rows(csv_file_path, header, rows):
+    """Append `rows` to a CSV in a single write, creating it with `header` first.
+
+    Several worker processes may append to the same CSV, so a page's rows
+    must go out in one append.
+    """
+    create_csv_with_header(csv_file_path, header)
+    if not rows:
+        return
+    data = encode_csv_rows(rows)
+    with csv_file_path.open("ab") as csv_file:
+        csv_file.write(data)
+    count("write_metadata", bytes_written=len(data))
+
+
+def parquet_schema():
+    import pyarrow as pa
+
+    return pa.schema(
+        [(name, getattr(pa, type_name)()) for name, type_name in PARQUET_COLUMNS]
+    )
+
+
+class MetadataSink:
+    """Per-process buffer of metadata rows, flushed in batches.
+
+    A lock guards the buffers, since the rows of a page may be added by a
+    writer thread while checkpoints flush the sink from the main thread.
+    """
+
+    def __init__(self, flush_rows=DEFAULT_METADATA_FLUSH_ROWS, parquet=False):
+        self.flush_rows = flush_rows
+        self.parquet = parquet
+        self.csv_rows = {}
+        self.csv_files = {}
+        self.parquet_rows = {}
+        self.parquet_writers = {}
+        self.pending = 0
+        self.lock = threading.RLock()
+
+    def add_csv_rows(self, csv_file_path, header, rows):
+        with self.lock:
+            if csv_file_path not in self.csv_files:
+                create_csv_with_header(csv_file_path, header)
+                # Unbuffered, so every flush of a file is one append
+                self.csv_files[csv_file_path] = open(csv_file_path, "ab", buffering=0)
+            self.csv_rows.setdefault(csv_file_path, []).extend(rows)
+            self.pending += len(rows)
+            if self.pending >= self.flush_rows:
+                self.flush()
+
+    def add_parquet_records(self, metadata_dir, records):
+        """Buffer typed line records (dicts keyed by PARQUET_COLUMNS names)."""
+        if not self.parquet:
+            return
+        with self.lock:
+            self.parquet_rows.setdefault(metadata_dir, []).extend(records)
+            self.pending += len(records)
+            if self.pending >= self.flush_rows:
+                self.flush()
+
+    @timed_stage("write_metadata")
+    def flush(self):
+        with self.lock:
+            for csv_file_path, rows in self.csv_rows.items():
+                if rows:
+                    data = encode_csv_rows(rows)
+                    self.csv_files[csv_file_path].write(data)
+                    count("write_metadata", bytes_written=len(data))
+            self.csv_rows = {}
+            for metadata_dir, records in self.parquet_rows.items():
+                if records:
+                    self._write_parquet(metadata_dir, records)
+            self.parquet_rows = {}
+            self.pending = 0
+
+    def _write_parquet(self, metadata_dir, records):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = parquet_schema()
+        if metadata_dir not in self.parquet_writers:
+            metadata_dir.mkdir(parents=True, exist_ok=True)
+            index = len(list(metadata_dir.glob(f"lines-{os.getpid()}-*.parquet")))
+            part_path = metadata_dir / f"lines-{os.getpid()}-{index:06d}.parquet"
+            self.parquet_writers[metadata_dir] = pq.ParquetWriter(part_path, schema)
+        table = pa.Table.from_pylist(records, schema=schema)
+        self.parquet_writers[metadata_dir].write_table(table)
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            for csv_file in self.csv_files.values():
+                csv_file.close()
+            for writer in self.parquet_writers.values():
+                writer.close()
+            self.csv_files = {}
+            self.parquet_writers = {}
+
+
+_sinks: Dict[Tuple[int, int, bool], MetadataSink] = {}
+
+
+def get_metadata_sink(
+    flush_rows=DEFAULT_METADATA_FLUSH_ROWS, parquet=False
+) -> MetadataSink:
+    """Return this process's metadata sink for the given settings."""
+    key = (os.getpid(), flush_rows, parquet)
+    if key not in _sinks:
+        _sinks[key] = MetadataSink(flush_rows, parquet)
+    return _sinks[key]
+
+
+def flush_metadata_sinks():
+    for key, sink in _sinks.items():
+        if key[0] == os.getpid():
+            sink.flush()
+
+
+def close_metadata_sinks():
+    """Flush and close every sink of this process; call at the end of a task."""
+    for key, sink in list(_sinks.items()):
+        if key[0] == os.getpid():
+            sink.close()
+        del _sinks[key]
+
+
+# Rows must reach disk before the checkpoints of their pages are committed.
+register_before_commit(flush_metadata_sinks)
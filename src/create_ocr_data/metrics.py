@@ -0,0 +1,168 @@
+import cProfile
+import json
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+from typing import Dict
+
+"""pipeline metrics
+
+Every process keeps counters per pipeline stage: calls, wall time, bytes
+read and written, lines and pages, and for queues the depth seen by each
+`get` (the mean depth is queue_depth / calls). Pool tasks hand their counters back with
+their result (see drain_metrics), and the parent adds them to a RunMetrics,
+which is exported as `metrics.json` and as a Prometheus textfile
+`metrics.prom`.
+"""
+
+COUNTERS = (
+    "calls",
+    "seconds",
+    "bytes_read",
+    "bytes_written",
+    "lines",
+    "pages",
+    "queue_depth",
+)
+METRIC_PREFIX = "create_ocr_data_stage"
+
+_stages: Dict[str, Dict[str, float]] = {}
+_stages_pid = None
+_lock = threading.Lock()  # Stages also run on writer and reader threads
+
+
+def stage_counters(stage):
+    """Return this process's counters of `stage`."""
+    global _stages, _stages_pid
+    if _stages_pid != os.getpid():  # Forked: start from zero
+        _stages = {}
+        _stages_pid = os.getpid()
+    counters = _stages.get(stage)
+    if counters is None:
+        counters = _stages[stage] = dict.fromkeys(COUNTERS, 0)
+    return counters
+
+
+def count(stage, **amounts):
+    """Add `amounts` (e.g. `lines=12`) to the counters of `stage`."""
+    with _lock:
+        counters = stage_counters(stage)
+        for name, amount in amounts.items():
+            counters[name] += amount
+
+
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        count(stage, calls=1, seconds=time.perf_counter() - start)
+
+
+def timed_stage(stage):
+    """Decorator counting the calls and wall time of a function as `stage`."""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def drain_metrics():
+    """Return this process's counters as `(pid, stages)` and reset them."""
+    global _stages
+    stage_counters("")  # Reset after a fork
+    stages = {stage: counters for stage, counters in _stages.items() if stage}
+    _stages = {}
+    return os.getpid(), stages
+
+
+def add_counters(total, stages):
+    for stage, counters in stages.items():
+        stage_total = total.setdefault(stage, dict.fromkeys(COUNTERS, 0))
+        for name, amount in counters.items():
+            stage_total[name] += amount
+
+
+class RunMetrics:
+    """Counters of a whole run, per stage and per worker process."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.stages = {}
+        self.workers = {}
+
+    def add(self, snapshot):
+        pid, stages = snapshot
+        add_counters(self.stages, stages)
+        add_counters(self.workers.setdefault(str(pid), {}), stages)
+
+    def summary(self):
+        return {
+            "started": self.started,
+            "elapsed_seconds": time.time() - self.started,
+            "stages": self.stages,
+            "workers": self.workers,
+        }
+
+    def prometheus_text(self):
+        lines = []
+        for name in COUNTERS:
+            metric = f"{METRIC_PREFIX}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for stage, counters in sorted(self.stages.items()):
+                lines.append(f'{metric}{{stage="{stage}"}} {counters[name]}')
+        metric = f"{METRIC_PREFIX}_worker_seconds_total"
+        lines.append(f"# TYPE {metric} counter")
+        for worker, stages in sorted(self.workers.items()):
+            for stage, counters in sorted(stages.items()):
+                lines.append(
+                    f'{metric}{{stage="{stage}",worker="{worker}"}} '
+                    f'{counters["seconds"]}'
+                )
+        return "\n".join(lines) + "\n"
+
+    def export(self, metrics_dir):
+        """Write `metrics.json` and `metrics.prom`, replacing them atomically."""
+        metrics_dir = Path(metrics_dir)
+        metrics_dir.mkdir(parents=True, exist_ok=True)
+        for name, text in (
+            ("metrics.json", json.dumps(self.summary(), indent=2, sort_keys=True)),
+            ("metrics.prom", self.prometheus_text()),
+        ):
+            tmp_path = metrics_dir / f".{name}.tmp"
+            tmp_path.write_text(text, encoding="utf-8")
+            os.replace(tmp_path, metrics_dir / name)
+
+
+def is_sampled(key, sample_rate):
+    """Deterministically pick about `sample_rate` of all keys."""
+    return zlib.crc32(str(key).encode("utf-8")) < sample_rate * 2**32
+
+
+@contextmanager
+def profile_page(key, sample_rate, profile_dir):
+    """Run the block under cProfile for a sampled subset of pages."""
+    if not sample_rate or not is_sampled(key, sample_rate):
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profile_dir = Path(profile_dir)
+        profile_dir.mkdir(parents=True, exist_ok=True)
+        crc = zlib.crc32(str(key).encode("utf-8"))
+        profiler.dump_stats(profile_dir / f"{Path(str(key)).stem}-{crc:08x}.prof")
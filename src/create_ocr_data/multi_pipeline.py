@@ -1,55 +1,388 @@
-from multiprocessing import Pool
+import multiprocessing
+import queue
+import time
+from collections import deque
 from pathlib import Path
+from typing import Dict
 
 from tqdm import tqdm
 
 from create_ocr_data.checkpoints import (
+    flush_checkpoints,
     load_checkpoints,
+    resolve_failures,
     save_checkpoint,
     save_corrupted_files,
 )
+from create_ocr_data.config import DEFAULT_CONFIG, PipelineConfig
 from create_ocr_data.extract_valid_image import organize_images_and_create_category_csvs
-from create_ocr_data.pipeline import process_work_folder
+from create_ocr_data.incremental import (
+    config_fingerprint,
+    page_digest,
+    page_key,
+    plan_work_pages,
+    remove_vanished_works,
+)
+from create_ocr_data.memory_budget import MemoryBudget, set_memory_budget
+from create_ocr_data.metrics import RunMetrics, drain_metrics, timed
+from create_ocr_data.page_pipeline import process_html_files_staged
+from create_ocr_data.pipeline import ImageIndex, process_html_files
+from create_ocr_data.sharding import (
+    estimate_pages,
+    shard_weights,
+    work_id_of,
+    write_summary,
+)
+from create_ocr_data.zip_source import (
+    is_zip_member,
+    plan_zip_volumes,
+    process_zip_pages,
+    zip_member_key,
+)
+
+# Upper bound on the number of pages handed to a worker in one task, so a
+# single huge volume is spread over the pool instead of pinning one process.
+MAX_PAGES_PER_TASK = 200
+
+
+def page_pool(num_processes, config=DEFAULT_CONFIG, context=None):
+    """Worker pool for page tasks, from the multiprocessing `context` if given.
+
+    Workers share the memory budget for decoded page images, and are
+    replaced after max_tasks_per_child tasks.
+    """
+    context = context or multiprocessing.get_context()
+    budget = None
+    if config.memory_budget_bytes:
+        budget = MemoryBudget(config.memory_budget_bytes, context)
+    return context.Pool(
+        processes=num_processes,
+        initializer=set_memory_budget,
+        initargs=(budget,),
+        maxtasksperchild=config.max_tasks_per_child,
+    )
+
+
+def is_hidden(path):
+    """Hidden entries, e.g. extraction staging directories, are not works."""
+    return path.name.startswith(".")
 
 
-def worker_task(args):
-    work, output_dir, checkpoints = args
+def page_task(args):
+    """Process a batch of pages; returns `(kind, work, volume, metrics, error)`."""
+    work, volume, chain, pages, output_dir, config, digests = args
+    try:
+        if chain is None and config.pipeline_depth:
+            process_html_files_staged(pages, (), output_dir, config, digests)
+        elif chain is None:
+            process_html_files(pages, (), output_dir, config, digests)
+        else:
+            process_zip_pages(work, chain, pages, (), output_dir, config)
+        flush_checkpoints()
+        return "page", work, volume, drain_metrics(), None
+    except Exception as e:
+        save_corrupted_files(volume, e, stage="volume")
+        flush_checkpoints()  # Keep the pages done before the failure
+        return "page", work, volume, drain_metrics(), str(e)
+
+
+def finalize_work(args):
+    """Build the per-category outputs of a work once all its pages are done."""
+    work, output_dir, config = args
     work = Path(work)
-    work_id = work.name
+    work_id = work.stem if is_zip_member(work.name) else work.name
     output_work_dir = Path(output_dir / work_id)
     csv_file_path = output_work_dir / f"{work_id}_90-100%.csv"
     images_base_path = output_work_dir
     output_base = output_work_dir / "filtered_images"
-    if f"{str(work)}" in checkpoints:
-        return
     try:
-        process_work_folder(work, output_dir)
-        organize_images_and_create_category_csvs(
-            csv_file_path, images_base_path, output_base
-        )
+        # In single-pass mode the category outputs were written page by page;
+        # without a 90-100% CSV no line of the work made it into a category
+        if not config.single_pass and csv_file_path.exists():
+            with timed("organize_categories"):
+                organize_images_and_create_category_csvs(
+                    csv_file_path,
+                    images_base_path,
+                    output_base,
+                    copy_images=config.output_mode == "files",
+                )
         save_checkpoint(work)
+        flush_checkpoints()
+        return "work", str(work), None, drain_metrics(), None
     except Exception as e:
-        save_corrupted_files(work, str(e))
+        save_corrupted_files(work, e, stage="work")
         print(f"Error processing {work}: {e}")
+        return "work", str(work), None, drain_metrics(), str(e)
+
 
+def plan_page_tasks(
+    work_paths,
+    output_dir: Path,
+    checkpoints,
+    max_pages_per_task,
+    config: PipelineConfig = DEFAULT_CONFIG,
+    skip_folders=False,
+):
+    """Split every unfinished work into page batches of at most `max_pages_per_task`.
 
-# Note: Updated the 'elif' for PDF to TXT and JPEG conversion to fit the expected arguments structure of `process_pdf`.
-# Ensure the `process_pdf` function is adapted to handle the directory paths correctly, especially if it expects
-# specific subdirectories for images and text.
+    A work is either a folder or a work ZIP, which is read without extracting.
+    Returns the page tasks and, per work, the volumes that still need a
+    checkpoint mapped to their number of page tasks.
+    """
+    tasks = []
+    work_volumes = {}
+    for work in work_paths:
+        if str(work) in checkpoints:
+            continue
+        if work.is_dir() and skip_folders:
+            continue
+        if work.is_dir():
+            volume_pages = {
+                str(volume): [(None, sorted(map(str, volume.rglob("*.html"))))]
+                for volume in sorted(work.iterdir())
+                if volume.is_dir() and not is_hidden(volume)
+            }
+        elif is_zip_member(work.name):
+            volume_pages = plan_zip_volumes(work)
+        else:
+            continue
+        volumes = {}
+        for volume, archives in volume_pages.items():
+            if volume in checkpoints:
+                continue
+            volumes[volume] = 0
+            for chain, pages in archives:
+                if chain is None:
+                    pages = [page for page in pages if page not in checkpoints]
+                else:
+                    pages = [
+                        page
+                        for page in pages
+                        if zip_member_key(work, chain, page[0]) not in checkpoints
+                    ]
+                for start in range(0, len(pages), max_pages_per_task):
+                    batch = pages[start : start + max_pages_per_task]
+                    tasks.append(
+                        (str(work), volume, chain, batch, output_dir, config, None)
+                    )
+                    volumes[volume] += 1
+        work_volumes[str(work)] = volumes
+    return tasks, work_volumes
 
 
-def process_all_works(works: Path, output_dir: Path, num_processes: int = 10):
+def digest_task(args):
+    """Digest every page of a volume folder (incremental mode)."""
+    work, volume, html_files, fingerprint = args
+    image_index = ImageIndex()
+    pages = [
+        (
+            html_file,
+            page_key(html_file),
+            page_digest(html_file, fingerprint, image_index),
+        )
+        for html_file in html_files
+    ]
+    return work, volume, pages
+
+
+def plan_incremental_tasks(
+    work_paths,
+    output_dir: Path,
+    pool,
+    max_pages_per_task,
+    config: PipelineConfig = DEFAULT_CONFIG,
+):
+    """Plan page batches of work folders from content digests, not checkpoints.
+
+    Pages are digested on `pool`; works with new, changed or removed pages
+    get their stale outputs cleared and are planned like plan_page_tasks.
+    """
+    fingerprint = config_fingerprint(config)
+    digest_tasks = [
+        (str(work), str(volume), sorted(map(str, volume.rglob("*.html"))), fingerprint)
+        for work in work_paths
+        if work.is_dir()
+        for volume in sorted(work.iterdir())
+        if volume.is_dir() and not is_hidden(volume)
+    ]
+    work_pages: Dict[str, Dict[str, list]] = {}
+    for work, volume, pages in pool.imap(digest_task, digest_tasks):
+        work_pages.setdefault(work, {})[volume] = pages
+
+    tasks = []
+    work_volumes = {}
+    for work, volume_pages in work_pages.items():
+        work_id = Path(work).name
+        digested_pages = [page for pages in volume_pages.values() for page in pages]
+        changed, removed_outputs = plan_work_pages(
+            work_id, digested_pages, output_dir / work_id
+        )
+        if not changed and not removed_outputs:
+            continue
+        changed_files = {html_file for html_file, _, _ in changed}
+        volumes = {}
+        for volume, pages in volume_pages.items():
+            pages = [page for page in pages if page[0] in changed_files]
+            volumes[volume] = 0
+            for start in range(0, len(pages), max_pages_per_task):
+                batch = pages[start : start + max_pages_per_task]
+                digests = {html_file: (key, digest) for html_file, key, digest in batch}
+                html_files = [html_file for html_file, _, _ in batch]
+                tasks.append(
+                    (work, volume, None, html_files, output_dir, config, digests)
+                )
+                volumes[volume] += 1
+        work_volumes[work] = volumes
+    return tasks, work_volumes
+
+
+def process_all_works(
+    works: Path,
+    output_dir: Path,
+    num_processes: int = 10,
+    max_pages_per_task: int = MAX_PAGES_PER_TASK,
+    config: PipelineConfig = DEFAULT_CONFIG,
+    shard=None,
+    pool=None,
+):
+    """Process every work (folder or work ZIP) under `works` into `output_dir`.
+
+    With `shard` as `(shard_index, shard_count)` only the works assigned to
+    that shard are processed, and a shard summary is written to `output_dir`
+    (see sharding.py). Pages are processed on `pool`, a page_pool of
+    `num_processes` workers, or on a new one.
+    """
+    if pool is None:
+        with page_pool(num_processes, config) as pool:
+            return process_all_works(
+                works,
+                output_dir,
+                num_processes,
+                max_pages_per_task,
+                config,
+                shard,
+                pool,
+            )
     checkpoints = load_checkpoints()
-    tasks = [(work, output_dir, checkpoints) for work in works.iterdir()]
-
-    num_processes = num_processes
-    with Pool(processes=num_processes) as pool:
-        list(
-            tqdm(
-                pool.imap(worker_task, tasks),
-                total=len(tasks),
-                desc="Creating OCR data...",
+    work_paths = [work for work in sorted(works.iterdir()) if not is_hidden(work)]
+    if config.incremental:
+        removed = remove_vanished_works(
+            [work_id_of(work.name) for work in work_paths], output_dir
+        )
+        if removed:
+            print(f"Removed the outputs of {len(removed)} works no longer in {works}")
+    if shard is not None:
+        weights = {
+            work_id_of(work.name): estimate_pages(work)
+            for work in work_paths
+            if work.is_dir() or is_zip_member(work.name)
+        }
+        weights = shard_weights(weights, *shard)
+        work_paths = [work for work in work_paths if work_id_of(work.name) in weights]
+    tasks, work_volumes = plan_page_tasks(
+        work_paths,
+        output_dir,
+        checkpoints,
+        max_pages_per_task,
+        config,
+        skip_folders=config.incremental,
+    )
+    if config.incremental:
+        folder_tasks, folder_volumes = plan_incremental_tasks(
+            work_paths, output_dir, pool, max_pages_per_task, config
+        )
+        tasks += folder_tasks
+        work_volumes.update(folder_volumes)
+    pending_tasks = deque(tasks)
+    volume_remaining = {}
+    work_remaining = {}
+    for work, volumes in work_volumes.items():
+        volume_remaining.update(volumes)
+        work_remaining[work] = sum(volumes.values())
+
+    # Tasks are submitted through a small window rather than all at once, so
+    # a work's finalisation is queued as soon as its last page is done instead
+    # of behind every remaining page of the corpus.
+    window = num_processes * 2
+    results: queue.Queue = queue.Queue()
+    in_flight = 0
+    run_metrics = RunMetrics()
+    last_export = time.monotonic()
+
+    with tqdm(total=len(work_volumes), desc="Creating OCR data...") as progress:
+
+        def submit(func, args, kind, work, volume=None):
+            # A task that raises is queued without metrics, to be recorded
+            # here: checkpoint writes stay in this thread.
+            nonlocal in_flight
+            pool.apply_async(
+                func,
+                (args,),
+                callback=results.put,
+                error_callback=lambda e: results.put((kind, work, volume, None, e)),
             )
+            in_flight += 1
+
+        failed_works = set()
+        failed_volumes = set()
+
+        for work, volumes in work_volumes.items():
+            for volume, count in volumes.items():
+                if count == 0:
+                    save_checkpoint(Path(volume))
+            if work_remaining[work] == 0:
+                submit(finalize_work, (work, output_dir, config), "work", work)
+
+        while pending_tasks or in_flight:
+            while pending_tasks and in_flight < window:
+                task = pending_tasks.popleft()
+                submit(page_task, task, "page", task[0], task[1])
+            kind, work, volume, metrics, error = results.get()
+            in_flight -= 1
+            if metrics is None:
+                stage = "volume" if kind == "page" else "work"
+                save_corrupted_files(volume or work, error, stage=stage)
+            else:
+                run_metrics.add(metrics)
+            if kind == "work" and error is None:
+                resolve_failures([work])
+            if (
+                config.metrics_dir is not None
+                and time.monotonic() - last_export >= config.metrics_interval
+            ):
+                run_metrics.export(config.metrics_dir)
+                last_export = time.monotonic()
+            if kind == "work":
+                progress.update()
+                continue
+            if error is not None:  # Left unfinished for the next run
+                failed_volumes.add(volume)
+                failed_works.add(work)
+            volume_remaining[volume] -= 1
+            if volume_remaining[volume] == 0 and volume not in failed_volumes:
+                save_checkpoint(Path(volume))
+                resolve_failures([volume])
+            work_remaining[work] -= 1
+            if work_remaining[work] == 0 and work in failed_works:
+                progress.update()
+            elif work_remaining[work] == 0:
+                submit(finalize_work, (work, output_dir, config), "work", work)
+    flush_checkpoints()
+    if config.metrics_dir is not None:
+        run_metrics.export(config.metrics_dir)
+    if shard is not None:
+        checkpoints = load_checkpoints()
+        finished = {
+            work_id_of(work.name) for work in work_paths if str(work) in checkpoints
+        }
+        shard_index, shard_count = shard
+        write_summary(
+            output_dir,
+            shard_index,
+            shard_count,
+            weights,
+            finished,
+            stages=run_metrics.stages,
         )
 
 
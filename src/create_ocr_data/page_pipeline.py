@@ -0,0 +1,179 @@
+import io
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Deque, Tuple
+
+from PIL import Image
+
+from create_ocr_data.checkpoints import save_corrupted_files
+from create_ocr_data.config import DEFAULT_CONFIG
+from create_ocr_data.line_archive import close_line_archives
+from create_ocr_data.metadata_sink import close_metadata_sinks
+from create_ocr_data.metrics import count, profile_page, timed, timed_stage
+from create_ocr_data.pipeline import (
+    ImageIndex,
+    analyze_ocr_texts,
+    crop_line_images,
+    filter_lines,
+    find_corresponding_image_path,
+    find_image_files,
+    line_images_dir,
+    mark_page_done,
+    parse_html,
+    store_page_lines,
+    work_and_volume_ids,
+)
+
+"""staged page pipeline
+
+Overlaps the I/O and CPU work of a batch of pages inside one worker:
+
+- a reader thread prefetches the hOCR and image bytes of upcoming pages;
+- the calling thread parses, crops, encodes and analyzes them;
+- a writer thread writes the line images and appends the metadata rows.
+
+The stages are connected by queues of at most `config.pipeline_depth`
+pages, so a slow stage holds the others back instead of letting pages pile
+up in memory. Time spent waiting on a neighbouring stage is recorded in the
+read_stall and write_stall metrics, along with the queue depths.
+"""
+
+
+@timed_stage("read_pages")
+def read_page(html_file, image_index=None):
+    """Reader stage: the hOCR and page image bytes of a page."""
+    html_file = Path(html_file)
+    html_bytes = html_file.read_bytes()
+    image_path = find_corresponding_image_path(html_file)
+    image_files = find_image_files(image_path, image_index)
+    image_file = image_files[0] if image_files else None
+    image_bytes = image_file.read_bytes() if image_file else None
+    count(
+        "read_pages",
+        pages=1,
+        bytes_read=len(html_bytes) + len(image_bytes or b""),
+    )
+    return html_file, html_bytes, image_path, image_file, image_bytes
+
+
+def read_pages(html_files, read_queue):
+    image_index = ImageIndex()
+    for html_file in html_files:
+        try:
+            read_queue.put(read_page(html_file, image_index))
+        except Exception as e:
+            read_queue.put((html_file, e))
+    read_queue.put(None)
+
+
+def prepare_page(page, output_base, config=DEFAULT_CONFIG):
+    """CPU stage: parse, crop, encode and analyze a prefetched page.
+
+    Returns the arguments of write_page, or None if the page is skipped.
+    """
+    html_file, html_bytes, image_path, image_file, image_bytes = page
+    ocr_data = parse_html(io.StringIO(html_bytes.decode("utf-8")), config.html_parser)
+    if ocr_data is None:  # Skip if parsing failed
+        return None
+    work_id, volume_id = work_and_volume_ids(image_path)
+    ocr_data = filter_lines(ocr_data, config.line_filter)
+    if not ocr_data:  # Nothing to crop, but the page is done
+        return ocr_data, output_base, work_id, volume_id, image_path.name, config
+    if image_file is None:
+        save_corrupted_files(
+            image_path,
+            f"No image file found for {image_path}",
+            stage="image",
+            error_type="FileNotFoundError",
+        )
+        return None
+    image = Image.open(io.BytesIO(image_bytes))
+    ocr_data = crop_line_images(
+        image,
+        ocr_data,
+        None,
+        volume_id,
+        image_file.stem,
+        image_file.suffix,
+        config,
+        work_id,
+    )
+    ocr_data = analyze_ocr_texts(ocr_data)
+    return ocr_data, output_base, work_id, volume_id, image_path.name, config
+
+
+@timed_stage("write_pages")
+def write_page(ocr_data, output_base, work_id, volume_id, page_id, config):
+    """Writer stage: write a page's line images and store its lines."""
+    output_dir = line_images_dir(output_base, work_id, config)
+    if output_dir is not None:
+        bytes_written = 0
+        for line in ocr_data:
+            page_output_dir = output_dir / line["image_page_id"]
+            page_output_dir.mkdir(parents=True, exist_ok=True)
+            image_bytes = line.pop("image_bytes")
+            (page_output_dir / line["line_image_name"]).write_bytes(image_bytes)
+            bytes_written += len(image_bytes)
+        count("write_pages", pages=1, bytes_written=bytes_written)
+    store_page_lines(ocr_data, output_base, work_id, volume_id, page_id, config)
+    return work_id
+
+
+def process_html_files_staged(
+    html_files, checkpoints, output_base, config=DEFAULT_CONFIG, digests=None
+):
+    """Staged counterpart of process_html_files."""
+    html_files = [
+        html_file for html_file in html_files if str(html_file) not in checkpoints
+    ]
+    read_queue: queue.Queue = queue.Queue(maxsize=config.pipeline_depth)
+    reader = threading.Thread(
+        target=read_pages, args=(html_files, read_queue), daemon=True
+    )
+    reader.start()
+    writes: Deque[Tuple[Path, Future]] = deque()
+
+    def finish_write():
+        html_file, future = writes.popleft()
+        try:
+            work_id = future.result()
+        except Exception as e:
+            save_corrupted_files(html_file, e, stage="write")
+            return
+        page_digest = None if digests is None else digests[str(html_file)]
+        mark_page_done(html_file, work_id, page_digest)
+
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        while True:
+            with timed("read_stall"):
+                count("read_stall", queue_depth=read_queue.qsize())
+                page = read_queue.get()
+            if page is None:
+                break
+            html_file = page[0]
+            if isinstance(page[1], Exception):
+                save_corrupted_files(html_file, page[1], stage="read")
+                continue
+            try:
+                with profile_page(
+                    html_file, config.profile_sample_rate, config.profile_dir
+                ):
+                    prepared = prepare_page(page, output_base, config)
+            except Exception as e:
+                save_corrupted_files(html_file, e)
+                continue
+            if prepared is None:
+                continue
+            while len(writes) >= config.pipeline_depth:
+                with timed("write_stall"):
+                    count("write_stall", queue_depth=len(writes))
+                    finish_write()
+            writes.append((html_file, writer.submit(write_page, *prepared)))
+        while writes:
+            finish_write()
+    reader.join()
+    close_line_archives()
+    close_metadata_sinks()
@@ -1,18 +1,94 @@
-import csv
+import io
+import os
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
+from typing import Dict, List
 
 from botok import WordTokenizer
 from bs4 import BeautifulSoup
 from PIL import Image, UnidentifiedImageError
 
 from create_ocr_data.checkpoints import (
+    flush_checkpoints,
     load_checkpoints,
     save_checkpoint,
     save_corrupted_files,
+    save_page_digest,
 )
+from create_ocr_data.config import DEFAULT_CONFIG, HTML_PARSERS, IMAGE_CODECS
+from create_ocr_data.dedup import dedup_lines
+from create_ocr_data.extract_valid_image import (
+    CATEGORY_CSV_COLUMNS,
+    CATEGORY_FOLDERS,
+    MIN_TEXT_LENGTH,
+    line_category,
+)
+from create_ocr_data.hocr_parser import open_html_file, parse_hocr
+from create_ocr_data.line_archive import archive_line, close_line_archives
+from create_ocr_data.line_classifier import fast_line_flags, page_char_classes
+from create_ocr_data.memory_budget import (
+    band_decodable,
+    crop_bands,
+    estimate_decoded_bytes,
+    reserve_memory,
+)
+from create_ocr_data.metadata_sink import (
+    append_csv_rows,
+    close_metadata_sinks,
+    get_metadata_sink,
+)
+from create_ocr_data.metrics import count, profile_page, timed, timed_stage
+
+# Number of distinct line texts whose flags are memoized per process. Headers,
+# page numbers and boilerplate lines repeat across volumes and hit the cache.
+LINE_CACHE_SIZE = 100_000
+
+# Preferred page image when a page has several, e.g. a TIFF master and a
+# JPEG preview of it.
+IMAGE_EXTENSION_PRIORITY = (
+    ".tif",
+    ".tiff",
+    ".png",
+    ".jpg",
+    ".jpeg",
+    ".jp2",
+    ".webp",
+    ".bmp",
+    ".gif",
+)
+
+CONFIDENCE_CATEGORIES = ["51-89%", "90-100%", "0-50%"]
+
+CSV_HEADER = [
+    "Work ID",
+    "Volume ID",
+    "Page ID",
+    "Line Image Name",
+    "OCR Confidence",
+    "Tibetan Num",
+    "Non Bo Word",
+    "Non Bo Num",
+    "Text_length",
+    "Text",
+]
 
-wt = WordTokenizer()
+# With dedup "tag" the rows also name the line they duplicate.
+TAGGED_CSV_HEADER = CSV_HEADER + ["Duplicate Of"]
+
+_word_tokenizer = None
+_encoder_pool = None
+_encoder_pool_key = None
+
+
+def get_word_tokenizer():
+    """Return this process's botok tokenizer, loading its dictionary on first use."""
+    global _word_tokenizer
+    if _word_tokenizer is None:
+        _word_tokenizer = WordTokenizer()
+    return _word_tokenizer
 
 
 def latin_num_exists(text):
@@ -26,30 +102,60 @@ def latin_num_exists(text):
     return match is not None
 
 
+@lru_cache(maxsize=LINE_CACHE_SIZE)
+def classify_line(text):
+    """Return the `(non_bo_word, tib_num, non_bo_num)` flags of a line of text.
+
+    Results are memoized; `classify_line.cache_info()` reports hits and misses.
+    """
+    tokens = get_word_tokenizer().tokenize(text)
+    non_bo_num = False
+    non_bo_word = False
+    tib_num = False
+    for token in tokens:
+        if token.chunk_type in ["LATIN", "CJK", "OTHER"]:
+            non_bo_word = True
+            if token.chunk_type == "LATIN" and latin_num_exists(token.text):
+                non_bo_num = True
+        if token.chunk_type == "NUM":
+            tib_num = True
+    return non_bo_word, tib_num, non_bo_num
+
+
+@timed_stage("analyze_ocr_texts")
 def analyze_ocr_texts(ocr_data):
+    char_classes = page_char_classes(line["text"] for line in ocr_data)
     for line in ocr_data:
-        tokens = wt.tokenize(line["text"])
-        non_bo_num = False
-        non_bo_word = False
-        tib_num = False
-        for token in tokens:
-            if token.chunk_type in ["LATIN", "CJK", "OTHER"]:
-                non_bo_word = True
-                if token.chunk_type == "LATIN" and latin_num_exists(token.text):
-                    non_bo_num = True
-            if token.chunk_type == "NUM":
-                tib_num = True
+        flags = fast_line_flags(line["text"], char_classes)
+        if flags is None:  # Mixed or numeric lines need the botok tokenizer
+            flags = classify_line(line["text"])
+        non_bo_word, tib_num, non_bo_num = flags
         line["text length"] = len(line["text"])
         line["non_bo_word"] = non_bo_word
         line["tib_num"] = tib_num
         line["non_bo_num"] = non_bo_num
+    count("analyze_ocr_texts", lines=len(ocr_data))
     return ocr_data
 
 
-def parse_html(html_file_path):
-    """Parse HTML file to extract OCR data including OCR confidence."""
+@timed_stage("parse_html")
+def parse_html(html_file_path, parser="bs4"):
+    """Parse HTML file to extract OCR data including OCR confidence.
+
+    `html_file_path` may also be an open text file, e.g. an archive member.
+    `parser` selects the BeautifulSoup parser ("bs4") or the single-pass
+    streaming hOCR parser ("stream"); both return the same records.
+    """
+    if parser not in HTML_PARSERS:
+        raise ValueError(f"Unknown HTML parser: {parser}")
     try:
-        with open(html_file_path, encoding="utf-8") as file:
+        if isinstance(html_file_path, (str, os.PathLike)):
+            count("parse_html", bytes_read=os.path.getsize(html_file_path))
+        if parser == "stream":
+            ocr_data = parse_hocr(html_file_path)
+            count("parse_html", pages=1, lines=len(ocr_data))
+            return ocr_data
+        with open_html_file(html_file_path) as file:
             soup = BeautifulSoup(file, "html.parser")
             ocr_data = []
             for line in soup.find_all("span", {"class": "ocr_line"}):
@@ -63,12 +169,56 @@ def parse_html(html_file_path):
                         line["title"].split("x_wconf")[1].split(";")[0].strip()
                     )
                 ocr_data.append({"bbox": bbox, "text": text, "ocr_conf": ocr_conf})
+        count("parse_html", pages=1, lines=len(ocr_data))
         return ocr_data
     except Exception as e:
         print(f"Error processing {html_file_path}: {e}")
         return None
 
 
+def line_rejection(line, line_filter, page_size=None):
+    """Why `line_filter` rejects a parsed line, or None if it is kept."""
+    ocr_conf = line.get("ocr_conf") or 0
+    if not line_filter.min_confidence <= ocr_conf <= line_filter.max_confidence:
+        return "confidence"
+    text_length = len(line["text"])
+    if text_length < line_filter.min_text_length:
+        return "text_length"
+    if line_filter.max_text_length is not None:
+        if text_length > line_filter.max_text_length:
+            return "text_length"
+    if line_filter.check_bbox:
+        left, top, right, bottom = line["bbox"]
+        if right <= left or bottom <= top:
+            return "bbox"
+        if page_size is not None:
+            width, height = page_size
+            if left < 0 or top < 0 or right > width or bottom > height:
+                return "bbox"
+    return None
+
+
+def filter_lines(ocr_data, line_filter, page_size=None):
+    """Drop the lines of a parsed page rejected by `line_filter`, if any.
+
+    Lines keep their position on the page as `line["line_number"]`, so they
+    are named as they would be without a filter. The out-of-page check needs
+    the `(width, height)` of the page image.
+    """
+    if line_filter is None:
+        return ocr_data
+    kept = []
+    for line_number, line in enumerate(ocr_data, start=1):
+        line.setdefault("line_number", line_number)
+        reason = line_rejection(line, line_filter, page_size)
+        if reason is None:
+            kept.append(line)
+        else:
+            count(f"rejected_lines_{reason}", lines=1)
+    count("rejected_lines", lines=len(ocr_data) - len(kept))
+    return kept
+
+
 def find_corresponding_image_path(html_file_path):
     html_file_path = Path(html_file_path)
     parts = html_file_path.parts
@@ -78,154 +228,509 @@ def find_corresponding_image_path(html_file_path):
     return image_path
 
 
-def find_image_files(image_path_pattern):
-    """Find image files matching a pattern."""
-    return list(Path(image_path_pattern.parent).glob(f"{image_path_pattern.name}.*"))
+def image_priority(image_file):
+    """Sort key preferring page image extensions in IMAGE_EXTENSION_PRIORITY order."""
+    suffix = image_file.suffix.lower()
+    if suffix in IMAGE_EXTENSION_PRIORITY:
+        return IMAGE_EXTENSION_PRIORITY.index(suffix), image_file.name
+    return len(IMAGE_EXTENSION_PRIORITY), image_file.name
+
+
+class ImageIndex:
+    """Page images of `images` directories, each listed at most once.
+
+    A volume's directory is scanned on its first lookup and its files are
+    indexed by stem, so finding the image of every page of a batch (or
+    finding that it has none) costs one directory listing per volume rather
+    than a glob per page.
+    """
+
+    def __init__(self):
+        self.directories = {}
+
+    def directory(self, images_dir):
+        index = self.directories.get(images_dir)
+        if index is None:
+            index = {}
+            with timed("index_images"):
+                try:
+                    with os.scandir(images_dir) as entries:
+                        for entry in entries:
+                            if entry.is_file():
+                                image_file = images_dir / entry.name
+                                index.setdefault(image_file.stem, []).append(image_file)
+                except FileNotFoundError:
+                    pass
+                for image_files in index.values():
+                    image_files.sort(key=image_priority)
+            self.directories[images_dir] = index
+        return index
+
+    def find(self, image_path):
+        return list(self.directory(image_path.parent).get(image_path.name, ()))
+
+
+def find_image_files(image_path_pattern, image_index=None):
+    """Find the image files of a page, preferred extension first.
+
+    Looks the page up in `image_index` when given instead of globbing its
+    directory.
+    """
+    if image_index is not None:
+        return image_index.find(image_path_pattern)
+    image_files = Path(image_path_pattern.parent).glob(f"{image_path_pattern.name}.*")
+    return sorted(image_files, key=image_priority)
+
+
+def encode_image(image, save_params):
+    """Encode a PIL image to bytes with the given save parameters."""
+    buffer = io.BytesIO()
+    image.save(buffer, **save_params)
+    return buffer.getvalue()
+
+
+def line_image_codec(source_suffix, config=DEFAULT_CONFIG):
+    """Return the suffix and PIL save parameters used for line images."""
+    codec = IMAGE_CODECS[config.image_codec]
+    if codec is None:
+        image_format = Image.registered_extensions()[source_suffix.lower()]
+        return source_suffix, {"format": image_format}
+    return codec
+
+
+def get_encoder_pool(config=DEFAULT_CONFIG):
+    """Return this process's thread pool for encoding line images.
+
+    The pool is rebuilt when `config.encoder_threads` differs from the
+    previous call's.
+    """
+    global _encoder_pool, _encoder_pool_key
+    key = (os.getpid(), config.encoder_threads)
+    if _encoder_pool is None or _encoder_pool_key != key:
+        if _encoder_pool is not None and _encoder_pool_key[0] == os.getpid():
+            _encoder_pool.shutdown(wait=False)  # Running encodes still finish
+        _encoder_pool = ThreadPoolExecutor(max_workers=config.encoder_threads)
+        _encoder_pool_key = key
+    return _encoder_pool
+
+
+def save_line_image(cropped_image, output_path, save_params):
+    """Encode a line crop, writing it to `output_path` unless that is None.
+
+    Returns the encoded bytes.
+    """
+    image_bytes = encode_image(cropped_image, save_params)
+    if output_path is not None:
+        output_path.write_bytes(image_bytes)
+    return image_bytes
+
+
+@timed_stage("crop_line_images")
+def crop_line_images(
+    image,
+    ocr_data,
+    output_dir,
+    volume_id,
+    page_id,
+    suffix,
+    config=DEFAULT_CONFIG,
+    work_id=None,
+):
+    """Crop every OCR line out of an opened page image and save it.
+
+    The page is decoded once, every line is cropped from that buffer and the
+    crops are encoded by a thread pool. With `output_dir` None the encoded
+    crops are kept in `line["image_bytes"]` instead of being written to disk.
+
+    Decoding first reserves the page's decoded size from the process's
+    memory budget; pages above `config.max_decoded_image_bytes` are cropped
+    band by band instead when their format allows it (see memory_budget.py).
+    With `config.dedup` set, lines of work `work_id` already in the dedup
+    index are dropped or tagged before they are encoded (see dedup.py).
+    """
+    ocr_data = filter_lines(ocr_data, config.line_filter, image.size)
+    if not ocr_data:  # Every line was outside the page
+        return ocr_data
+    start = time.perf_counter()
+    needed = estimate_decoded_bytes(image, config.grayscale)
+    if needed > config.max_decoded_image_bytes and band_decodable(image):
+        crops = crop_bands(image, [line["bbox"] for line in ocr_data], config.grayscale)
+    else:
+        with reserve_memory(needed):
+            image.load()  # Decode the page exactly once
+            if config.grayscale and image.mode not in ("1", "L"):
+                image = image.convert("L")
+            crops = [image.crop(line["bbox"]) for line in ocr_data]
+    decoded = time.perf_counter()
+
+    image_page_id = f"{volume_id}{page_id[-4:]}"
+    suffix, save_params = line_image_codec(suffix, config)
+    for i, line in enumerate(ocr_data, start=1):
+        line_image_name = f"{image_page_id}_{line.get('line_number', i):04d}{suffix}"
+        line["image_page_id"] = image_page_id
+        line["line_image_name"] = line_image_name
+    if config.dedup is not None:
+        ocr_data, crops = dedup_lines(ocr_data, crops, work_id, config)
+
+    # Construct the directory for the current page images
+    if output_dir is not None and ocr_data:
+        page_output_dir = output_dir / image_page_id
+        page_output_dir.mkdir(parents=True, exist_ok=True)  # Create it once per page
 
+    jobs = []
+    for line, crop in zip(ocr_data, crops):
+        output_path = (
+            None if output_dir is None else page_output_dir / line["line_image_name"]
+        )
+        jobs.append((crop, output_path))
+    cropped = time.perf_counter()
 
-def crop_and_save_line_images(image_file_path, ocr_data, output_dir, volume_id):
+    encoder_pool = get_encoder_pool(config)
+    encoded_images = encoder_pool.map(
+        lambda job: save_line_image(job[0], job[1], save_params), jobs
+    )
+    bytes_written = 0
+    for line, image_bytes in zip(ocr_data, encoded_images):
+        bytes_written += len(image_bytes)
+        if output_dir is None:
+            line["image_bytes"] = image_bytes
+    encoded = time.perf_counter()
+    count(
+        "crop_line_images",
+        pages=1,
+        lines=len(ocr_data),
+        bytes_written=bytes_written if output_dir is not None else 0,
+    )
+
+    if config.report_page_timing:
+        print(
+            f"{image_page_id}: {len(ocr_data)} lines, decode {decoded - start:.3f}s, "
+            f"crop {cropped - decoded:.3f}s, encode {encoded - cropped:.3f}s"
+        )
+    return ocr_data
+
+
+def crop_and_save_line_images(
+    image_file_path,
+    ocr_data,
+    output_dir,
+    volume_id,
+    config=DEFAULT_CONFIG,
+    image_index=None,
+    work_id=None,
+):
     """Crop and save line images from a page image based on OCR data."""
     try:
-        # Assuming find_image_files is a function you've defined to locate image files.
-        image_files = find_image_files(image_file_path)
+        image_files = find_image_files(image_file_path, image_index)
         if not image_files:
             raise FileNotFoundError(f"No image file found for {image_file_path}")
+        count("crop_line_images", bytes_read=image_files[0].stat().st_size)
         image = Image.open(image_files[0])
-        page_id = image_files[0].stem
-
-        # Construct the directory for the current page images
-        image_page_id = f"{volume_id}{page_id[-4:]}"
-        page_output_dir = output_dir / image_page_id
-        page_output_dir.mkdir(
-            parents=True, exist_ok=True
-        )  # Create it only once per page
-
-        for i, line in enumerate(ocr_data, start=1):
-            line_image_id = f"{image_page_id}_{i:04d}"
-            output_path = page_output_dir / f"{line_image_id}{image_files[0].suffix}"
-            cropped_image = image.crop(line["bbox"])
-            cropped_image.save(output_path)
-            line["image_page_id"] = image_page_id
-            line["line_image_name"] = output_path.name
-
-        return ocr_data
+        return crop_line_images(
+            image,
+            ocr_data,
+            output_dir,
+            volume_id,
+            image_files[0].stem,
+            image_files[0].suffix,
+            config,
+            work_id,
+        )
     except UnidentifiedImageError as e:
-        save_corrupted_files(image_file_path, f"UnidentifiedImageError {str(e)}")
+        save_corrupted_files(
+            image_file_path,
+            f"UnidentifiedImageError {str(e)}",
+            stage="image",
+            error_type="UnidentifiedImageError",
+        )
     except Exception as e:
-        save_corrupted_files(image_file_path, str(e))
+        save_corrupted_files(image_file_path, e, stage="image")
     return None
 
 
+def confidence_category(ocr_conf):
+    """Return the confidence band of a line; lines without confidence go to 0-50%."""
+    if ocr_conf and 51 <= ocr_conf <= 89:
+        return "51-89%"
+    if ocr_conf and 90 <= ocr_conf <= 100:
+        return "90-100%"
+    return "0-50%"
+
+
+def csv_row(line, work_id, volume_id):
+    ocr_conf = line.get("ocr_conf")
+    return [
+        work_id,
+        volume_id,
+        line["image_page_id"],
+        line.get("line_image_name", "No Image"),
+        ocr_conf if ocr_conf else "No Confidence",
+        line.get("tib_num"),
+        line.get("non_bo_word"),
+        line.get("non_bo_num"),
+        line.get("text length"),
+        line["text"],
+    ] + ([line["duplicate_of"]] if "duplicate_of" in line else [])
+
+
+def csv_header(config=DEFAULT_CONFIG):
+    return TAGGED_CSV_HEADER if config.dedup == "tag" else CSV_HEADER
+
+
 def update_csv_files_by_category(
-    base_csv_file_path, ocr_data, work_id, volume_id, page_id
+    base_csv_file_path,
+    ocr_data,
+    work_id,
+    volume_id,
+    page_id,
+    sink=None,
+    header=CSV_HEADER,
 ):
     base_path_template = (
         str(base_csv_file_path.parent / (base_csv_file_path.stem + "_{}"))
         + base_csv_file_path.suffix
     )
 
-    categories = ["51-89%", "90-100%", "0-50%"]
-    writers = {}
-    files = {}  # Dictionary to keep track of file handles
-
-    # Define the header
-    header = [
-        "Work ID",
-        "Volume ID",
-        "Page ID",
-        "Line Image Name",
-        "OCR Confidence",
-        "Tibetan Num",
-        "Non Bo Word",
-        "Non Bo Num",
-        "Text_length",
-        "Text",
-    ]
+    rows: Dict[str, List[list]] = {category: [] for category in CONFIDENCE_CATEGORIES}
+    for line in ocr_data:
+        category = confidence_category(line.get("ocr_conf"))
+        rows[category].append(csv_row(line, work_id, volume_id))
 
-    for category in categories:
+    for category in CONFIDENCE_CATEGORIES:
         csv_file_path = Path(base_path_template.format(category))
-        is_new_file = not csv_file_path.exists()  # Check if file exists
-        csv_file = csv_file_path.open("a", newline="", encoding="utf-8")
+        if sink is None:
+            append_csv_rows(csv_file_path, header, rows[category])
+        else:
+            sink.add_csv_rows(csv_file_path, header, rows[category])
+
 
-        writers[category] = csv.writer(csv_file)
-        files[category] = csv_file  # Store the file handle for later closing
+def work_and_volume_ids(image_path):
+    """Derive the work and volume ids from a `<work>/<work>-<volume>/images/<page>` path."""
+    parts = image_path.parts
+    work_id, work_volume_id = parts[-4:-2]
+    volume_id = work_volume_id.split("-")[1]
+    return work_id, volume_id
 
-        # If it's a new file, write the header
-        if is_new_file:
-            writers[category].writerow(header)
 
+@timed_stage("archive_lines")
+def archive_page_lines(ocr_data, shard_dir, work_id, volume_id, shard_size):
+    """Append a page's line images and metadata rows to the work's tar shards."""
     for line in ocr_data:
-        ocr_conf = line.get("ocr_conf")
-        # Determine the confidence category
-        if ocr_conf:
-            if 51 <= ocr_conf <= 89:
-                confidence_category = "51-89%"
-            elif 90 <= ocr_conf <= 100:
-                confidence_category = "90-100%"
-            else:
-                confidence_category = "0-50%"
-
-        # Append the data row to the appropriate CSV
-        writers[confidence_category].writerow(
-            [
-                work_id,
-                volume_id,
-                line["image_page_id"],
-                line.get("line_image_name", "No Image"),
-                ocr_conf if ocr_conf else "No Confidence",
-                line.get("tib_num"),
-                line.get("non_bo_word"),
-                line.get("non_bo_num"),
-                line.get("text length"),
-                line["text"],
-            ]
+        metadata = dict(zip(TAGGED_CSV_HEADER, csv_row(line, work_id, volume_id)))
+        category = line_category(
+            line["tib_num"], line["non_bo_word"], line["non_bo_num"]
+        )
+        archive_line(
+            shard_dir / confidence_category(line.get("ocr_conf")),
+            category,
+            shard_size,
+            line,
+            metadata,
         )
+    count(
+        "archive_lines",
+        lines=len(ocr_data),
+        bytes_written=sum(len(line["image_bytes"]) for line in ocr_data),
+    )
 
-    # Close all the file handles
-    for file in files.values():
-        file.close()
 
+def route_page_lines(ocr_data, work_output_dir, work_id, volume_id, config, sink=None):
+    """Route a page's lines to their categories while the page is in memory.
 
-def process_volume_folder(volume_folder, checkpoints, output_base):
-    for html_file in volume_folder.rglob("*.html"):
-        if str(html_file) in checkpoints:
-            continue  # Skip already processed files
+    Single-pass counterpart of organize_images_and_create_category_csvs:
+    rows go straight to `csv/<category>.csv` and, in files mode, line images
+    are hardlinked into `filtered_images/` rather than copied.
+    """
+    category_rows: Dict[str, List[list]] = {}
+    for line in ocr_data:
+        if confidence_category(line.get("ocr_conf")) != "90-100%":
+            continue
+        if line["text length"] < MIN_TEXT_LENGTH:
+            continue
+        category = line_category(
+            line["tib_num"], line["non_bo_word"], line["non_bo_num"]
+        )
+        row = dict(zip(TAGGED_CSV_HEADER, csv_row(line, work_id, volume_id)))
+        category_rows.setdefault(category, []).append(
+            [row[column] for column in CATEGORY_CSV_COLUMNS]
+        )
+        if config.output_mode != "files":
+            continue
+        target_folder = work_output_dir / "filtered_images" / CATEGORY_FOLDERS[category]
+        if len(category_rows[category]) == 1:
+            target_folder.mkdir(parents=True, exist_ok=True)
+        source_path = (
+            work_output_dir / "images" / line["image_page_id"] / line["line_image_name"]
+        )
         try:
-            ocr_data = parse_html(html_file)
+            os.link(source_path, target_folder / line["line_image_name"])
+        except FileExistsError:
+            pass
+
+    for category, rows in category_rows.items():
+        category_csv_path = work_output_dir / "csv" / f"{category}.csv"
+        if sink is None:
+            append_csv_rows(category_csv_path, CATEGORY_CSV_COLUMNS, rows)
+        else:
+            sink.add_csv_rows(category_csv_path, CATEGORY_CSV_COLUMNS, rows)
+
+
+def parquet_records(ocr_data, work_id, volume_id):
+    """Typed metadata records of a page's lines for the Parquet sink."""
+    return [
+        {
+            "work_id": work_id,
+            "volume_id": volume_id,
+            "page_id": line["image_page_id"],
+            "line_image_name": line.get("line_image_name"),
+            "ocr_conf": line.get("ocr_conf"),
+            "tib_num": line.get("tib_num"),
+            "non_bo_word": line.get("non_bo_word"),
+            "non_bo_num": line.get("non_bo_num"),
+            "text_length": line.get("text length"),
+            "text": line["text"],
+            "duplicate_of": line.get("duplicate_of"),
+        }
+        for line in ocr_data
+    ]
+
+
+def line_images_dir(output_base, work_id, config=DEFAULT_CONFIG):
+    """Where line images are written, or None when they go to tar shards."""
+    if config.output_mode == "archive":
+        return None
+    return output_base / work_id / "images"
+
+
+def record_page_lines(
+    ocr_data, output_base, work_id, volume_id, page_id, config=DEFAULT_CONFIG
+):
+    """Analyze the cropped lines of a page and append them to the work CSVs."""
+    if ocr_data is None:  # Cropping failed
+        return False
+    ocr_data = analyze_ocr_texts(ocr_data)
+    store_page_lines(ocr_data, output_base, work_id, volume_id, page_id, config)
+    return True
+
+
+def store_page_lines(
+    ocr_data, output_base, work_id, volume_id, page_id, config=DEFAULT_CONFIG
+):
+    """Append the analyzed lines of a page to the work's outputs.
+
+    Rows are buffered in this process's metadata sink; they are written out
+    before any checkpoint is committed and when the task closes the sinks.
+    """
+    if not ocr_data:  # Every line was filtered out
+        return
+    if config.output_mode == "archive":
+        archive_page_lines(
+            ocr_data,
+            output_base / work_id / "shards",
+            work_id,
+            volume_id,
+            config.shard_size,
+        )
+    sink = get_metadata_sink(config.metadata_flush_rows, config.parquet_metadata)
+    csv_file_path = output_base / work_id / f"{work_id}.csv"
+    update_csv_files_by_category(
+        csv_file_path,
+        ocr_data,
+        work_id,
+        volume_id,
+        page_id,
+        sink,
+        csv_header(config),
+    )
+    if config.parquet_metadata:
+        sink.add_parquet_records(
+            output_base / work_id / "metadata",
+            parquet_records(ocr_data, work_id, volume_id),
+        )
+    if config.single_pass:
+        route_page_lines(
+            ocr_data, output_base / work_id, work_id, volume_id, config, sink
+        )
+
+
+def mark_page_done(html_file, work_id, page_digest=None):
+    """Checkpoint a page by its path, or by its `(page_key, digest)` if given."""
+    if page_digest is None:
+        save_checkpoint(html_file)  # Mark as processed
+    else:
+        page_key, digest = page_digest
+        save_page_digest(page_key, work_id, digest)
+
+
+def process_html_file(
+    html_file, output_base, config=DEFAULT_CONFIG, page_digest=None, image_index=None
+):
+    """Crop, analyze and record the lines of a single hOCR page.
+
+    With a `(page_key, digest)` page digest the page is marked as processed
+    by its digest (incremental mode) instead of by its path. The page image
+    is looked up in `image_index` if given.
+    """
+    html_file = Path(html_file)
+    try:
+        with profile_page(html_file, config.profile_sample_rate, config.profile_dir):
+            ocr_data = parse_html(html_file, config.html_parser)
             if ocr_data is None:  # Skip if parsing failed
-                continue
+                return
             image_path = find_corresponding_image_path(html_file)
-            parts = image_path.parts
-            work_id, work_volume_id = parts[-4:-2]
-            volume_id = work_volume_id.split("-")[1]
-            output_dir = output_base / work_id / "images"
+            work_id, volume_id = work_and_volume_ids(image_path)
+            ocr_data = filter_lines(ocr_data, config.line_filter)
+            if not ocr_data:  # Nothing to crop
+                mark_page_done(html_file, work_id, page_digest)
+                return
+            output_dir = line_images_dir(output_base, work_id, config)
 
             ocr_data = crop_and_save_line_images(
-                image_path, ocr_data, output_dir, volume_id
+                image_path,
+                ocr_data,
+                output_dir,
+                volume_id,
+                config,
+                image_index,
+                work_id,
             )
-            ocr_data = analyze_ocr_texts(ocr_data)
-            if ocr_data:  # Ensure OCR data was processed successfully
-                csv_file_path = output_base / work_id / f"{work_id}.csv"
-                update_csv_files_by_category(
-                    csv_file_path,
-                    ocr_data,
-                    work_id,
-                    volume_id,
-                    image_path.name,
-                )
-                save_checkpoint(html_file)  # Mark as processed
-        except Exception as e:
-            save_corrupted_files(html_file, str(e))
-
-
-def process_work_folder(work_folder, output_base):
+            if record_page_lines(
+                ocr_data, output_base, work_id, volume_id, image_path.name, config
+            ):
+                mark_page_done(html_file, work_id, page_digest)
+    except Exception as e:
+        save_corrupted_files(html_file, e)
+
+
+def process_html_files(
+    html_files, checkpoints, output_base, config=DEFAULT_CONFIG, digests=None
+):
+    """Process hOCR pages; `digests` maps a page to its `(page_key, digest)`."""
+    image_index = ImageIndex()
+    for html_file in html_files:
+        if str(html_file) in checkpoints:
+            continue  # Skip already processed files
+        page_digest = None if digests is None else digests[str(html_file)]
+        process_html_file(html_file, output_base, config, page_digest, image_index)
+    close_line_archives()
+    close_metadata_sinks()
+
+
+def process_volume_folder(
+    volume_folder, checkpoints, output_base, config=DEFAULT_CONFIG
+):
+    process_html_files(volume_folder.rglob("*.html"), checkpoints, output_base, config)
+
+
+def process_work_folder(work_folder, output_base, config=DEFAULT_CONFIG):
     """Process HTML files in work folder, cropping images and updating CSVs."""
     checkpoints = load_checkpoints()
     for volume_folder in work_folder.iterdir():
-        if not volume_folder.is_dir():
+        if not volume_folder.is_dir() or volume_folder.name.startswith("."):
             continue
-        process_volume_folder(volume_folder, checkpoints, output_base)
+        process_volume_folder(volume_folder, checkpoints, output_base, config)
         save_checkpoint(volume_folder)
+    flush_checkpoints()
 
 
 # Example usage:
@@ -0,0 +1,211 @@
+import os
+import time
+from pathlib import Path, PurePosixPath
+from typing import Dict, List
+
+from create_ocr_data.checkpoints import (
+    load_checkpoints,
+    load_failures,
+    load_page_digests,
+    resolve_failures,
+)
+from create_ocr_data.config import DEFAULT_CONFIG, PipelineConfig
+from create_ocr_data.incremental import config_fingerprint, page_digest, page_key
+from create_ocr_data.multi_pipeline import (
+    MAX_PAGES_PER_TASK,
+    finalize_work,
+    page_pool,
+    page_task,
+)
+from create_ocr_data.pipeline import ImageIndex
+from create_ocr_data.zip_source import (
+    KEY_SEPARATOR,
+    find_zip_pages,
+    logical_member_path,
+    open_zip_chain,
+    zip_member_key,
+)
+
+"""retrying failed pages
+
+Reprocesses only the pages recorded in the `failures` table, instead of
+walking the whole corpus again. Failures are mapped back to their hOCR page
+from the failed path: the page itself, or its page image. A page is
+retried once the backoff after its last failure has passed, doubling with
+every attempt up to `max_backoff_seconds`, and is given up after
+`max_attempts` failures. Pages that succeed get their failures resolved and
+their works finalized again; pages that are already checkpointed are only
+resolved.
+"""
+
+DEFAULT_BACKOFF_SECONDS = 60
+DEFAULT_MAX_BACKOFF_SECONDS = 60 * 60
+DEFAULT_MAX_ATTEMPTS = 5
+
+
+def failed_page(path):
+    """The page a failed path belongs to, as `(work, volume, chain, page)`.
+
+    For a work folder `page` is the hOCR file and `chain` None; for a work
+    ZIP `page` is the hOCR member of the archive reached through `chain`.
+    Returns None for failures that are not about a page, e.g. a whole ZIP.
+    """
+    if KEY_SEPARATOR in path:
+        zip_path, *chain, member = path.split(KEY_SEPARATOR)
+        member = PurePosixPath(member)
+        if member.suffix != ".html":
+            if member.parent.name != "images":
+                return None
+            member = member.parent.parent / "html" / f"{member.stem}.html"
+        page_path = logical_member_path(zip_path, chain, member.as_posix())
+        if len(page_path.parts) < 3:
+            return None
+        volume = zip_member_key(zip_path, (), page_path.parts[1])
+        return zip_path, volume, tuple(chain), member.as_posix()
+    path = Path(path)
+    if path.suffix != ".html":
+        # Images are recorded by their path without extension
+        if path.parent.name != "images":
+            return None
+        path = path.parent.parent / "html" / f"{path.name}.html"
+    if len(path.parts) < 4 or path.parent.name != "html":
+        return None
+    return str(path.parents[2]), str(path.parents[1]), None, str(path)
+
+
+def pending_failures(directory, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """Failures of inputs under `directory` that have not been given up on."""
+    directory = str(directory)
+    return [
+        failure
+        for failure in load_failures()
+        if failure["attempts"] < max_attempts
+        and (
+            failure["path"] == directory
+            or failure["path"].startswith(directory + os.sep)
+        )
+    ]
+
+
+def page_checkpoint_key(work, chain, page):
+    return page if chain is None else zip_member_key(work, chain, page)
+
+
+def retry_delay(attempts, backoff_seconds, max_backoff_seconds):
+    """Seconds to wait after the `attempts`-th failure before retrying."""
+    return min(backoff_seconds * 2 ** (attempts - 1), max_backoff_seconds)
+
+
+def due_pages(
+    failures,
+    now,
+    backoff_seconds=DEFAULT_BACKOFF_SECONDS,
+    max_backoff_seconds=DEFAULT_MAX_BACKOFF_SECONDS,
+    max_attempts=DEFAULT_MAX_ATTEMPTS,
+):
+    """Group `failures` by page and keep the pages due for a retry.
+
+    Returns `{(work, volume, chain, page): [failed paths]}` of the due pages
+    and the number of pages waiting for their backoff and given up.
+    """
+    pages: Dict[tuple, List[dict]] = {}
+    for failure in failures:
+        page = failed_page(failure["path"])
+        if page is not None:
+            pages.setdefault(page, []).append(failure)
+    due = {}
+    waiting = given_up = 0
+    for page, page_failures in pages.items():
+        attempts = max(failure["attempts"] for failure in page_failures)
+        last_failed_at = max(failure["last_failed_at"] for failure in page_failures)
+        delay = retry_delay(attempts, backoff_seconds, max_backoff_seconds)
+        if attempts >= max_attempts:
+            given_up += 1
+        elif now - last_failed_at < delay:
+            waiting += 1
+        else:
+            due[page] = [failure["path"] for failure in page_failures]
+    return due, waiting, given_up
+
+
+def zip_page_members(work, chain, html_members):
+    """Pair the hOCR members of a (nested) archive with their image members."""
+    wanted = set(html_members)
+    with open_zip_chain(work, chain) as zip_file:
+        return [page for page in find_zip_pages(zip_file) if page[0] in wanted]
+
+
+def plan_retry_tasks(
+    pages,
+    output_dir: Path,
+    max_pages_per_task=MAX_PAGES_PER_TASK,
+    config: PipelineConfig = DEFAULT_CONFIG,
+):
+    """Batch due pages `[(work, volume, chain, page)]` into page tasks."""
+    batches: Dict[tuple, list] = {}
+    for work, volume, chain, page in sorted(pages, key=str):
+        batches.setdefault((work, volume, chain), []).append(page)
+    fingerprint = config_fingerprint(config)
+    tasks = []
+    for (work, volume, chain), batch_pages in batches.items():
+        if chain is not None:
+            batch_pages = zip_page_members(work, chain, batch_pages)
+        for start in range(0, len(batch_pages), max_pages_per_task):
+            batch = batch_pages[start : start + max_pages_per_task]
+            digests = None
+            if config.incremental and chain is None:
+                image_index = ImageIndex()
+                digests = {
+                    page: (page_key(page), page_digest(page, fingerprint, image_index))
+                    for page in batch
+                }
+            tasks.append((work, volume, chain, batch, output_dir, config, digests))
+    return tasks
+
+
+def page_done(failed, checkpoints, config=DEFAULT_CONFIG):
+    """Whether a `(work, volume, chain, page)` page is processed."""
+    work, _, chain, page = failed
+    if config.incremental and chain is None:
+        return page_key(page) in load_page_digests(Path(work).name)
+    return page_checkpoint_key(work, chain, page) in checkpoints
+
+
+def retry_failed(
+    output_dir: Path,
+    num_processes: int = 10,
+    max_pages_per_task: int = MAX_PAGES_PER_TASK,
+    config: PipelineConfig = DEFAULT_CONFIG,
+    backoff_seconds=DEFAULT_BACKOFF_SECONDS,
+    max_backoff_seconds=DEFAULT_MAX_BACKOFF_SECONDS,
+    max_attempts=DEFAULT_MAX_ATTEMPTS,
+):
+    """Reprocess the failed pages that are due for a retry, in parallel.
+
+    `config` should match the run the pages failed in. Returns the number
+    of pages that no longer fail.
+    """
+    checkpoints = load_checkpoints()
+    due, waiting, given_up = due_pages(
+        load_failures(), time.time(), backoff_seconds, max_backoff_seconds, max_attempts
+    )
+    done = [page for page in due if page_done(page, checkpoints, config)]
+    resolve_failures(path for page in done for path in due.pop(page))
+    tasks = plan_retry_tasks(due, output_dir, max_pages_per_task, config)
+    print(
+        f"Retrying {len(due)} failed pages in {len(tasks)} tasks "
+        f"({waiting} waiting for backoff, {given_up} given up)"
+    )
+
+    with page_pool(num_processes, config) as pool:
+        for _ in pool.imap_unordered(page_task, tasks):
+            pass
+        checkpoints = load_checkpoints()
+        retried = [page for page in due if page_done(page, checkpoints, config)]
+        resolve_failures(path for page in retried for path in due[page])
+        works = sorted({work for work, _, _, _ in retried})
+        finalize_tasks = [(work, output_dir, config) for work in works]
+        for _ in pool.imap_unordered(finalize_work, finalize_tasks):
+            pass
+    print(f"{len(retried)} of {len(due)} retried pages succeeded")
+    return len(done) + len(retried)
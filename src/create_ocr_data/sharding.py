@@ -0,0 +1,161 @@
+import json
+import os
+import time
+import zipfile
+import zlib
+from multiprocessing import Pool
+from pathlib import Path
+
+from create_ocr_data.create_output import (
+    merge_csv_files,
+    plan_work_archives,
+    write_work_archive,
+)
+from create_ocr_data.extract_valid_image import CATEGORY_FOLDERS
+
+"""sharding works across machines
+
+Every node lists the same corpus and computes the same assignment of works
+to shards: works are taken heaviest first, by estimated page count, and
+each goes to the least loaded shard, ties broken by a stable hash of the
+work id. A node processes only the works of its shard into its own output
+folder and writes a `shard_summary.json` there. merge_shards checks that
+the summaries of all shards are present and complete, then combines the
+node outputs into the corpus-wide category CSVs and per-work archives.
+"""
+
+SUMMARY_NAME = "shard_summary.json"
+
+# Bytes of a work ZIP per page, to estimate the pages of works known only
+# by their size (e.g. Drive listings).
+ZIP_BYTES_PER_PAGE = 256 * 1024
+
+
+def work_id_of(name) -> str:
+    """Work id of a work folder or work ZIP name."""
+    return Path(name).stem if name.lower().endswith(".zip") else name
+
+
+def stable_hash(work_id) -> int:
+    return zlib.crc32(work_id.encode("utf-8"))
+
+
+def estimate_pages(work: Path) -> int:
+    """Pages of a work folder, or of a work ZIP from its central directory."""
+    if work.is_dir():
+        return sum(1 for _ in work.rglob("*.html"))
+    with zipfile.ZipFile(work) as zip_file:
+        infos = zip_file.infolist()
+    pages = sum(1 for info in infos if info.filename.endswith(".html"))
+    if pages:
+        return pages
+    # Pages inside nested archives
+    return sum(info.file_size for info in infos) // ZIP_BYTES_PER_PAGE
+
+
+def assign_shards(weights, shard_count) -> dict:
+    """Map every work id of `weights` ({work_id: estimated pages}) to a shard."""
+    loads = [0] * shard_count
+    assignment = {}
+    for work_id in sorted(weights, key=lambda work_id: (-weights[work_id], work_id)):
+        offset = stable_hash(work_id) % shard_count
+        shard = min(
+            range(shard_count),
+            key=lambda index: (loads[index], (index - offset) % shard_count),
+        )
+        assignment[work_id] = shard
+        loads[shard] += max(weights[work_id], 1)
+    return assignment
+
+
+def shard_weights(weights, shard_index, shard_count) -> dict:
+    """The `{work_id: estimated pages}` of the works assigned to `shard_index`."""
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"Shard index {shard_index} is not below {shard_count}")
+    assignment = assign_shards(weights, shard_count)
+    return {
+        work_id: pages
+        for work_id, pages in weights.items()
+        if assignment[work_id] == shard_index
+    }
+
+
+def write_summary(output_dir, shard_index, shard_count, weights, finished, **extra):
+    """Write a node's `shard_summary.json`; `finished` are its finished work ids."""
+    summary = {
+        "shard_index": shard_index,
+        "shard_count": shard_count,
+        "created_at": time.time(),
+        "works": {
+            work_id: {"estimated_pages": pages, "finished": work_id in finished}
+            for work_id, pages in sorted(weights.items())
+        },
+        **extra,
+    }
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = output_dir / f".{SUMMARY_NAME}.tmp"
+    tmp_path.write_text(json.dumps(summary, indent=2), encoding="utf-8")
+    os.replace(tmp_path, output_dir / SUMMARY_NAME)
+    return summary
+
+
+def load_summaries(node_dirs):
+    """Read and check the summaries of every node, returning `{work_id: node_dir}`."""
+    summaries = {}
+    for node_dir in map(Path, node_dirs):
+        summary_path = node_dir / SUMMARY_NAME
+        if not summary_path.exists():
+            raise ValueError(f"{node_dir}: no {SUMMARY_NAME}")
+        summaries[node_dir] = json.loads(summary_path.read_text(encoding="utf-8"))
+    shard_counts = {summary["shard_count"] for summary in summaries.values()}
+    if len(shard_counts) != 1:
+        raise ValueError(f"Nodes were run with different shard counts: {shard_counts}")
+    (shard_count,) = shard_counts
+    indexes = sorted(summary["shard_index"] for summary in summaries.values())
+    if indexes != list(range(shard_count)):
+        raise ValueError(f"Expected shards 0-{shard_count - 1}, got {indexes}")
+    work_nodes = {}
+    for node_dir, summary in summaries.items():
+        for work_id, work in summary["works"].items():
+            if not work["finished"]:
+                raise ValueError(f"{node_dir}: {work_id} is not finished")
+            if work_id in work_nodes:
+                raise ValueError(f"{work_id} was processed by more than one node")
+            work_nodes[work_id] = node_dir
+    return work_nodes
+
+
+def merge_shards(node_dirs, merged_dir, num_processes=None):
+    """Combine the outputs of every shard into `merged_dir`.
+
+    Writes `csv/<category>.csv` with the category rows of all works and the
+    per-work category archives under `archives/`.
+    """
+    work_nodes = load_summaries(node_dirs)
+    merged_dir = Path(merged_dir)
+    csv_dir = merged_dir / "csv"
+    csv_dir.mkdir(parents=True, exist_ok=True)
+    for category in CATEGORY_FOLDERS:
+        csv_files = [
+            node_dir / work_id / "csv" / f"{category}.csv"
+            for work_id, node_dir in sorted(work_nodes.items())
+        ]
+        csv_files = [csv_file for csv_file in csv_files if csv_file.is_file()]
+        if not csv_files:
+            continue
+        tmp_path = csv_dir / f".{category}.csv.tmp"
+        with tmp_path.open("wb") as out:
+            merge_csv_files(csv_files, out)
+        os.replace(tmp_path, csv_dir / f"{category}.csv")
+
+    tasks = []
+    for work_id, node_dir in sorted(work_nodes.items()):
+        if (node_dir / work_id).is_dir():
+            tasks.extend(
+                plan_work_archives(node_dir / work_id, merged_dir / "archives")
+            )
+    with Pool(processes=num_processes) as pool:
+        for dest_zip in pool.imap_unordered(write_work_archive, tasks):
+            print(f"Created {dest_zip}")
+    print(f"Merged {len(work_nodes)} works from {len(node_dirs)} shards")
@@ -0,0 +1,265 @@
+import multiprocessing
+import queue
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import Pool
+from pathlib import Path
+
+from create_ocr_data.checkpoints import (
+    flush_checkpoints,
+    load_checkpoints,
+    resolve_failures,
+    save_checkpoint,
+    save_corrupted_files,
+)
+from create_ocr_data.config import DEFAULT_CONFIG
+from create_ocr_data.create_output import plan_work_archives, write_work_archive
+from create_ocr_data.extract_zip import extract_archive, remove_stale_staging
+from create_ocr_data.multi_pipeline import page_pool, process_all_works
+from create_ocr_data.retry import pending_failures
+
+"""streaming corpus pipeline
+
+Runs download, extraction, processing and packaging as one pipeline over
+the works of a corpus instead of finishing each stage for the whole corpus
+first: while work N is processed, work N+1 is being extracted and N+2
+downloaded. Downloads run on threads, extraction and packaging on their own
+process pools, and the pages of one work at a time on process_all_works'
+pool. All checkpoint writes happen in the calling thread.
+
+A new work is only admitted while fewer than `works_in_flight` works are
+unfinished and the disk keeps `min_free_bytes` free after what admitted
+works are still expected to take. Intermediates are deleted as soon as a
+work no longer needs them: the ZIP once it is extracted, the extracted
+pages once they are processed. A work with failed inputs that
+retry-failed may still retry keeps its ZIP and extracted pages and gets no
+checkpoint; a later run packages it once retries have resolved them.
+"""
+
+# Checkpoint key prefix of works that went through the whole pipeline.
+CHECKPOINT_PREFIX = "stream:"
+
+# Expected disk footprint of a work before it is extracted, relative to the
+# size of its ZIP: the ZIP itself and its extracted pages.
+FOOTPRINT_FACTOR = 2
+
+# How often a work waiting for disk space checks the free space again.
+DISK_POLL_SECONDS = 5
+
+
+@dataclass(frozen=True)
+class StreamLimits:
+    """Concurrency of each stage and how far the pipeline may run ahead."""
+
+    download_workers: int = 4
+    extract_workers: int = 2
+    processes: int = 10
+    package_workers: int = 2
+    works_in_flight: int = 3
+    min_free_bytes: int = 0
+    keep_intermediates: bool = False
+
+
+class WorkAdmission:
+    """Blocks the admission of new works until there is room for them."""
+
+    def __init__(self, disk_path, works_in_flight, min_free_bytes):
+        self.disk_path = disk_path
+        self.works_in_flight = works_in_flight
+        self.min_free_bytes = min_free_bytes
+        self.works = 0
+        self.reserved = 0
+        self.condition = threading.Condition()
+
+    def has_room(self, footprint):
+        if self.works >= self.works_in_flight:
+            return False
+        free = shutil.disk_usage(self.disk_path).free - self.reserved
+        return free - footprint >= self.min_free_bytes
+
+    def admit(self, footprint):
+        # With nothing in flight, waiting would not free any space
+        with self.condition:
+            while self.works and not self.has_room(footprint):
+                self.condition.wait(DISK_POLL_SECONDS)
+            self.works += 1
+            self.reserved += footprint
+
+    def settle(self, footprint):
+        """The footprint of a work is now on disk (or will never be)."""
+        with self.condition:
+            self.reserved -= footprint
+            self.condition.notify_all()
+
+    def finish(self):
+        with self.condition:
+            self.works -= 1
+            self.condition.notify_all()
+
+
+def local_zip_files(zip_dir):
+    """Work ZIPs already on disk, described like Drive files."""
+    return [
+        {"name": zip_path.name, "size": str(zip_path.stat().st_size)}
+        for zip_path in sorted(Path(zip_dir).glob("*.zip"))
+    ]
+
+
+def run_pipeline(
+    files,
+    fetch,
+    extract_dir,
+    output_dir,
+    package_dir,
+    limits=StreamLimits(),
+    config=DEFAULT_CONFIG,
+    delete_zips=False,
+):
+    """Download, extract, process and package every work ZIP of `files`.
+
+    `files` are Drive file descriptions (`name`, optionally `size`) and
+    `fetch(file)` returns the path of the file's ZIP, downloading it first
+    if needed; it is called on the download threads. Fetched ZIPs are
+    deleted once extracted if `delete_zips`.
+    """
+    extract_dir, output_dir = Path(extract_dir), Path(output_dir)
+    package_dir = Path(package_dir)
+    for directory in (extract_dir, output_dir, package_dir):
+        directory.mkdir(parents=True, exist_ok=True)
+    for work_dir in extract_dir.iterdir():  # Left behind by an interrupted run
+        remove_stale_staging(work_dir)
+    checkpoints = load_checkpoints()
+    files = [
+        file for file in files if CHECKPOINT_PREFIX + file["name"] not in checkpoints
+    ]
+    admission = WorkAdmission(
+        extract_dir, limits.works_in_flight, limits.min_free_bytes
+    )
+    # Events of the background stages: `(kind, name, footprint, detail)`
+    events: queue.Queue = queue.Queue()
+
+    def extract(file, footprint, fetched):
+        try:
+            zip_path = fetched.result()
+        except Exception as e:
+            events.put(("failed", file["name"], footprint, ("download", e)))
+            return
+        work_id = Path(file["name"]).stem
+        job = (file["name"], str(zip_path), str(extract_dir / work_id / work_id))
+        extract_pool.apply_async(
+            extract_archive,
+            (job,),
+            callback=lambda result: events.put(
+                ("extracted", file["name"], footprint, (zip_path, result[2]))
+            ),
+            error_callback=lambda e: events.put(
+                ("failed", file["name"], footprint, ("extract", e))
+            ),
+        )
+
+    def feed(executor):
+        for file in files:
+            footprint = FOOTPRINT_FACTOR * int(file.get("size", 0))
+            admission.admit(footprint)
+            fetched = executor.submit(fetch, file)
+            fetched.add_done_callback(
+                lambda fetched, file=file, footprint=footprint: extract(
+                    file, footprint, fetched
+                )
+            )
+
+    def process(name):
+        """Process an extracted work and queue its archives.
+
+        Returns the number of queued archives, or None if inputs of the work
+        failed and may still be retried: its pages are then kept for
+        retry-failed and it is not packaged.
+        """
+        work_id = Path(name).stem
+        process_all_works(
+            extract_dir / work_id,
+            output_dir,
+            limits.processes,
+            config=config,
+            pool=process_pool,
+        )
+        if pending_failures(extract_dir / work_id):
+            return None
+        if not limits.keep_intermediates:
+            shutil.rmtree(extract_dir / work_id, ignore_errors=True)
+            admission.settle(0)  # Wake works waiting for disk space
+        if not (output_dir / work_id).is_dir():
+            return 0
+        archives = plan_work_archives(output_dir / work_id, package_dir)
+        for archive in archives:
+            package_pool.apply_async(
+                write_work_archive,
+                (archive,),
+                callback=lambda _: events.put(("packaged", name, 0, None)),
+                error_callback=lambda e: events.put(("packaged", name, 0, e)),
+            )
+        return len(archives)
+
+    def finish(name, error, stage=None):
+        if error is None:
+            save_checkpoint(CHECKPOINT_PREFIX + name)
+            flush_checkpoints()
+            resolve_failures([name])
+            print(f"Finished {name}")
+        else:
+            save_corrupted_files(name, error, stage=stage)
+            print(f"Failed {name}: {error}")
+        admission.finish()
+
+    unpackaged = {}
+    package_errors = {}
+    remaining = len(files)
+    # Every pool forks its workers before the download threads start. Page
+    # workers that are recycled are started later, from a fork server.
+    context = None
+    if config.max_tasks_per_child is not None:
+        context = multiprocessing.get_context("forkserver")
+    with Pool(processes=limits.extract_workers) as extract_pool, Pool(
+        processes=limits.package_workers
+    ) as package_pool, page_pool(
+        limits.processes, config, context
+    ) as process_pool, ThreadPoolExecutor(
+        max_workers=limits.download_workers
+    ) as executor:
+        feeder = threading.Thread(target=feed, args=(executor,), daemon=True)
+        feeder.start()
+        while remaining:
+            kind, name, footprint, detail = events.get()
+            if kind == "failed":
+                admission.settle(footprint)
+                stage, error = detail
+                finish(name, error, stage)
+                remaining -= 1
+            elif kind == "extracted":
+                zip_path, error = detail
+                admission.settle(footprint)
+                archives = process(name) if error is None else 0
+                if archives is None:
+                    # Left without a checkpoint, so the next run packages it
+                    finish(name, "failed inputs kept for retry-failed", "process")
+                    remaining -= 1
+                    continue
+                if delete_zips and not limits.keep_intermediates:
+                    Path(zip_path).unlink(missing_ok=True)
+                if error is not None:
+                    shutil.rmtree(extract_dir / Path(name).stem, ignore_errors=True)
+                unpackaged[name] = archives
+                if not unpackaged[name]:
+                    finish(name, error, "extract")
+                    remaining -= 1
+            elif kind == "packaged":
+                if detail is not None:
+                    package_errors[name] = detail
+                unpackaged[name] -= 1
+                if not unpackaged[name]:
+                    finish(name, package_errors.get(name), "package")
+                    remaining -= 1
+        feeder.join()
+    flush_checkpoints()
@@ -1,13 +1,29 @@
-import io
+import hashlib
 import os
 import pickle
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
 
 from google.auth.transport.requests import Request  # Add this import
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
 
-from create_ocr_data.checkpoints import load_checkpoints, save_checkpoint
+from create_ocr_data.checkpoints import (
+    flush_checkpoints,
+    load_checkpoints,
+    save_checkpoint,
+    save_corrupted_files,
+)
+
+"""Drive downloader
+
+Lists every page of a Drive folder and downloads its ZIP files concurrently.
+Each worker thread reuses one Drive service (and so one HTTP connection) for
+all its downloads. Files are fetched in byte ranges into `<name>.part`, so an
+interrupted download resumes where it stopped, and a file is only moved into
+place and checkpointed once its size and md5 match what Drive reports.
+"""
 
 # The ID of the Google Drive folder from which to download ZIP files.
 FOLDER_ID = "15Y-PnZBT1JtrZX1ck-RT4Hd1oWU9VA7b"
@@ -15,12 +31,17 @@ FOLDER_ID = "15Y-PnZBT1JtrZX1ck-RT4Hd1oWU9VA7b"
 # Local directory to save the downloaded ZIP files.
 DOWNLOAD_PATH = "../../data/work_zip/"
 
+DEFAULT_CHUNK_SIZE = 32 * 1024 * 1024
+DEFAULT_DOWNLOAD_WORKERS = 4
+LIST_PAGE_SIZE = 1000
 
-def authenticate_google_drive():
-    """Authenticate and return a Google Drive service instance."""
+
+def load_credentials(
+    token_pickle="../../data/token.pickle",
+    credentials_file="../../data/drive_cred.json",
+):
+    """Load the saved Drive credentials, refreshing or logging in when needed."""
     creds = None
-    token_pickle = "../../data/token.pickle"
-    credentials_file = "../../data/drive_cred.json"
     scopes = ["https://www.googleapis.com/auth/drive.readonly"]
 
     if os.path.exists(token_pickle):
@@ -38,46 +59,171 @@ def authenticate_google_drive():
         # Save the credentials for the next run
         with open(token_pickle, "wb") as token:
             pickle.dump(creds, token)
+    return creds
+
 
+def authenticate_google_drive(creds=None):
+    """Authenticate and return a Google Drive service instance."""
+    if creds is None:
+        creds = load_credentials()
     service = build("drive", "v3", credentials=creds)
     return service
 
 
 def list_zip_files(service, folder_id):
-    """List all ZIP files in the specified Google Drive folder."""
+    """List all ZIP files in the specified Google Drive folder, following every page."""
     query = f"'{folder_id}' in parents and mimeType='application/zip'"
-    results = (
-        service.files()
-        .list(q=query, spaces="drive", fields="nextPageToken, files(id, name)")
-        .execute()
-    )
-    return results.get("files", [])
-
-
-def download_file(service, file_id, file_name, download_path):
-    """Download a file from Google Drive."""
-    request = service.files().get_media(fileId=file_id)
-    file_path = os.path.join(download_path, file_name)
-    fh = io.FileIO(file_path, "wb")
-    downloader = MediaIoBaseDownload(fh, request)
-    done = False
-    while not done:
-        status, done = downloader.next_chunk()
-        print(f"Downloaded {file_name} {int(status.progress() * 100)}%.")
-
-
-def main():
+    files = []
+    page_token = None
+    while True:
+        results = (
+            service.files()
+            .list(
+                q=query,
+                spaces="drive",
+                fields="nextPageToken, files(id, name, size, md5Checksum)",
+                pageSize=LIST_PAGE_SIZE,
+                pageToken=page_token,
+            )
+            .execute()
+        )
+        files.extend(results.get("files", []))
+        page_token = results.get("nextPageToken")
+        if not page_token:
+            return files
+
+
+def partial_path(file_path):
+    return file_path.with_name(file_path.name + ".part")
+
+
+def file_md5(file_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    digest = hashlib.md5()
+    with open(file_path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def verify_download(file_path, file):
+    """Raise ValueError unless `file_path` has the size and md5 Drive reports."""
+    if "size" in file and file_path.stat().st_size != int(file["size"]):
+        raise ValueError(
+            f"{file['name']}: expected {file['size']} bytes, "
+            f"got {file_path.stat().st_size}"
+        )
+    if "md5Checksum" in file and file_md5(file_path) != file["md5Checksum"]:
+        raise ValueError(f"{file['name']}: md5 mismatch")
+
+
+def content_range_total(response):
+    """Total size from a `Content-Range: bytes a-b/total` header, if known."""
+    content_range = response.get("content-range", "")
+    total = content_range.rpartition("/")[2]
+    return int(total) if total.isdigit() else None
+
+
+def download_file(service, file, download_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Download a file from Google Drive, resuming a previous partial download.
+
+    Returns the path of the verified file.
+    """
+    file_path = Path(download_path) / file["name"]
+    part_path = partial_path(file_path)
+    offset = part_path.stat().st_size if part_path.exists() else 0
+    total = int(file["size"]) if "size" in file else None
+
+    request = service.files().get_media(fileId=file["id"])
+    with part_path.open("ab") as fh:
+        while total is None or offset < total:
+            headers = dict(request.headers)
+            headers["range"] = f"bytes={offset}-{offset + chunk_size - 1}"
+            response, content = request.http.request(request.uri, headers=headers)
+            if response.status == 416:  # Nothing left past `offset`
+                break
+            if response.status not in (200, 206):
+                raise ValueError(
+                    f"{file['name']}: download failed with HTTP {response.status}"
+                )
+            if response.status == 200:  # Range ignored, the whole file was sent
+                fh.seek(0)
+                fh.truncate()
+                offset = 0
+                total = len(content)
+            fh.write(content)
+            offset += len(content)
+            total = content_range_total(response) or total
+            if not content:
+                break
+
+    try:
+        verify_download(part_path, file)
+    except ValueError:
+        part_path.unlink()  # Corrupt, start over next time
+        raise
+    part_path.replace(file_path)
+    return file_path
+
+
+def thread_local_downloader(
+    service_factory, download_path, chunk_size=DEFAULT_CHUNK_SIZE
+):
+    """Return `download(file)`, which reuses one service per calling thread."""
+    local = threading.local()
+
+    def download(file):
+        if not hasattr(local, "service"):
+            local.service = service_factory()
+        return download_file(local.service, file, download_path, chunk_size)
+
+    return download
+
+
+def download_files(
+    service_factory,
+    files,
+    download_path,
+    checkpoints=(),
+    num_workers=DEFAULT_DOWNLOAD_WORKERS,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+):
+    """Download `files` on `num_workers` threads and checkpoint each verified file.
+
+    `service_factory()` is called once per worker thread; its service is
+    reused for every download of that thread.
+    """
+    download = thread_local_downloader(service_factory, download_path, chunk_size)
+    pending = [file for file in files if file["name"] not in checkpoints]
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = {executor.submit(download, file): file for file in pending}
+        for future in as_completed(futures):
+            file = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                save_corrupted_files(file["name"], e, stage="download")
+                print(f"Failed to download {file['name']}: {e}")
+                continue
+            print(f"Downloaded {file['name']}.")
+            save_checkpoint(file["name"])
+            flush_checkpoints()
+
+
+def main(num_workers=DEFAULT_DOWNLOAD_WORKERS, chunk_size=DEFAULT_CHUNK_SIZE):
     checkpoints = load_checkpoints()
-    service = authenticate_google_drive()
+    creds = load_credentials()
+    service = authenticate_google_drive(creds)
     if not os.path.exists(DOWNLOAD_PATH):
         os.makedirs(DOWNLOAD_PATH)
     zip_files = list_zip_files(service, FOLDER_ID)
-    for file in zip_files:
-        if file["name"] in checkpoints:
-            continue
-        print(f"Downloading {file['name']}...")
-        download_file(service, file["id"], file["name"], DOWNLOAD_PATH)
-        save_checkpoint(file["name"])
+    download_files(
+        lambda: authenticate_google_drive(creds),
+        zip_files,
+        DOWNLOAD_PATH,
+        checkpoints,
+        num_workers,
+        chunk_size,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,251 @@
+import io
+import shutil
+import tempfile
+import zipfile
+from contextlib import ExitStack, contextmanager
+from pathlib import Path, PurePosixPath
+from typing import IO, Dict, List
+
+from PIL import Image, UnidentifiedImageError
+
+from create_ocr_data.checkpoints import (
+    flush_checkpoints,
+    load_checkpoints,
+    save_checkpoint,
+    save_corrupted_files,
+)
+from create_ocr_data.config import DEFAULT_CONFIG
+from create_ocr_data.line_archive import close_line_archives
+from create_ocr_data.metadata_sink import close_metadata_sinks
+from create_ocr_data.metrics import count, profile_page
+from create_ocr_data.pipeline import (
+    crop_line_images,
+    filter_lines,
+    find_corresponding_image_path,
+    image_priority,
+    line_images_dir,
+    parse_html,
+    record_page_lines,
+    work_and_volume_ids,
+)
+
+"""work archives as a page source
+
+A work ZIP is read in place: hOCR pages and page images are opened straight
+from the archive members, including members of nested ZIPs, and mapped to
+work/volume/page ids from the path they would have after extraction.
+"""
+
+KEY_SEPARATOR = "::"
+
+# Nested archives up to this size are spooled to memory, larger ones to a
+# temporary file.
+NESTED_SPOOL_MEMORY_BYTES = 64 * 1024 * 1024
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+
+def is_zip_member(name):
+    return name.lower().endswith(".zip")
+
+
+@contextmanager
+def open_nested_zip(zip_file, member):
+    """Open a nested archive from a seekable copy of its member.
+
+    Reading members out of order seeks backwards in the member stream, which
+    decompresses it again from the start, so the member is spooled once:
+    to memory up to NESTED_SPOOL_MEMORY_BYTES, to a temporary file otherwise.
+    """
+    info = zip_file.getinfo(member) if isinstance(member, str) else member
+    with ExitStack() as stack:
+        if info.file_size <= NESTED_SPOOL_MEMORY_BYTES:
+            spool: IO[bytes] = io.BytesIO(zip_file.read(info))
+        else:
+            spool = stack.enter_context(tempfile.TemporaryFile())
+            with zip_file.open(info) as nested_file:
+                shutil.copyfileobj(nested_file, spool, SPOOL_CHUNK_SIZE)
+            spool.seek(0)
+        yield stack.enter_context(zipfile.ZipFile(spool))
+
+
+def iter_zip_archives(zip_file, chain=()):
+    """Yield `(chain, zip_file)` for an archive and every nested archive in it.
+
+    `chain` lists the member names leading from the outer archive to the
+    nested one; nested archives stay open only while they are yielded.
+    """
+    yield chain, zip_file
+    for info in zip_file.infolist():
+        if info.is_dir() or not is_zip_member(info.filename):
+            continue
+        with open_nested_zip(zip_file, info) as nested:
+            yield from iter_zip_archives(nested, chain + (info.filename,))
+
+
+@contextmanager
+def open_zip_chain(zip_path, chain):
+    """Open the (possibly nested) archive reached from `zip_path` through `chain`."""
+    with ExitStack() as stack:
+        zip_file = stack.enter_context(zipfile.ZipFile(zip_path))
+        for member in chain:
+            zip_file = stack.enter_context(open_nested_zip(zip_file, member))
+        yield zip_file
+
+
+def logical_member_path(zip_path, chain, member):
+    """Return the path `member` would have after find_and_extract_zip."""
+    nested_dirs = [PurePosixPath(name).with_suffix("") for name in chain]
+    return PurePosixPath(Path(zip_path).stem, *nested_dirs, member)
+
+
+def zip_member_key(zip_path, chain, member):
+    """Checkpoint key of an archive member, e.g. `W1.zip::W1-I1/html/0001.html`."""
+    return KEY_SEPARATOR.join([str(zip_path), *chain, member])
+
+
+def find_zip_pages(zip_file):
+    """Pair every hOCR member of an archive with its page image member (or None).
+
+    Of several images of a page the preferred one is picked, as for work
+    folders (see image_priority).
+    """
+    html_members = []
+    image_members: Dict[str, List[PurePosixPath]] = {}
+    for name in sorted(zip_file.namelist()):
+        member = PurePosixPath(name)
+        if name.endswith("/") or is_zip_member(name):
+            continue
+        if member.suffix == ".html":
+            html_members.append(name)
+        else:
+            image_members.setdefault(member.with_suffix("").as_posix(), []).append(
+                member
+            )
+    pages = []
+    for html_member in html_members:
+        image_path = find_corresponding_image_path(PurePosixPath(html_member))
+        candidates = image_members.get(image_path.as_posix())
+        image_member = None
+        if candidates:
+            image_member = min(candidates, key=image_priority).as_posix()
+        pages.append((html_member, image_member))
+    return pages
+
+
+def process_zip_page(
+    zip_file,
+    zip_path,
+    chain,
+    html_member,
+    image_member,
+    output_base,
+    config=DEFAULT_CONFIG,
+):
+    """Crop, analyze and record the lines of a single hOCR page read from an archive."""
+    page_key = zip_member_key(zip_path, chain, html_member)
+    try:
+        with profile_page(page_key, config.profile_sample_rate, config.profile_dir):
+            count("parse_html", bytes_read=zip_file.getinfo(html_member).file_size)
+            with zip_file.open(html_member) as html_file:
+                ocr_data = parse_html(
+                    io.TextIOWrapper(html_file, encoding="utf-8"), config.html_parser
+                )
+            if ocr_data is None:  # Skip if parsing failed
+                return
+            page_path = logical_member_path(zip_path, chain, html_member)
+            image_path = find_corresponding_image_path(page_path)
+            work_id, volume_id = work_and_volume_ids(image_path)
+            ocr_data = filter_lines(ocr_data, config.line_filter)
+            if not ocr_data:  # Nothing to crop
+                save_checkpoint(page_key)
+                return
+            if image_member is None:
+                save_corrupted_files(
+                    page_key,
+                    f"No image file found for {image_path}",
+                    stage="image",
+                    error_type="FileNotFoundError",
+                )
+                return
+            image_key = zip_member_key(zip_path, chain, image_member)
+            try:
+                image_data = zip_file.read(image_member)
+                count("crop_line_images", bytes_read=len(image_data))
+                image = Image.open(io.BytesIO(image_data))
+                ocr_data = crop_line_images(
+                    image,
+                    ocr_data,
+                    line_images_dir(output_base, work_id, config),
+                    volume_id,
+                    PurePosixPath(image_member).stem,
+                    PurePosixPath(image_member).suffix,
+                    config,
+                    work_id,
+                )
+            except UnidentifiedImageError as e:
+                save_corrupted_files(
+                    image_key,
+                    f"UnidentifiedImageError {str(e)}",
+                    stage="image",
+                    error_type="UnidentifiedImageError",
+                )
+                return
+            if record_page_lines(
+                ocr_data, output_base, work_id, volume_id, image_path.name, config
+            ):
+                save_checkpoint(page_key)  # Mark as processed
+    except Exception as e:
+        save_corrupted_files(page_key, e)
+
+
+def process_zip_pages(
+    zip_path, chain, pages, checkpoints, output_base, config=DEFAULT_CONFIG
+):
+    """Process `(html_member, image_member)` pages of one archive in `chain`."""
+    with open_zip_chain(zip_path, chain) as zip_file:
+        for html_member, image_member in pages:
+            if zip_member_key(zip_path, chain, html_member) in checkpoints:
+                continue  # Skip already processed files
+            process_zip_page(
+                zip_file,
+                zip_path,
+                chain,
+                html_member,
+                image_member,
+                output_base,
+                config,
+            )
+    close_line_archives()
+    close_metadata_sinks()
+
+
+def plan_zip_volumes(zip_path):
+    """Group the pages of a work archive by volume.
+
+    Returns `{volume_key: [(chain, pages), ...]}`, where the volume key is the
+    checkpoint key of the volume and `pages` are `(html_member, image_member)`.
+    """
+    volumes: Dict[str, list] = {}
+    with zipfile.ZipFile(zip_path) as zip_file:
+        for chain, archive in iter_zip_archives(zip_file):
+            by_volume: Dict[str, list] = {}
+            for html_member, image_member in find_zip_pages(archive):
+                page_path = logical_member_path(zip_path, chain, html_member)
+                volume = page_path.parts[1] if len(page_path.parts) > 2 else ""
+                by_volume.setdefault(volume, []).append((html_member, image_member))
+            for volume, pages in by_volume.items():
+                volume_key = zip_member_key(zip_path, (), volume)
+                volumes.setdefault(volume_key, []).append((chain, pages))
+    return volumes
+
+
+def process_work_zip(zip_path, output_base, config=DEFAULT_CONFIG):
+    """Process every page of a work archive without extracting it to disk."""
+    checkpoints = load_checkpoints()
+    for volume_key, archives in plan_zip_volumes(zip_path).items():
+        if volume_key in checkpoints:
+            continue
+        for chain, pages in archives:
+            process_zip_pages(zip_path, chain, pages, checkpoints, output_base, config)
+        save_checkpoint(volume_key)
+    flush_checkpoints()
@@ -0,0 +1,14 @@
+import pytest
+
+from create_ocr_data import checkpoints
+from create_ocr_data.metadata_sink import close_metadata_sinks
+
+
+@pytest.fixture(autouse=True)
+def checkpoint_db(tmp_path, monkeypatch):
+    """Keep every test's checkpoints in its own temporary database."""
+    db_path = tmp_path / "checkpoints.sqlite3"
+    monkeypatch.setenv(checkpoints.CHECKPOINT_DB_ENV, str(db_path))
+    yield db_path
+    close_metadata_sinks()
+    checkpoints.close_checkpoint_store()
@@ -1,7 +1,9 @@
 from pathlib import Path
 
+from create_ocr_data import pipeline
 from create_ocr_data.pipeline import (
     analyze_ocr_texts,
+    classify_line,
     crop_and_save_line_images,
     parse_html,
 )
@@ -48,5 +50,24 @@ def test_analyze_ocr_texts():
         print("Failed to parse OCR data.")
 
 
+def test_analyze_ocr_texts_caches_repeated_lines(monkeypatch):
+    class CountingTokenizer:
+        calls = 0
+
+        def tokenize(self, text):
+            CountingTokenizer.calls += 1
+            return []
+
+    monkeypatch.setattr(pipeline, "_word_tokenizer", CountingTokenizer())
+    classify_line.cache_clear()
+
+    # Tibetan digits are left to botok, so these lines reach the tokenizer
+    analyze_ocr_texts([{"text": "༡༢"}, {"text": "༡༢"}, {"text": "༣"}])
+
+    assert CountingTokenizer.calls == 2
+    assert classify_line.cache_info().hits == 1
+    classify_line.cache_clear()
+
+
 if __name__ == "__main__":
     test_analyze_ocr_texts()
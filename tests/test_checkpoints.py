@@ -0,0 +1,53 @@
+from pathlib import Path
+
+from create_ocr_data.checkpoints import (
+    close_checkpoint_store,
+    flush_checkpoints,
+    import_legacy_files,
+    load_checkpoints,
+    load_corrupted_files,
+    save_checkpoint,
+    save_corrupted_files,
+)
+
+
+def test_save_and_load_checkpoints():
+    save_checkpoint(Path("/data/W1/W1-I1/html/0001.html"))
+    checkpoints = load_checkpoints()
+    assert "/data/W1/W1-I1/html/0001.html" in checkpoints  # visible before commit
+
+    flush_checkpoints()
+    close_checkpoint_store()
+    checkpoints = load_checkpoints()
+    assert "/data/W1/W1-I1/html/0001.html" in checkpoints
+    assert "/data/W1/W1-I1/html/0002.html" not in checkpoints
+    assert len(checkpoints) == 1
+
+
+def test_save_corrupted_files():
+    save_corrupted_files(Path("/data/W1/W1-I1/html/0001.html"), "bad image")
+
+    assert load_corrupted_files() == [("/data/W1/W1-I1/html/0001.html", "bad image")]
+
+
+def test_import_legacy_files(tmp_path):
+    checkpoint_file = tmp_path / "checkpoint.txt"
+    checkpoint_file.write_text("/data/W1/W1-I1/html/0001.html\n/data/W1/W1-I1\n")
+    corrupted_file = tmp_path / "corrupted_file.txt"
+    corrupted_file.write_text(
+        "/data/W1/W1-I1/html/0002.html-[Errno 2] No such file: /data/x-y\n"
+        "/data/W1/W1-I2-pool-worker-3 died\n"
+    )
+
+    import_legacy_files(checkpoint_file, corrupted_file)
+    import_legacy_files(checkpoint_file, corrupted_file)
+
+    checkpoints = load_checkpoints()
+    assert "/data/W1/W1-I1/html/0001.html" in checkpoints
+    assert "/data/W1/W1-I1" in checkpoints
+    assert load_corrupted_files() == [
+        ("/data/W1/W1-I1/html/0002.html", "[Errno 2] No such file: /data/x-y"),
+        ("/data/W1/W1-I2", "pool-worker-3 died"),
+    ]
+    assert not corrupted_file.exists()
+    assert (tmp_path / "corrupted_file.txt.imported").exists()
@@ -0,0 +1,70 @@
+import csv
+import io
+import zipfile
+
+import pytest
+
+from create_ocr_data.create_output import (
+    merge_csv_files,
+    reorganize_directory_structure,
+)
+
+
+def write_work_outputs(work_dir):
+    for folder, names in {
+        "bo/text": ["I1_0001.png", "I1_0002.png"],
+        "non_bo/number": ["I1_0003.png"],
+        "non_bo/text": ["I1_0004.png"],
+    }.items():
+        image_dir = work_dir / "filtered_images" / folder
+        image_dir.mkdir(parents=True)
+        for name in names:
+            (image_dir / name).write_bytes(b"png")
+    csv_dir = work_dir / "csv"
+    csv_dir.mkdir()
+    (csv_dir / "bo_text.csv").write_text("line_image_id,text\nI1_0001.png,a\n")
+    (csv_dir / "non_bo_text.csv").write_text("line_image_id,text\nI1_0004.png,b\n")
+
+
+def test_packages_work_outputs_without_staging_tree(tmp_path):
+    base_path, new_base_path = tmp_path / "output", tmp_path / "packaged"
+    write_work_outputs(base_path / "W1")
+
+    reorganize_directory_structure(base_path, new_base_path, num_processes=2)
+
+    with zipfile.ZipFile(new_base_path / "bo" / "text" / "W1.zip") as zipf:
+        assert sorted(zipf.namelist()) == [
+            "W1/W1.csv",
+            "W1/images/I1_0001.png",
+            "W1/images/I1_0002.png",
+        ]
+        assert zipf.getinfo("W1/images/I1_0001.png").compress_type == (
+            zipfile.ZIP_STORED
+        )
+    with zipfile.ZipFile(new_base_path / "non-bo" / "W1.zip") as zipf:
+        assert "W1/images/I1_0003.png" in zipf.namelist()
+        assert "W1/images/I1_0004.png" in zipf.namelist()
+    # Only the archives are written, no copied folders
+    assert {path.name for path in new_base_path.rglob("*") if path.is_file()} == {
+        "W1.zip"
+    }
+
+
+def test_merge_csv_files_keeps_every_row(tmp_path):
+    first, second = tmp_path / "a.csv", tmp_path / "b.csv"
+    first.write_bytes(b'id,text\r\n1,"a, b"\r\n2,c')  # no trailing newline
+    second.write_bytes(b"id,text\r\n3,d\r\n4,e\r\n")
+    out = io.BytesIO()
+
+    merge_csv_files([first, second], out)
+
+    rows = list(csv.reader(io.StringIO(out.getvalue().decode("utf-8"))))
+    assert rows == [["id", "text"], ["1", "a, b"], ["2", "c"], ["3", "d"], ["4", "e"]]
+
+
+def test_merge_csv_files_rejects_mismatched_header(tmp_path):
+    first, second = tmp_path / "a.csv", tmp_path / "b.csv"
+    first.write_text("id,text\n1,a\n")
+    second.write_text("text,id\nb,2\n")
+    with pytest.raises(ValueError, match="header"):
+        merge_csv_files([first, second], io.BytesIO())
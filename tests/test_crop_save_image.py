@@ -1,6 +1,13 @@
 from pathlib import Path
 
-from create_ocr_data.pipeline import crop_and_save_line_images, parse_html
+from PIL import Image
+
+from create_ocr_data.config import PipelineConfig
+from create_ocr_data.pipeline import (
+    crop_and_save_line_images,
+    get_encoder_pool,
+    parse_html,
+)
 
 
 def test_crop_and_save_line_images():
@@ -37,5 +44,32 @@ def test_crop_and_save_line_images():
         print("Failed to parse OCR data.")
 
 
+def test_crop_and_save_line_images_with_codec(tmp_path):
+    html_file_path = Path(
+        "./tests/test_data/work/work_volume_id/ocr/html/00000005.html"
+    )
+    image_file_path = Path("./tests/test_data/work/work_volume_id/ocr/images/00000005")
+    config = PipelineConfig(image_codec="png", grayscale=True, encoder_threads=2)
+
+    result_ocr_data = crop_and_save_line_images(
+        image_file_path, parse_html(html_file_path), tmp_path, "volume_id", config
+    )
+
+    for i, line in enumerate(result_ocr_data, start=1):
+        line_image_path = tmp_path / "volume_id0005" / f"volume_id0005_{i:04d}.png"
+        assert line["line_image_name"] == line_image_path.name
+        with Image.open(line_image_path) as line_image:
+            assert line_image.format == "PNG"
+            assert line_image.mode in ("1", "L")
+
+
+def test_encoder_pool_follows_encoder_threads():
+    pool = get_encoder_pool(PipelineConfig(encoder_threads=2))
+    assert get_encoder_pool(PipelineConfig(encoder_threads=2)) is pool
+    assert pool._max_workers == 2
+
+    assert get_encoder_pool(PipelineConfig(encoder_threads=3))._max_workers == 3
+
+
 if __name__ == "__main__":
     test_crop_and_save_line_images()
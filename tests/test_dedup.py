@@ -0,0 +1,93 @@
+import csv
+import io
+import shutil
+from pathlib import Path
+
+from PIL import Image
+
+from create_ocr_data.config import PipelineConfig
+from create_ocr_data.dedup import hash_distance, image_hash
+from create_ocr_data.multi_pipeline import process_all_works
+from create_ocr_data.pipeline import parse_html
+
+TEST_VOLUME = Path("tests/test_data/work/work_volume_id/ocr")
+
+
+def make_volume(root, work_id, volume_id):
+    volume_dir = root / work_id / f"{work_id}-{volume_id}"
+    (volume_dir / "html").mkdir(parents=True)
+    (volume_dir / "images").mkdir()
+    shutil.copy(TEST_VOLUME / "html/00000005.html", volume_dir / "html/0001.html")
+    shutil.copy(TEST_VOLUME / "images/00000005.tif", volume_dir / "images/0001.tif")
+
+
+def test_image_hash_survives_reencoding():
+    page = Image.open(TEST_VOLUME / "images/00000005.tif")
+    crops = [
+        page.crop(line["bbox"])
+        for line in parse_html(TEST_VOLUME / "html/00000005.html")
+    ]
+    buffer = io.BytesIO()
+    crops[0].convert("L").save(buffer, format="PNG")
+
+    assert image_hash(Image.open(buffer)) == image_hash(crops[0])
+    assert len({image_hash(crop) for crop in crops}) == len(crops)
+    assert all(
+        hash_distance(image_hash(crops[0]), image_hash(crop)) > 10 for crop in crops[1:]
+    )
+
+
+def read_rows(output_dir, work_id):
+    rows = []
+    for csv_file_path in (output_dir / work_id).glob(f"{work_id}_*.csv"):
+        with csv_file_path.open(newline="", encoding="utf-8") as csv_file:
+            rows.extend(csv.DictReader(csv_file))
+    return rows
+
+
+def test_reprinted_lines_are_skipped(tmp_path):
+    works = tmp_path / "works"
+    make_volume(works, "W1", "I1")
+    make_volume(works, "W2", "I2")
+    output_dir = tmp_path / "output"
+
+    process_all_works(works, output_dir, 1, config=PipelineConfig(dedup="skip"))
+
+    first, second = sorted(
+        [output_dir / "W1/images/I10001", output_dir / "W2/images/I20001"],
+        key=lambda path: not path.exists(),
+    )
+    assert len(list(first.iterdir())) == 4
+    assert not second.exists()
+
+
+def test_reprinted_lines_are_tagged_across_runs(tmp_path):
+    works = tmp_path / "works"
+    output_dir = tmp_path / "output"
+    config = PipelineConfig(dedup="tag")
+    make_volume(works, "W1", "I1")
+    process_all_works(works, output_dir, 1, config=config)
+    make_volume(works, "W2", "I2")
+    process_all_works(works, output_dir, 1, config=config)
+
+    first_rows = read_rows(output_dir, "W1")
+    assert [row["Duplicate Of"] for row in first_rows] == [""] * 4
+    assert sorted(row["Duplicate Of"] for row in read_rows(output_dir, "W2")) == sorted(
+        f"W1/{row['Line Image Name']}" for row in first_rows
+    )
+
+
+def test_same_text_on_another_image_is_not_a_duplicate(tmp_path):
+    works = tmp_path / "works"
+    make_volume(works, "W1", "I1")
+    make_volume(works, "W2", "I1")
+    # Same transcripts and line image names, but another page image
+    page = Image.open(works / "W2/W2-I1/images/0001.tif")
+    page.transpose(Image.Transpose.ROTATE_180).save(works / "W2/W2-I1/images/0001.tif")
+    output_dir = tmp_path / "output"
+
+    process_all_works(works, output_dir, 1, config=PipelineConfig(dedup="tag"))
+
+    rows = read_rows(output_dir, "W1") + read_rows(output_dir, "W2")
+    assert len(rows) == 8
+    assert [row["Duplicate Of"] for row in rows] == [""] * 8
@@ -0,0 +1,57 @@
+import io
+import json
+import os
+import zipfile
+
+from create_ocr_data.extract_zip import MANIFEST_NAME, find_and_extract_zip
+
+
+def write_work_zip(zip_path, text="page"):
+    nested = io.BytesIO()
+    with zipfile.ZipFile(nested, "w") as nested_zip:
+        nested_zip.writestr("W1-I1/html/0001.html", text)
+    with zipfile.ZipFile(zip_path, "w") as work_zip:
+        work_zip.writestr("vols.zip", nested.getvalue())
+        work_zip.writestr("info.txt", "W1")
+
+
+def test_extracts_nested_archives_and_skips_unchanged(tmp_path):
+    root_path, output_path = tmp_path / "zips", tmp_path / "out"
+    root_path.mkdir()
+    write_work_zip(root_path / "W1.zip")
+
+    find_and_extract_zip(root_path, output_path, num_processes=2)
+
+    page = output_path / "W1" / "vols" / "W1-I1" / "html" / "0001.html"
+    assert page.read_text() == "page"
+    manifest = json.loads((output_path / MANIFEST_NAME).read_text())
+    assert set(manifest) == {"W1.zip"}
+
+    marker = output_path / "W1" / "marker"
+    marker.write_text("kept")
+    os.utime(root_path / "W1.zip", ns=(0, 0))  # touched, same content
+    find_and_extract_zip(root_path, output_path, num_processes=2)
+    assert marker.exists()
+
+    write_work_zip(root_path / "W1.zip", text="new page")
+    find_and_extract_zip(root_path, output_path, num_processes=2)
+    assert not marker.exists()
+    assert page.read_text() == "new page"
+    # No temporary extraction directories are left behind
+    assert sorted(path.name for path in output_path.iterdir()) == [
+        "W1",
+        MANIFEST_NAME,
+    ]
+
+
+def test_stale_staging_is_removed_and_never_scanned(tmp_path):
+    root_path, output_path = tmp_path / "zips", tmp_path / "out"
+    root_path.mkdir()
+    write_work_zip(root_path / "W1.zip")
+    stale = output_path / ".W1.tmp-99999"
+    (stale / "vols/W1-I1/html").mkdir(parents=True)
+
+    find_and_extract_zip(root_path, output_path, num_processes=1)
+
+    assert not stale.exists()
+    assert (output_path / "W1/vols/W1-I1/html/0001.html").exists()
@@ -1,6 +1,11 @@
+import os
 from pathlib import Path
 
-from create_ocr_data.pipeline import find_corresponding_image_path
+from create_ocr_data.pipeline import (
+    ImageIndex,
+    find_corresponding_image_path,
+    find_image_files,
+)
 
 
 def test_find_corresponding_image_path():
@@ -17,3 +22,31 @@ def test_find_corresponding_image_path():
     ), "Image path does not match expected output"
 
     print("All tests passed!")
+
+
+def test_image_index_lists_each_directory_once(tmp_path, monkeypatch):
+    images_dir = tmp_path / "W1/W1-I1/images"
+    images_dir.mkdir(parents=True)
+    for name in ("0001.jpg", "0001.tif", "0002.png", "0002.JPG", "0003.xyz"):
+        (images_dir / name).write_bytes(b"")
+    html_dir = tmp_path / "W1/W1-I1/html"
+    pages = [html_dir / f"{page:04d}.html" for page in range(1, 5)]
+
+    scans = []
+    scandir = os.scandir
+    monkeypatch.setattr(os, "scandir", lambda path: scans.append(path) or scandir(path))
+    image_index = ImageIndex()
+    found = [
+        find_image_files(find_corresponding_image_path(page), image_index)
+        for page in pages
+    ]
+
+    assert scans == [images_dir]
+    assert [[image.name for image in images] for images in found] == [
+        ["0001.tif", "0001.jpg"],
+        ["0002.png", "0002.JPG"],
+        ["0003.xyz"],
+        [],
+    ]
+    # Globbing finds the same files in the same order
+    assert [find_image_files(find_corresponding_image_path(p)) for p in pages] == found
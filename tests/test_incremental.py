@@ -0,0 +1,76 @@
+import csv
+import shutil
+from collections import Counter
+from pathlib import Path
+
+from create_ocr_data.config import PipelineConfig
+from create_ocr_data.multi_pipeline import process_all_works
+
+TEST_VOLUME = Path("tests/test_data/work/work_volume_id/ocr")
+INCREMENTAL = PipelineConfig(incremental=True)
+
+
+def make_works(root, pages=("0001", "0002", "0003")):
+    volume_dir = root / "W1" / "W1-I1"
+    (volume_dir / "html").mkdir(parents=True)
+    (volume_dir / "images").mkdir()
+    for page in pages:
+        shutil.copy(
+            TEST_VOLUME / "html/00000005.html", volume_dir / f"html/{page}.html"
+        )
+        shutil.copy(
+            TEST_VOLUME / "images/00000005.tif", volume_dir / f"images/{page}.tif"
+        )
+    return root
+
+
+def page_row_counts(output_dir):
+    counts = Counter()
+    for csv_file_path in (output_dir / "W1").glob("W1_*.csv"):
+        with csv_file_path.open(newline="", encoding="utf-8") as csv_file:
+            counts.update(row["Page ID"] for row in csv.DictReader(csv_file))
+    return counts
+
+
+def test_incremental_reprocesses_only_changed_pages(tmp_path):
+    works = make_works(tmp_path / "works")
+    output_dir = tmp_path / "output"
+    process_all_works(works, output_dir, 1, config=INCREMENTAL)
+    counts = page_row_counts(output_dir)
+    assert set(counts) == {"I10001", "I10002", "I10003"}
+
+    # A moved data root does not cause any reprocessing
+    moved = tmp_path / "moved"
+    shutil.move(works, moved)
+    line_image = next((output_dir / "W1/images/I10001").iterdir())
+    line_image.unlink()
+    process_all_works(moved, output_dir, 1, config=INCREMENTAL)
+    assert not line_image.exists()
+    assert page_row_counts(output_dir) == counts
+
+    # A corrected page is reprocessed once, a removed page loses its rows
+    html_file = moved / "W1/W1-I1/html/0001.html"
+    html_file.write_text(html_file.read_text(encoding="utf-8") + "\n", "utf-8")
+    (moved / "W1/W1-I1/html/0003.html").unlink()
+    process_all_works(moved, output_dir, 1, config=INCREMENTAL)
+    assert line_image.exists()
+    assert page_row_counts(output_dir) == Counter(
+        {page: count for page, count in counts.items() if page != "I10003"}
+    )
+    assert not (output_dir / "W1/images/I10003").exists()
+
+
+def test_incremental_clears_works_that_disappeared(tmp_path):
+    works = make_works(tmp_path / "works")
+    output_dir = tmp_path / "output"
+    process_all_works(works, output_dir, 1, config=INCREMENTAL)
+    assert (output_dir / "W1/images/I10001").is_dir()
+
+    shutil.rmtree(works / "W1")
+    process_all_works(works, output_dir, 1, config=INCREMENTAL)
+    assert not (output_dir / "W1").exists()
+
+    # Its digests are gone too, so it is processed again when it comes back
+    make_works(works)
+    process_all_works(works, output_dir, 1, config=INCREMENTAL)
+    assert set(page_row_counts(output_dir)) == {"I10001", "I10002", "I10003"}
@@ -0,0 +1,47 @@
+import json
+import tarfile
+
+from create_ocr_data import line_archive
+from create_ocr_data.line_archive import ShardWriter, archive_line, close_line_archives
+
+
+def test_shard_writer_rolls_over(tmp_path):
+    writer = ShardWriter(tmp_path, "bo_text", shard_size=4096)
+    for i in range(4):
+        writer.write(f"line_{i}", {".tif": b"x" * 2000})
+    writer.close()
+
+    shards = sorted(tmp_path.glob("bo_text-*.tar"))
+    assert len(shards) == 2
+    names = [name for shard in shards for name in tarfile.open(shard).getnames()]
+    assert names == ["line_0.tif", "line_1.tif", "line_2.tif", "line_3.tif"]
+
+
+def test_archive_line(tmp_path):
+    line = {"line_image_name": "I10005_0001.tif", "image_bytes": b"image"}
+    archive_line(tmp_path, "bo_text", 1024**2, line, {"Text": "བོད་"})
+    close_line_archives()
+
+    (shard,) = tmp_path.glob("bo_text-*.tar")
+    with tarfile.open(shard) as tar:
+        assert tar.extractfile("I10005_0001.tif").read() == b"image"
+        assert json.load(tar.extractfile("I10005_0001.json")) == {"Text": "བོད་"}
+
+
+def test_tasks_continue_their_shards(tmp_path, monkeypatch):
+    names = []
+    for i in range(3):
+        line = {"line_image_name": f"I10005_000{i}.tif", "image_bytes": b"image"}
+        archive_line(tmp_path, "bo_text", 1024**2, line, {})
+        close_line_archives()
+        names += [f"I10005_000{i}.tif", f"I10005_000{i}.json"]
+
+    (shard,) = tmp_path.glob("bo_text-*.tar")
+    with tarfile.open(shard) as tar:
+        assert tar.getnames() == names
+
+    # A new process (here: an empty writer registry) starts another shard
+    monkeypatch.setattr(line_archive, "_writers", {})
+    archive_line(tmp_path, "bo_text", 1024**2, line, {})
+    close_line_archives()
+    assert len(list(tmp_path.glob("bo_text-*.tar"))) == 2
@@ -0,0 +1,18 @@
+from create_ocr_data.line_classifier import fast_line_flags, page_char_classes
+
+
+def test_fast_line_flags():
+    texts = ["༄༅། །རང་ཉིད་ངོ་སྤྲོད་", "Page 12", "Preface", "漢字", "རང་ abc", "༡༢", ""]
+    char_classes = page_char_classes(texts)
+
+    flags = [fast_line_flags(text, char_classes) for text in texts]
+
+    assert flags == [
+        (False, False, False),
+        (True, False, True),
+        (True, False, False),
+        (True, False, False),
+        None,  # Tibetan mixed with Latin goes to botok
+        None,  # Tibetan digits go to botok
+        (False, False, False),
+    ]
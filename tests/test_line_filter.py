@@ -0,0 +1,42 @@
+from pathlib import Path
+
+from create_ocr_data.config import LineFilter, PipelineConfig
+from create_ocr_data.pipeline import crop_and_save_line_images, filter_lines, parse_html
+
+TEST_VOLUME = Path("tests/test_data/work/work_volume_id/ocr")
+
+
+def test_filter_lines():
+    ocr_data = [
+        {"text": "རང་ཉིད་ངོ་སྤྲོད་", "ocr_conf": 95, "bbox": [0, 0, 100, 20]},
+        {"text": "རང་ཉིད་ངོ་སྤྲོད་", "ocr_conf": 60, "bbox": [0, 20, 100, 40]},
+        {"text": "བོད་", "ocr_conf": 99, "bbox": [0, 40, 100, 60]},
+        {"text": "རང་ཉིད་ངོ་སྤྲོད་", "ocr_conf": None, "bbox": [0, 60, 100, 80]},
+        {"text": "རང་ཉིད་ངོ་སྤྲོད་", "ocr_conf": 90, "bbox": [50, 80, 50, 100]},
+        {"text": "རང་ཉིད་ངོ་སྤྲོད་", "ocr_conf": 100, "bbox": [0, 100, 900, 120]},
+    ]
+
+    kept = filter_lines(ocr_data, LineFilter(), page_size=(800, 600))
+
+    assert [line["line_number"] for line in kept] == [1]
+    assert filter_lines(ocr_data, None) is ocr_data
+    relaxed = LineFilter(min_confidence=0, min_text_length=0, check_bbox=False)
+    assert len(filter_lines(ocr_data, relaxed)) == len(ocr_data)
+
+
+def test_filtered_lines_are_not_cropped(tmp_path):
+    ocr_data = parse_html(TEST_VOLUME / "html/00000005.html")
+    config = PipelineConfig(line_filter=LineFilter(min_text_length=15))
+    expected = filter_lines(
+        [dict(line) for line in ocr_data], config.line_filter, (3264, 5100)
+    )
+
+    result = crop_and_save_line_images(
+        TEST_VOLUME / "images/00000005", ocr_data, tmp_path, "volume_id", config
+    )
+
+    assert 0 < len(result) == len(expected) < len(ocr_data)
+    written = sorted(path.name for path in (tmp_path / "volume_id0005").iterdir())
+    assert written == sorted(
+        f"volume_id0005_{line['line_number']:04d}.tif" for line in expected
+    )
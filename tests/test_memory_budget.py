@@ -0,0 +1,72 @@
+import threading
+
+from PIL import Image, ImageDraw
+
+from create_ocr_data.memory_budget import (
+    MemoryBudget,
+    band_decodable,
+    crop_bands,
+    estimate_decoded_bytes,
+)
+
+TEST_IMAGE = "tests/test_data/work/work_volume_id/ocr/images/00000005.tif"
+BBOXES = [(10, 0, 200, 40), (0, 95, 300, 160), (50, 1990, 120, 2000)]
+
+
+def make_page(tmp_path, mode, name):
+    page = Image.new(mode, (300, 2000), "white")
+    draw = ImageDraw.Draw(page)
+    for y in range(0, 2000, 37):
+        draw.line((0, y, 300, y + 20), fill="black", width=3)
+    page.save(tmp_path / name)
+    return page
+
+
+def test_estimate_decoded_bytes_reads_only_the_header():
+    image = Image.open(TEST_IMAGE)
+    assert estimate_decoded_bytes(image) == image.width * image.height
+    assert image.tile  # Not decoded
+    assert not band_decodable(image)  # group4 decodes whole pages only
+
+
+def test_crop_bands_matches_full_decode(tmp_path):
+    for mode, name in (("1", "page.tif"), ("L", "page.tif"), ("RGB", "page.ppm")):
+        page = make_page(tmp_path, mode, name)
+        image = Image.open(tmp_path / name)
+        assert band_decodable(image)
+        crops = crop_bands(image, BBOXES, grayscale=True)
+        assert image.tile
+        for bbox, crop in zip(BBOXES, crops):
+            expected = page.crop(bbox)
+            if mode == "RGB":
+                expected = expected.convert("L")
+            assert crop.tobytes() == expected.tobytes()
+
+
+def test_memory_budget_waits_for_released_bytes():
+    budget = MemoryBudget(100)
+    reserved = threading.Event()
+    release = threading.Event()
+    acquired = threading.Event()
+
+    def hold():
+        with budget.reserve(80):
+            reserved.set()
+            release.wait()
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    reserved.wait()
+
+    def wait():
+        with budget.reserve(50):
+            acquired.set()
+
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    assert not acquired.wait(0.2)
+    release.set()
+    assert acquired.wait(5)
+    holder.join()
+    waiter.join()
+    assert budget.used.value == 0
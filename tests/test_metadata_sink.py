@@ -0,0 +1,55 @@
+import csv
+
+import pytest
+
+from create_ocr_data.checkpoints import flush_checkpoints, save_checkpoint
+from create_ocr_data.metadata_sink import MetadataSink, get_metadata_sink
+
+
+def test_rows_are_buffered_until_flush(tmp_path):
+    csv_path = tmp_path / "W1.csv"
+    sink = MetadataSink(flush_rows=3)
+    sink.add_csv_rows(csv_path, ["a", "b"], [[1, 2]])
+    assert csv_path.read_bytes() == b"a,b\r\n"
+
+    sink.add_csv_rows(csv_path, ["a", "b"], [[3, 4], [5, 6]])  # reaches flush_rows
+    sink.add_csv_rows(csv_path, ["a", "b"], [[7, 8]])
+    sink.close()
+
+    with csv_path.open(newline="") as csv_file:
+        rows = list(csv.reader(csv_file))
+    assert rows == [["a", "b"], ["1", "2"], ["3", "4"], ["5", "6"], ["7", "8"]]
+
+
+def test_checkpoint_commit_flushes_sinks(tmp_path):
+    csv_path = tmp_path / "W1.csv"
+    get_metadata_sink(flush_rows=100).add_csv_rows(csv_path, ["a"], [["x"]])
+    save_checkpoint("page")
+    flush_checkpoints()
+    assert csv_path.read_bytes() == b"a\r\nx\r\n"
+
+
+def test_parquet_records_are_typed(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    sink = MetadataSink(parquet=True)
+    record = {
+        "work_id": "W1",
+        "volume_id": "I1",
+        "page_id": "I10005",
+        "line_image_name": "I10005_0001.tif",
+        "ocr_conf": None,
+        "tib_num": False,
+        "non_bo_word": True,
+        "non_bo_num": False,
+        "text_length": 12,
+        "text": "Chapter text",
+    }
+    sink.add_parquet_records(tmp_path / "metadata", [record, record])
+    sink.close()
+
+    (part,) = (tmp_path / "metadata").glob("*.parquet")
+    table = pq.read_table(part)
+    assert table.num_rows == 2
+    assert str(table.schema.field("ocr_conf").type) == "int16"
+    assert str(table.schema.field("non_bo_word").type) == "bool"
+    assert table.column("ocr_conf").null_count == 2
@@ -0,0 +1,29 @@
+import json
+
+from create_ocr_data.metrics import RunMetrics, count, drain_metrics, timed_stage
+
+
+@timed_stage("parse")
+def parse(lines):
+    count("parse", pages=1, lines=lines)
+
+
+def test_metrics_are_drained_and_exported(tmp_path):
+    drain_metrics()
+    parse(3)
+    parse(4)
+    pid, stages = drain_metrics()
+    assert stages["parse"]["calls"] == 2
+    assert stages["parse"]["lines"] == 7
+    assert drain_metrics() == (pid, {})
+
+    run_metrics = RunMetrics()
+    run_metrics.add((pid, stages))
+    run_metrics.add((pid + 1, stages))
+    run_metrics.export(tmp_path)
+
+    summary = json.loads((tmp_path / "metrics.json").read_text())
+    assert summary["stages"]["parse"]["pages"] == 4
+    assert set(summary["workers"]) == {str(pid), str(pid + 1)}
+    prom = (tmp_path / "metrics.prom").read_text()
+    assert 'create_ocr_data_stage_lines_total{stage="parse"} 14' in prom
@@ -0,0 +1,56 @@
+import os
+import shutil
+import signal
+from pathlib import Path
+
+from create_ocr_data import multi_pipeline
+from create_ocr_data.checkpoints import load_checkpoints, load_failures
+from create_ocr_data.multi_pipeline import process_all_works
+
+TEST_VOLUME = Path("tests/test_data/work/work_volume_id/ocr")
+
+
+def make_volume(volume_dir):
+    (volume_dir / "html").mkdir(parents=True)
+    (volume_dir / "images").mkdir()
+    shutil.copy(TEST_VOLUME / "html/00000005.html", volume_dir / "html/0001.html")
+    shutil.copy(TEST_VOLUME / "images/00000005.tif", volume_dir / "images/0001.tif")
+    return volume_dir
+
+
+def test_hidden_staging_dirs_are_not_works(tmp_path):
+    make_volume(tmp_path / "works/W1/W1-I1")
+    make_volume(tmp_path / "works/.W1.tmp-12345/W1-I1")
+
+    process_all_works(tmp_path / "works", tmp_path / "output", 1)
+
+    csv_text = (tmp_path / "output/W1/W1_90-100%.csv").read_text(encoding="utf-8")
+    assert len(csv_text.splitlines()) == 5
+
+
+def test_failing_tasks_do_not_hang_the_run(tmp_path, monkeypatch):
+    volume_dir = make_volume(tmp_path / "works/W1/W1-I1")
+    parent_pid = os.getpid()
+    flush_checkpoints = multi_pipeline.flush_checkpoints
+
+    def flush_in_parent_only():
+        if os.getpid() != parent_pid:
+            raise RuntimeError("checkpoint store unavailable")
+        flush_checkpoints()
+
+    monkeypatch.setattr(multi_pipeline, "flush_checkpoints", flush_in_parent_only)
+
+    def hung(signum, frame):
+        raise TimeoutError("process_all_works hung on a failed task")
+
+    signal.signal(signal.SIGALRM, hung)
+    signal.alarm(60)
+    try:
+        process_all_works(tmp_path / "works", tmp_path / "output", 1)
+    finally:
+        signal.alarm(0)
+
+    assert [failure["stage"] for failure in load_failures()] == ["volume"]
+    checkpoints = load_checkpoints()
+    assert str(volume_dir) not in checkpoints
+    assert str(volume_dir.parent) not in checkpoints
@@ -0,0 +1,48 @@
+import shutil
+from pathlib import Path
+
+from create_ocr_data.checkpoints import load_checkpoints
+from create_ocr_data.config import PipelineConfig
+from create_ocr_data.page_pipeline import process_html_files_staged
+from create_ocr_data.pipeline import process_html_files
+
+TEST_VOLUME = Path("tests/test_data/work/work_volume_id/ocr")
+
+
+def make_volume(root):
+    volume_dir = root / "W1" / "W1-I1"
+    (volume_dir / "html").mkdir(parents=True)
+    (volume_dir / "images").mkdir()
+    for page in ("0001", "0002", "0003"):
+        shutil.copy(
+            TEST_VOLUME / "html/00000005.html", volume_dir / f"html/{page}.html"
+        )
+        shutil.copy(
+            TEST_VOLUME / "images/00000005.tif", volume_dir / f"images/{page}.tif"
+        )
+    (volume_dir / "images/0003.tif").unlink()  # A page without its image
+    return sorted((volume_dir / "html").glob("*.html"))
+
+
+def output_files(output_dir):
+    return {
+        path.relative_to(output_dir): path.read_bytes()
+        for path in output_dir.rglob("*")
+        if path.is_file()
+    }
+
+
+def test_staged_pipeline_matches_serial_run(tmp_path):
+    html_files = make_volume(tmp_path / "works")
+    serial_dir, staged_dir = tmp_path / "serial", tmp_path / "staged"
+
+    process_html_files(html_files, (), serial_dir)
+    process_html_files_staged(
+        html_files, (), staged_dir, PipelineConfig(pipeline_depth=1)
+    )
+
+    assert output_files(staged_dir) == output_files(serial_dir)
+    assert (staged_dir / "W1" / "images" / "I10002").is_dir()
+    checkpoints = load_checkpoints()
+    assert str(html_files[1]) in checkpoints
+    assert str(html_files[2]) not in checkpoints
@@ -1,6 +1,10 @@
+import shutil
 from pathlib import Path
 
-from create_ocr_data.pipeline import parse_html
+import pytest
+
+from create_ocr_data.config import PipelineConfig
+from create_ocr_data.pipeline import parse_html, process_html_files
 
 
 def test_parse_html():
@@ -35,3 +39,28 @@ def test_parse_html():
     # You can add more assertions here for the rest of the lines or for specific properties you care about
 
     print("All tests passed!")
+
+
+def test_parse_html_stream_matches_bs4():
+    html_path = Path("tests/test_data/work/work_volume_id/ocr/html/00000005.html")
+
+    assert parse_html(html_path, parser="stream") == parse_html(html_path)
+
+
+def test_html_parser_is_selected_by_config(tmp_path):
+    with pytest.raises(ValueError):
+        PipelineConfig(html_parser="lxml")
+    volume_dir = tmp_path / "W1/W1-I1"
+    shutil.copytree("tests/test_data/work/work_volume_id/ocr", volume_dir)
+    outputs = []
+    for parser in ("bs4", "stream"):
+        output_dir = tmp_path / parser
+        config = PipelineConfig(html_parser=parser)
+        process_html_files([volume_dir / "html/00000005.html"], (), output_dir, config)
+        outputs.append((output_dir / "W1/W1_90-100%.csv").read_text(encoding="utf-8"))
+    assert len(outputs[0].splitlines()) == 5
+    assert outputs[0] == outputs[1]
+
+
+def test_parse_html_missing_page_returns_none(tmp_path):
+    assert parse_html(tmp_path / "missing.html") is None
@@ -0,0 +1,89 @@
+import csv
+import shutil
+from pathlib import Path
+
+from create_ocr_data.checkpoints import load_failures, save_corrupted_files
+from create_ocr_data.cli import main
+from create_ocr_data.retry import due_pages, failed_page
+
+TEST_VOLUME = Path("tests/test_data/work/work_volume_id/ocr")
+
+
+def make_work(works, pages=3):
+    volume_dir = works / "W1" / "W1-I1"
+    (volume_dir / "html").mkdir(parents=True)
+    (volume_dir / "images").mkdir()
+    for page in range(1, pages + 1):
+        shutil.copy(
+            TEST_VOLUME / "html/00000005.html", volume_dir / f"html/{page:04d}.html"
+        )
+        shutil.copy(
+            TEST_VOLUME / "images/00000005.tif", volume_dir / f"images/{page:04d}.tif"
+        )
+    return volume_dir
+
+
+def test_failed_page_maps_images_to_their_page():
+    assert failed_page("/c/W1/W1-I1/images/0002") == failed_page(
+        "/c/W1/W1-I1/html/0002.html"
+    )
+    assert failed_page("/c/W1/W1-I1/html/0002.html") == (
+        "/c/W1",
+        "/c/W1/W1-I1",
+        None,
+        "/c/W1/W1-I1/html/0002.html",
+    )
+    assert failed_page("W1.zip::W1-I1/images/0002.tif") == (
+        "W1.zip",
+        "W1.zip::W1-I1",
+        (),
+        "W1-I1/html/0002.html",
+    )
+    assert failed_page("W1.zip") is None
+
+
+def test_due_pages_backs_off_and_gives_up():
+    failure = {"path": "/c/W1/W1-I1/html/0001.html", "last_failed_at": 100.0}
+    for attempts, now, due in [
+        (1, 109, False),
+        (1, 110, True),
+        (3, 129, False),
+        (3, 130, True),
+    ]:
+        pages, _, _ = due_pages([{**failure, "attempts": attempts}], now, 10, 30, 5)
+        assert bool(pages) == due
+    pages, waiting, given_up = due_pages([{**failure, "attempts": 5}], 1e9, 10, 30, 5)
+    assert (pages, waiting, given_up) == ({}, 0, 1)
+
+
+def test_retry_failed_reprocesses_only_failed_pages(tmp_path):
+    volume_dir = make_work(tmp_path / "works")
+    (volume_dir / "images/0002.tif").write_bytes(b"not an image")
+    output_dir = tmp_path / "output"
+    main(["process", str(tmp_path / "works"), str(output_dir), "--processes", "1"])
+
+    (failure,) = load_failures()
+    assert failure["path"] == str(volume_dir / "images/0002")
+    assert (failure["stage"], failure["error_type"]) == (
+        "image",
+        "UnidentifiedImageError",
+    )
+    assert failure["attempts"] == 1
+    save_corrupted_files(volume_dir / "images/0002", "still not an image", "image")
+    assert load_failures()[0]["attempts"] == 2
+
+    # Still within its backoff
+    main(["retry-failed", str(output_dir), "--processes", "1"])
+    assert len(load_failures()) == 1
+
+    shutil.copy(TEST_VOLUME / "images/00000005.tif", volume_dir / "images/0002.tif")
+    first_page_dir = output_dir / "W1/images/I10001"
+    first_page_mtime = first_page_dir.stat().st_mtime_ns
+    argv = ["retry-failed", str(output_dir), "--processes", "1"]
+    main(argv + ["--backoff-seconds", "0"])
+
+    assert load_failures() == []
+    assert first_page_dir.stat().st_mtime_ns == first_page_mtime
+    with open(output_dir / "W1/csv/bo_text.csv", newline="", encoding="utf-8") as f:
+        page_ids = [row["Page ID"] for row in csv.DictReader(f)]
+    assert sorted(page_ids) == ["I10001"] * 4 + ["I10002"] * 4 + ["I10003"] * 4
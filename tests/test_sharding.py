@@ -0,0 +1,74 @@
+import csv
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from create_ocr_data.cli import main
+from create_ocr_data.sharding import assign_shards
+
+TEST_VOLUME = Path("tests/test_data/work/work_volume_id/ocr")
+WORK_PAGES = {"W1": 3, "W2": 1, "W3": 2, "W4": 2}
+
+
+def make_works(root):
+    for work_id, pages in WORK_PAGES.items():
+        volume_dir = root / work_id / f"{work_id}-I{work_id[1:]}"
+        (volume_dir / "html").mkdir(parents=True)
+        (volume_dir / "images").mkdir()
+        for page in range(1, pages + 1):
+            shutil.copy(
+                TEST_VOLUME / "html/00000005.html", volume_dir / f"html/{page:04d}.html"
+            )
+            shutil.copy(
+                TEST_VOLUME / "images/00000005.tif",
+                volume_dir / f"images/{page:04d}.tif",
+            )
+    return root
+
+
+def test_assign_shards_is_stable_and_balanced():
+    weights = {f"W{i}": pages for i, pages in enumerate([50, 40, 30, 20, 10, 10, 5])}
+    assignment = assign_shards(weights, 3)
+
+    assert assign_shards(dict(reversed(weights.items())), 3) == assignment
+    loads = [0, 0, 0]
+    for work_id, shard in assignment.items():
+        loads[shard] += weights[work_id]
+    assert max(loads) - min(loads) <= 10
+
+
+def test_shards_run_as_separate_processes_and_merge(tmp_path):
+    works = make_works(tmp_path / "works")
+    nodes = []
+    for shard_index in range(2):
+        node_dir = tmp_path / f"node{shard_index}"
+        env = dict(os.environ, PYTHONPATH="src")
+        env["CREATE_OCR_DATA_CHECKPOINT_DB"] = str(node_dir / "checkpoints.sqlite3")
+        command = [sys.executable, "-m", "create_ocr_data.cli", "process"]
+        command += [str(works), str(node_dir), "--processes", "1"]
+        command += ["--shard-index", str(shard_index), "--shard-count", "2"]
+        nodes.append((node_dir, subprocess.Popen(command, env=env)))
+    for _, node in nodes:
+        assert node.wait(timeout=120) == 0
+    node_dirs = [str(node_dir) for node_dir, _ in nodes]
+    merged_dir = tmp_path / "merged"
+
+    with pytest.raises(ValueError):
+        main(["merge", node_dirs[0], "--out", str(merged_dir)])
+    main(["merge", *node_dirs, "--out", str(merged_dir), "--processes", "1"])
+
+    node_works = [
+        {path.name for path in Path(node_dir).iterdir() if path.is_dir()}
+        for node_dir in node_dirs
+    ]
+    assert all(node_works) and set.union(*node_works) == set(WORK_PAGES)
+    assert not set.intersection(*node_works)
+    with open(merged_dir / "csv/bo_text.csv", newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 4 * sum(WORK_PAGES.values())
+    for work_id in WORK_PAGES:
+        assert (merged_dir / f"archives/bo/text/{work_id}.zip").exists()
@@ -0,0 +1,43 @@
+import csv
+
+from create_ocr_data.config import PipelineConfig
+from create_ocr_data.pipeline import route_page_lines
+
+
+def test_route_page_lines(tmp_path):
+    page_dir = tmp_path / "images" / "I10005"
+    page_dir.mkdir(parents=True)
+    ocr_data = []
+    for i, (text, ocr_conf) in enumerate(
+        [
+            ("རང་ཉིད་ངོ་སྤྲོད་", 100),
+            ("Chapter 12 text", 95),
+            ("བོད་", 100),
+            ("རྩོམ་པ་པོ།་་་", 60),
+        ],
+        start=1,
+    ):
+        (page_dir / f"I10005_{i:04d}.tif").write_bytes(b"image")
+        non_bo = text.isascii()
+        ocr_data.append(
+            {
+                "text": text,
+                "ocr_conf": ocr_conf,
+                "image_page_id": "I10005",
+                "line_image_name": f"I10005_{i:04d}.tif",
+                "text length": len(text),
+                "tib_num": False,
+                "non_bo_word": non_bo,
+                "non_bo_num": non_bo,
+            }
+        )
+
+    route_page_lines(ocr_data, tmp_path, "W1", "I1", PipelineConfig(single_pass=True))
+
+    bo_text = tmp_path / "filtered_images" / "bo" / "text" / "I10005_0001.tif"
+    assert bo_text.stat().st_nlink == 2  # hardlinked, not copied
+    assert (tmp_path / "filtered_images/non_bo/number/I10005_0002.tif").exists()
+    assert not (tmp_path / "filtered_images/bo/text/I10005_0003.tif").exists()
+    with open(tmp_path / "csv" / "bo_text.csv", encoding="utf-8") as csv_file:
+        rows = list(csv.DictReader(csv_file))
+    assert [row["Line Image Name"] for row in rows] == ["I10005_0001.tif"]
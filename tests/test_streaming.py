@@ -0,0 +1,109 @@
+import shutil
+import threading
+import zipfile
+from pathlib import Path
+
+from create_ocr_data.checkpoints import load_checkpoints, load_corrupted_files
+from create_ocr_data.cli import main
+from create_ocr_data.streaming import WorkAdmission
+
+TEST_VOLUME = Path("tests/test_data/work/work_volume_id/ocr")
+
+
+def make_work_zip(
+    zip_dir, work_id, volume_id="I1", pages=("0001", "0002"), broken_pages=()
+):
+    zip_dir.mkdir(parents=True, exist_ok=True)
+    with zipfile.ZipFile(zip_dir / f"{work_id}.zip", "w") as zip_file:
+        for page in pages:
+            volume = f"{work_id}-{volume_id}"
+            zip_file.write(
+                TEST_VOLUME / "html/00000005.html", f"{volume}/html/{page}.html"
+            )
+            image_name = f"{volume}/images/{page}.tif"
+            if page in broken_pages:
+                zip_file.writestr(image_name, b"not an image")
+            else:
+                zip_file.write(TEST_VOLUME / "images/00000005.tif", image_name)
+
+
+def test_run_packages_every_work(tmp_path):
+    zip_dir = tmp_path / "zips"
+    make_work_zip(zip_dir, "W1")
+    make_work_zip(zip_dir, "W2")
+    (zip_dir / "W3.zip").write_bytes(b"not a zip")
+    data_dir = tmp_path / "data"
+    argv = ["run", str(data_dir), "--zip-dir", str(zip_dir)]
+    argv += ["--processes", "1", "--extract-workers", "1", "--package-workers", "1"]
+    argv += ["--works-in-flight", "2"]
+
+    main(argv)
+
+    for work_id in ("W1", "W2"):
+        with zipfile.ZipFile(data_dir / f"outputs_new/bo/text/{work_id}.zip") as out:
+            names = out.namelist()
+        assert f"{work_id}/{work_id}.csv" in names
+        assert len([name for name in names if "/images/" in name]) == 8
+    assert [path for path, _ in load_corrupted_files()] == ["W3.zip"]
+    assert list((data_dir / "extracted_data").iterdir()) == []
+    assert (zip_dir / "W1.zip").exists()  # Local ZIPs are inputs, not intermediates
+
+    # Packaged works are skipped on the next run
+    (data_dir / "outputs_new/bo/text/W1.zip").unlink()
+    main(argv)
+    assert not (data_dir / "outputs_new/bo/text/W1.zip").exists()
+
+
+def test_recycled_page_workers(tmp_path):
+    zip_dir = tmp_path / "zips"
+    make_work_zip(zip_dir, "W1")
+    data_dir = tmp_path / "data"
+    argv = ["run", str(data_dir), "--zip-dir", str(zip_dir), "--processes", "1"]
+    argv += ["--max-tasks-per-child", "1", "--memory-budget-mb", "256"]
+
+    main(argv)
+
+    assert "stream:W1.zip" in load_checkpoints()
+
+
+def test_admission_waits_for_room(tmp_path):
+    admission = WorkAdmission(tmp_path, works_in_flight=2, min_free_bytes=0)
+    admission.admit(0)
+    admission.admit(0)
+    waiting = threading.Thread(target=admission.admit, args=(0,))
+    waiting.start()
+    waiting.join(0.2)
+    assert waiting.is_alive()
+    admission.finish()
+    waiting.join(5)
+    assert not waiting.is_alive()
+
+    # A footprint that would eat into the free space waits while works are in flight
+    admission.finish()
+    assert admission.has_room(0)
+    assert not admission.has_room(2 * shutil.disk_usage(tmp_path).free)
+
+
+def test_works_with_failed_pages_are_kept_for_retry(tmp_path):
+    zip_dir = tmp_path / "zips"
+    make_work_zip(zip_dir, "W1", broken_pages=("0002",))
+    data_dir = tmp_path / "data"
+    argv = ["run", str(data_dir), "--zip-dir", str(zip_dir)]
+    argv += ["--processes", "1", "--extract-workers", "1", "--package-workers", "1"]
+
+    main(argv)
+
+    volume_dir = data_dir / "extracted_data/W1/W1/W1-I1"
+    assert (volume_dir / "html/0002.html").exists()
+    assert "stream:W1.zip" not in load_checkpoints()
+    assert not (data_dir / "outputs_new/bo/text/W1.zip").exists()
+
+    shutil.copy(TEST_VOLUME / "images/00000005.tif", volume_dir / "images/0002.tif")
+    retry = ["retry-failed", str(data_dir / "output_data"), "--processes", "1"]
+    main(retry + ["--backoff-seconds", "0"])
+    main(argv)
+
+    assert "stream:W1.zip" in load_checkpoints()
+    with zipfile.ZipFile(data_dir / "outputs_new/bo/text/W1.zip") as out:
+        assert len([name for name in out.namelist() if "/images/" in name]) == 8
+    assert list((data_dir / "extracted_data").iterdir()) == []
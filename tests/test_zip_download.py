@@ -0,0 +1,125 @@
+import hashlib
+
+import pytest
+
+from create_ocr_data.checkpoints import load_checkpoints
+from create_ocr_data.zip_download import download_file, download_files, list_zip_files
+
+
+class FakeResponse(dict):
+    def __init__(self, status, headers=()):
+        super().__init__(headers)
+        self.status = status
+
+
+class FakeHttp:
+    """Serves byte ranges of in-memory files like the Drive media endpoint."""
+
+    def __init__(self, contents):
+        self.contents = contents
+        self.ranges = []
+
+    def request(self, uri, headers):
+        content = self.contents[uri]
+        start, end = map(int, headers["range"][len("bytes=") :].split("-"))
+        self.ranges.append((uri, start))
+        if start >= len(content):
+            return FakeResponse(416), b""
+        chunk = content[start : end + 1]
+        content_range = f"bytes {start}-{start + len(chunk) - 1}/{len(content)}"
+        return FakeResponse(206, {"content-range": content_range}), chunk
+
+
+class FakeMediaRequest:
+    def __init__(self, http, uri):
+        self.http = http
+        self.uri = uri
+        self.headers = {}
+
+
+class FakeListRequest:
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self):
+        return self.result
+
+
+class FakeFiles:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, pageToken=None, **kwargs):
+        page = int(pageToken or 0)
+        result = {"files": self.service.pages[page]}
+        if page + 1 < len(self.service.pages):
+            result["nextPageToken"] = str(page + 1)
+        return FakeListRequest(result)
+
+    def get_media(self, fileId):
+        return FakeMediaRequest(self.service.http, fileId)
+
+
+class FakeDriveService:
+    def __init__(self, contents, page_size=2):
+        self.http = FakeHttp(contents)
+        files = [
+            {
+                "id": name,
+                "name": name,
+                "size": str(len(content)),
+                "md5Checksum": hashlib.md5(content).hexdigest(),
+            }
+            for name, content in contents.items()
+        ]
+        self.pages = [
+            files[start : start + page_size]
+            for start in range(0, len(files), page_size)
+        ]
+
+    def files(self):
+        return FakeFiles(self)
+
+
+def test_list_zip_files_follows_pages():
+    service = FakeDriveService({f"W{i}.zip": b"zip" for i in range(5)})
+    names = [file["name"] for file in list_zip_files(service, "folder")]
+    assert names == [f"W{i}.zip" for i in range(5)]
+
+
+def test_download_resumes_partial_file(tmp_path):
+    content = bytes(range(256)) * 40
+    service = FakeDriveService({"W1.zip": content})
+    (file,) = list_zip_files(service, "folder")
+    (tmp_path / "W1.zip.part").write_bytes(content[:1000])
+
+    path = download_file(service, file, tmp_path, chunk_size=4096)
+
+    assert path.read_bytes() == content
+    assert service.http.ranges[0] == ("W1.zip", 1000)
+    assert not (tmp_path / "W1.zip.part").exists()
+
+
+def test_download_rejects_corrupt_partial_file(tmp_path):
+    content = b"x" * 5000
+    service = FakeDriveService({"W1.zip": content})
+    (file,) = list_zip_files(service, "folder")
+    (tmp_path / "W1.zip.part").write_bytes(b"y" * 1000)
+
+    with pytest.raises(ValueError, match="md5"):
+        download_file(service, file, tmp_path, chunk_size=4096)
+    assert not (tmp_path / "W1.zip").exists()
+    assert not (tmp_path / "W1.zip.part").exists()
+
+
+def test_download_files_checkpoints_verified_files(tmp_path):
+    contents = {f"W{i}.zip": f"work {i}".encode() * 100 for i in range(4)}
+    service = FakeDriveService(contents)
+    files = list_zip_files(service, "folder")
+
+    download_files(lambda: service, files, tmp_path, num_workers=3, chunk_size=256)
+
+    checkpoints = load_checkpoints()
+    for name, content in contents.items():
+        assert (tmp_path / name).read_bytes() == content
+        assert name in checkpoints
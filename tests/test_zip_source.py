@@ -0,0 +1,71 @@
+import zipfile
+from pathlib import Path, PurePosixPath
+
+from create_ocr_data import zip_source
+from create_ocr_data.zip_source import (
+    find_zip_pages,
+    iter_zip_archives,
+    logical_member_path,
+    open_zip_chain,
+    zip_member_key,
+)
+
+TEST_VOLUME = Path("tests/test_data/work/work_volume_id/ocr")
+
+
+def make_work_zip(tmp_path):
+    inner_zip = tmp_path / "inner.zip"
+    with zipfile.ZipFile(inner_zip, "w") as zip_file:
+        zip_file.write(TEST_VOLUME / "html/00000005.html", "W1-I2/html/0001.html")
+    work_zip = tmp_path / "W1.zip"
+    with zipfile.ZipFile(work_zip, "w") as zip_file:
+        zip_file.write(TEST_VOLUME / "html/00000005.html", "W1-I1/html/0001.html")
+        zip_file.write(TEST_VOLUME / "images/00000005.tif", "W1-I1/images/0001.tif")
+        zip_file.write(inner_zip, "nested/inner.zip")
+    return work_zip
+
+
+def test_find_zip_pages(tmp_path):
+    work_zip = make_work_zip(tmp_path)
+    with zipfile.ZipFile(work_zip) as zip_file:
+        archives = {
+            chain: find_zip_pages(archive)
+            for chain, archive in iter_zip_archives(zip_file)
+        }
+
+    assert archives == {
+        (): [("W1-I1/html/0001.html", "W1-I1/images/0001.tif")],
+        ("nested/inner.zip",): [("W1-I2/html/0001.html", None)],
+    }
+
+
+def test_find_zip_pages_prefers_image_extensions(tmp_path):
+    work_zip = tmp_path / "W1.zip"
+    with zipfile.ZipFile(work_zip, "w") as zip_file:
+        zip_file.write(TEST_VOLUME / "html/00000005.html", "W1-I1/html/0001.html")
+        for suffix in (".jpg", ".png", ".tif"):
+            zip_file.writestr(f"W1-I1/images/0001{suffix}", b"")
+    with zipfile.ZipFile(work_zip) as zip_file:
+        pages = find_zip_pages(zip_file)
+
+    assert pages == [("W1-I1/html/0001.html", "W1-I1/images/0001.tif")]
+
+
+def test_logical_member_path():
+    assert logical_member_path(
+        Path("/data/W1.zip"), ("nested/inner.zip",), "W1-I2/html/0001.html"
+    ) == PurePosixPath("W1/nested/inner/W1-I2/html/0001.html")
+    assert (
+        zip_member_key("/data/W1.zip", ("nested/inner.zip",), "W1-I2/html/0001.html")
+        == "/data/W1.zip::nested/inner.zip::W1-I2/html/0001.html"
+    )
+
+
+def test_nested_archives_are_spooled_to_seekable_files(tmp_path, monkeypatch):
+    work_zip = make_work_zip(tmp_path)
+    expected = (TEST_VOLUME / "html/00000005.html").read_bytes()
+    for spool_memory_bytes in (0, zip_source.NESTED_SPOOL_MEMORY_BYTES):
+        monkeypatch.setattr(zip_source, "NESTED_SPOOL_MEMORY_BYTES", spool_memory_bytes)
+        with open_zip_chain(work_zip, ("nested/inner.zip",)) as zip_file:
+            assert not isinstance(zip_file.fp, zipfile.ZipExtFile)
+            assert zip_file.read("W1-I2/html/0001.html") == expected